@@ -0,0 +1,236 @@
+#!/usr/bin/python
+import os, sys, argparse, json, time, math, platform, subprocess, tempfile
+import numpy as np
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--output", type=str, default="benchmark.json", help="results file to write")
+parser.add_argument("--baseline", type=str, help="if provided, results are compared with it")
+parser.add_argument("--compare", type=str, help="compare existing results with the baseline without running")
+parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percents")
+parser.add_argument("--cases", type=str, default="", help="semicolon separated parts of case names to run")
+parser.add_argument("--repeat", type=int, default=3, help="runs of every case, the fastest one is kept")
+parser.add_argument("--quick", action="store_true", help="skip the biggest inputs")
+parser.add_argument("--work_directory", type=str, help="generated inputs are kept there between runs")
+arguments = parser.parse_args()
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+if arguments.work_directory == None:
+	arguments.work_directory = os.path.join(tempfile.gettempdir(), "quake-mapping-tools-benchmark")
+os.makedirs(arguments.work_directory, exist_ok=True)
+
+
+
+# writing generated meshes in the same layout as Blender exports
+def write_obj_file(path, objects):
+	with open(path, "w") as output_file:
+		vertex_count = 0
+		for name, vertices, faces, material, smooth_group in objects:
+			output_file.write(f"o {name}\n")
+			output_file.write("".join([f"v {' '.join([f'{value:.6f}' for value in vertex])}\n" for vertex in vertices.tolist()]))
+			if material != None:
+				output_file.write(f"usemtl {material}\n")
+			output_file.write(f"s {smooth_group}\n")
+			faces = (faces + vertex_count + 1).tolist()
+			output_file.write("".join([f"f {' '.join([str(index) for index in face])}\n" for face in faces]))
+			vertex_count += len(vertices)
+
+def get_icosphere(level):
+	t = (1.0 + math.sqrt(5.0)) / 2.0
+	vertices = np.array([
+		[-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+		[0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+		[t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1]], dtype=np.float64)
+	triangles = np.array([
+		[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+		[1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+		[3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+		[4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1]], dtype=np.int64)
+	for iteration in range(level):
+		# every edge gets a single midpoint shared by both of its triangles
+		edges = np.sort(np.stack((triangles, triangles[:, [1, 2, 0]]), axis=2).reshape(-1, 2), axis=1)
+		edges, midpoints = np.unique(edges, axis=0, return_inverse=True)
+		midpoints = midpoints.reshape(-1, 3) + len(vertices)
+		vertices = np.concatenate((vertices, (vertices[edges[:, 0]] + vertices[edges[:, 1]]) * 0.5))
+		a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+		ab, bc, ca = midpoints[:, 0], midpoints[:, 1], midpoints[:, 2]
+		triangles = np.concatenate((np.stack((a, ab, ca), axis=1), np.stack((b, bc, ab), axis=1), np.stack((c, ca, bc), axis=1), np.stack((ab, bc, ca), axis=1)))
+	vertices /= np.linalg.norm(vertices, axis=1)[:, None]
+	return vertices * 8.0, triangles
+
+def get_grid(size, height_scale = 1.0):
+	x, z = np.meshgrid(np.arange(size + 1, dtype=np.float64), np.arange(size + 1, dtype=np.float64))
+	y = np.sin(x * 0.3) * np.cos(z * 0.2) * height_scale
+	vertices = np.stack((x.reshape(-1), y.reshape(-1), z.reshape(-1)), axis=1) * 0.25
+	corners = (np.arange(size)[:, None] * (size + 1) + np.arange(size)[None, :]).reshape(-1)
+	faces = np.stack((corners, corners + 1, corners + size + 2, corners + size + 1), axis=1)
+	return vertices, faces
+
+def create_icosphere(path, level):
+	vertices, triangles = get_icosphere(level)
+	write_obj_file(path, [("Icosphere", vertices, triangles, "STONE", 1)])
+
+def create_convex_icosphere(path, level):
+	vertices, triangles = get_icosphere(level)
+	write_obj_file(path, [("Icosphere-convex", vertices, triangles, "STONE", 1)])
+
+def create_object_scene(path, object_count, material_count):
+	random = np.random.default_rng(1)
+	vertices, triangles = get_icosphere(1)
+	objects = []
+	for index in range(object_count):
+		offset = random.uniform(-200.0, 200.0, 3)
+		material = f"material_{index % material_count}"
+		objects.append((f"Object.{index:05d}", vertices * 0.25 + offset, triangles, material, index % 4))
+	write_obj_file(path, objects)
+
+def create_vertex_color_grid(path, size, color_count):
+	random = np.random.default_rng(2)
+	vertices, faces = get_grid(size)
+	palette = random.integers(0, 256, (color_count, 3)) / 255.0
+	colors = palette[(np.arange(len(vertices)) // 7) % color_count]
+	write_obj_file(path, [("Colored", np.column_stack((vertices, colors)), faces, None, 0)])
+
+def create_path_scene(path, path_count, path_length):
+	random = np.random.default_rng(3)
+	with open(path, "w") as output_file:
+		vertex_count = 0
+		for index in range(path_count):
+			points = np.cumsum(random.uniform(-1.0, 1.0, (path_length, 3)), axis=0)
+			output_file.write(f"o Path.{index:05d}\n")
+			output_file.write("".join([f"v {x:.6f} {y:.6f} {z:.6f}\n" for x, y, z in points.tolist()]))
+			indices = range(vertex_count + 1, vertex_count + path_length + 1)
+			output_file.write("l " + " ".join([str(index) for index in indices]) + "\n")
+			vertex_count += path_length
+
+def create_heightmap(path, size):
+	from PIL import Image
+	x, y = np.meshgrid(np.arange(size), np.arange(size))
+	height = (np.sin(x * 0.11) * np.cos(y * 0.07) * 0.5 + 0.5) * 255.0
+	alpha = np.where((x + y) % 29 == 0, 0, 255)
+	pixels = np.stack((height, alpha), axis=2).astype(np.uint8)
+	Image.fromarray(pixels, "LA").save(path)
+
+
+
+# cases are (name, script, input name, input generator, script arguments)
+cases = []
+icosphere_levels = [5, 6, 7] if arguments.quick else [5, 6, 7, 8]
+for level in icosphere_levels:
+	triangle_count = 20 * 4 ** level
+	name = f"icosphere_{triangle_count}"
+	generator = (create_icosphere, level)
+	cases.append((f"{name}_pyramids", "obj2map.py", f"{name}.obj", generator, []))
+	if level == 6:
+		cases.append((f"{name}_bipyramids", "obj2map.py", f"{name}.obj", generator, ["--secondary_normal_offset", "1.0"]))
+		cases.append((f"{name}_split_bipyramids", "obj2map.py", f"{name}.obj", generator, ["--secondary_normal_offset", "-1.0", "--secondary_normal_brush"]))
+		cases.append((f"{name}_valve", "obj2map.py", f"{name}.obj", generator, ["--uv_valve"]))
+		cases.append((f"{name}_stream", "obj2map.py", f"{name}.obj", generator, ["--stream"]))
+		cases.append((f"{name}_info", "obj2map.py", f"{name}.obj", generator, ["--info"]))
+		cases.append((f"{name}_convex", "obj2map.py", f"{name}_convex.obj", (create_convex_icosphere, level), []))
+cases.append(("objects_2000", "obj2map.py", "objects_2000.obj", (create_object_scene, 2000, 200), []))
+cases.append(("objects_2000_stream", "obj2map.py", "objects_2000.obj", (create_object_scene, 2000, 200), ["--stream"]))
+cases.append(("vertex_colors_250", "obj2map.py", "vertex_colors_250.obj", (create_vertex_color_grid, 250, 64), ["--vertex_color_materials"]))
+cases.append(("paths_1000", "obj2map.py", "paths_1000.obj", (create_path_scene, 1000, 50), []))
+for size in [64, 128, 256]:
+	for chunk_size in [0, 16, 64]:
+		if chunk_size < size:
+			cases.append((f"heightmap_{size}_chunks_{chunk_size}", "height2map.py", f"heightmap_{size}.png", (create_heightmap, size), ["--chunk_size", str(chunk_size)]))
+
+if arguments.cases != "":
+	parts = arguments.cases.split(";")
+	cases = [case for case in cases if any([part in case[0] for part in parts])]
+
+def run_case(case):
+	name, script, input_name, generator, script_arguments = case
+	input_path = os.path.join(arguments.work_directory, input_name)
+	if not os.path.isfile(input_path):
+		print(f"Generating {input_name}")
+		generator[0](input_path, *generator[1:])
+	output_path = os.path.join(arguments.work_directory, name + ".map")
+	profile_path = os.path.join(arguments.work_directory, name + ".profile.json")
+	command = [sys.executable, os.path.join(script_directory, script), input_path, "--output", output_path, "--profile", profile_path] + script_arguments
+
+	result = {"script": script, "arguments": script_arguments, "input_bytes": os.path.getsize(input_path)}
+	wall_times, cpu_times, peak_sizes, profiles = [], [], [], []
+	for iteration in range(max(1, arguments.repeat)):
+		with tempfile.TemporaryFile("w+") as error_file:
+			start_time = time.perf_counter()
+			process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=error_file)
+			# resource usage of this process only, maximum resident size is in kilobytes on Linux
+			status, usage = os.wait4(process.pid, 0)[1:]
+			process.returncode = os.waitstatus_to_exitcode(status)
+			wall_times.append(time.perf_counter() - start_time)
+			if process.returncode != 0:
+				error_file.seek(0)
+				print(f"{name} failed:\n{error_file.read()}")
+				return None
+		cpu_times.append(usage.ru_utime + usage.ru_stime)
+		peak_sizes.append(usage.ru_maxrss / 1024.0)
+		with open(profile_path, "r") as profile_file:
+			profiles.append(json.load(profile_file))
+	result["wall"] = min(wall_times)
+	result["cpu"] = min(cpu_times)
+	result["peak_rss_mb"] = max(peak_sizes)
+	result["output_bytes"] = os.path.getsize(output_path) if os.path.isfile(output_path) else 0
+
+	# stages and counters reported by the fastest run
+	profile = profiles[wall_times.index(result["wall"])]
+	result["stages"] = {stage: times["wall"] for stage, times in profile["stages"].items()}
+	result["counters"] = profile["counters"]
+	return result
+
+
+
+def compare_results(results, baseline):
+	regressions = 0
+	print(f"{'case':<40} {'baseline':>10} {'current':>10} {'change':>8}")
+	for name, case in results["cases"].items():
+		if not name in baseline["cases"]:
+			print(f"{name:<40} {'-':>10} {case['wall']:>10.3f} {'new':>8}")
+			continue
+		base_wall = baseline["cases"][name]["wall"]
+		change = (case["wall"] / base_wall - 1.0) * 100.0 if base_wall > 0.0 else 0.0
+		flag = ""
+		if change > arguments.threshold:
+			flag = " slower"
+			regressions += 1
+		print(f"{name:<40} {base_wall:>10.3f} {case['wall']:>10.3f} {change:>+7.1f}%{flag}")
+	print(f"{regressions} regressions over {arguments.threshold:g}%")
+	return regressions
+
+def read_results(path):
+	try:
+		with open(path, "r") as input_file:
+			return json.load(input_file)
+	except Exception:
+		print(f"Failed reading results: {path}")
+		quit()
+
+if arguments.compare != None:
+	if arguments.baseline == None:
+		print("Comparing results requires a baseline!")
+		quit()
+	sys.exit(1 if compare_results(read_results(arguments.compare), read_results(arguments.baseline)) > 0 else 0)
+
+results = {"version": 1, "python": platform.python_version(), "numpy": np.__version__}
+results["platform"] = platform.platform()
+results["cpu_count"] = os.cpu_count()
+results["cases"] = {}
+for case in cases:
+	result = run_case(case)
+	if result == None:
+		continue
+	results["cases"][case[0]] = result
+	stages = result.get("stages", {})
+	stage_text = " ".join([f"{stage} {stage_time:.3f}" for stage, stage_time in stages.items()])
+	print(f"{case[0]}: {result['wall']:.3f}s, {result['peak_rss_mb']:.0f} MB {stage_text}")
+
+try:
+	with open(arguments.output, "w") as output_file:
+		json.dump(results, output_file, indent = 2)
+except Exception:
+	print(f"Failed writing results: {arguments.output}")
+	quit()
+
+if arguments.baseline != None:
+	sys.exit(1 if compare_results(results, read_results(arguments.baseline)) > 0 else 0)
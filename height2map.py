@@ -1,9 +1,12 @@
 #!/usr/bin/python
-import os, argparse, math
+import os, sys, argparse, io, mmap, multiprocessing, threading, hashlib
+import numpy as np
 from PIL import Image
+from mapwriter import MapWriter, ConversionError
+from profiler import Profiler
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("input", type=str, help="input image")
+parser.add_argument("input", type=str, help="input image or raw heightmap")
 parser.add_argument("--height", type=float, default=256.0, help="max terrain height in map units")
 parser.add_argument("--unit_size", type=float, default=64.0, help="heightmap pixel size in map units")
 parser.add_argument("--grid_snap_step", type=float, default=0.125, help="coordinates snapping in map units")
@@ -13,6 +16,14 @@ parser.add_argument("--material", type=str, default="__TB_empty", help="default
 parser.add_argument("--skip_material", type=str, default="SKIP", help="skip material name to write")
 parser.add_argument("--offset", type=float, default=32.0, help="bottom offset in map units")
 parser.add_argument("--chunk_size", type=int, default=0, help="heightmap chunk size in pixels")
+parser.add_argument("--jobs", type=int, default=1, help="processes generating chunks, 0 uses all cores")
+parser.add_argument("--tile_output", action="store_true", help="write every chunk into its own map file")
+parser.add_argument("--update", action="store_true", help="regenerate only changed chunks of the output map")
+parser.add_argument("--merge_coplanar", action="store_true", help="merge coplanar cells into rectangle brushes")
+parser.add_argument("--merge_tolerance", type=float, default=0.0, help="height error allowed inside merged cells")
+parser.add_argument("--validate", action="store_true", help="drop and report brushes without volume")
+parser.add_argument("--raw_width", type=int, help="raw heightmap width in pixels, square if not provided")
+parser.add_argument("--raw_format", type=str, default="<u2", help="NumPy type of raw heightmap values")
 parser.add_argument("--x_offset", type=float, default="0.0", help="x-offset for splatmap texture")
 parser.add_argument("--y_offset", type=float, default="0.0", help="y-offset for splatmap texture")
 parser.add_argument("--x_scale", type=float, default="1.0", help="x-scale for splatmap texture")
@@ -20,148 +31,629 @@ parser.add_argument("--y_scale", type=float, default="1.0", help="y-scale for sp
 parser.add_argument("--phong_disabled", action="store_true", help="don't use smooth shading for terrain")
 parser.add_argument("--phong_angle", type=float, default = "89.0", help="smooth shading split angle")
 parser.add_argument("--game", type=str, default="Generic", help="game type for TrenchBroom")
+parser.add_argument("--profile", type=str, nargs="?", const="", help="print stage times to stderr or to a JSON file")
+parser.add_argument("--profile_stage", type=str, help="run cProfile for a single stage, stats are saved to output.prof")
 parser.add_argument("--output", type=str)
-arguments = parser.parse_args()
-
-# using input file name for the output if not provided
-input_basename = os.path.basename(arguments.input)
-input_name = os.path.splitext(input_basename)[0]
-if arguments.output == None:
-	arguments.output = input_name + ".map"
-
-def grid_snap(v, s):
-	return math.floor(v / s + 0.5) * s
-
-# shortcuts for easier reading
-h = arguments.height
-u = arguments.unit_size
-m = arguments.material
-sm = arguments.skip_material
-o = -arguments.offset
-cs = arguments.chunk_size
-xo = arguments.x_offset
-yo = arguments.y_offset
-xs = arguments.x_scale
-ys = arguments.y_scale
-
-# trying to open input file
-input_file = None
-try:
-	input_file = Image.open(arguments.input)
-except Exception:
-	print(f"Failed loading image: {arguments.input}")
-	quit()
-
-# loading heightmap pixels
-heightmap = input_file.convert("LA")
-heightmap = heightmap.transpose(Image.FLIP_TOP_BOTTOM)
-pixels = heightmap.load()
-iw, ih = heightmap.size
-# disabling chunking
-cs = min(iw, ih) if cs <= 0 else cs
-
-# sanity checks
-if iw > 256 or ih > 256:
-	print("Don't use heightmaps larger than 256x256")
-	quit()
-if iw % 2 != 0 or ih % 2 != 0:
-	print("Heightmap dimensions are not divisible by 2")
-	quit()
-if arguments.chunk_size > 0:
-	if iw % cs != 0 or ih % cs != 0:
-		print("Heightmap dimensions are not divisible by the chunk size")
+profile_stages = ["parse", "update", "brushes", "writing"]
+
+# parses command line arguments, library options override the defaults without reading the command line
+def get_arguments(argv = None, **options):
+	arguments = parser.parse_args(argv if argv != None else [""])
+	for key, value in options.items():
+		if not key in vars(arguments):
+			raise ConversionError(f"Unknown option: {key}")
+		setattr(arguments, key, value)
+	return arguments
+
+# inputs are paths, streams or images, outputs are paths or streams
+def is_path(value):
+	return value == None or isinstance(value, (str, os.PathLike))
+
+def get_input_name(input):
+	if is_path(input):
+		return os.path.splitext(os.path.basename(input))[0]
+	name = getattr(input, "filename", getattr(input, "name", None))
+	return os.path.splitext(os.path.basename(name))[0] if isinstance(name, str) and name != "" else "input"
+
+def grids_snap(v, s):
+	return np.floor(v / s + 0.5) * s
+
+# heightmap values and alphas are kept in their file types, first row on top,
+# windows are read with wrap-around and flipped so y grows upwards like in maps
+class Heightmap:
+	def __init__(self, values, alphas = None, max_value = 255.0):
+		self.values = values
+		self.alphas = alphas
+		self.max_value = max_value
+		self.height, self.width = values.shape
+
+	# returns values and alphas in the range from zero to one indexed by x and y
+	def get_window(self, x, y, width, height):
+		columns = np.arange(x, x + width) % self.width
+		rows = (self.height - 1) - np.arange(y, y + height) % self.height
+		window = np.ix_(rows, columns)
+		values = self.values[window].astype(np.float64).T
+		alphas = np.ones_like(values)
+		if self.alphas is not None:
+			alphas = self.alphas[window].astype(np.float64).T / 255.0
+		return values, alphas
+
+# heights closer than this are on the same plane
+plane_epsilon = 1e-6
+
+def get_plane_heights(v):
+	a = np.arange(v.shape[0])[:, None] / (v.shape[0] - 1)
+	b = np.arange(v.shape[1])[None, :] / (v.shape[1] - 1)
+	return v[0, 0] + (v[-1, 0] - v[0, 0]) * a + (v[0, -1] - v[0, 0]) * b
+
+# cells lying on one plane have the same slopes, which are compared as multiples of the epsilon,
+# returns slope keys of planar cells and the number of cells with the same keys starting at each cell
+def get_cell_slopes(heights, is_visible):
+	width, height = is_visible.shape
+	x_slopes = np.rint((heights[1:, :-1] - heights[:-1, :-1]) / plane_epsilon)
+	y_slopes = np.rint((heights[:-1, 1:] - heights[:-1, :-1]) / plane_epsilon)
+	twists = heights[1:, 1:] - heights[1:, :-1] - heights[:-1, 1:] + heights[:-1, :-1]
+	is_planar = is_visible & (np.abs(twists) <= plane_epsilon)
+	is_same = is_planar[:, :-1] & is_planar[:, 1:] & (x_slopes[:, :-1] == x_slopes[:, 1:]) & (y_slopes[:, :-1] == y_slopes[:, 1:])
+	# runs end at the first cell which differs from the next one
+	run_ends = np.where(np.column_stack((~is_same, np.ones(width, dtype=bool))), np.arange(height), height - 1)
+	run_ends = np.minimum.accumulate(run_ends[:, ::-1], axis=1)[:, ::-1]
+	return x_slopes, y_slopes, is_planar, run_ends - np.arange(height) + 1
+
+# greedy rectangles of cells lying on one plane within the tolerance, returned by their first cells,
+# corners of merged cells are moved onto the plane and fixed, so neighbouring brushes meet without cracks
+def get_cell_rectangles(heights, is_visible, tolerance):
+	width, height = is_visible.shape
+	is_used = ~is_visible
+	# corners on window borders are shared with other windows
+	is_fixed = np.zeros(heights.shape, dtype=bool)
+	is_fixed[[0, -1], :] = True
+	is_fixed[:, [0, -1]] = True
+	# returns heights of the plane through the rectangle, unless its cells are used or off the plane
+	def get_plane(i0, j0, i1, j1):
+		if is_used[i0:i1, j0:j1].any():
+			return None
+		v = heights[i0:i1 + 1, j0:j1 + 1]
+		plane = get_plane_heights(v)
+		limits = np.where(is_fixed[i0:i1 + 1, j0:j1 + 1], plane_epsilon, max(tolerance, plane_epsilon))
+		return None if np.any(np.abs(v - plane) > limits) else plane
+
+	# growing rectangles by fitting their planes again at every step
+	def get_rectangle(i, j, plane):
+		i1, j1 = i + 1, j + 1
+		while j1 < height:
+			next_plane = get_plane(i, j, i1, j1 + 1)
+			if next_plane is None:
+				break
+			j1, plane = j1 + 1, next_plane
+		while i1 < width:
+			next_plane = get_plane(i, j, i1 + 1, j1)
+			if next_plane is None:
+				break
+			i1, plane = i1 + 1, next_plane
+		return i1, j1, plane
+
+	# without tolerance corners are not moved, so rectangles grow by comparing slopes of single cells
+	# and are only fitted once, rectangles are grown by fitting if rounded slopes were not on one plane
+	use_slopes = not tolerance > plane_epsilon
+	if use_slopes:
+		x_slopes, y_slopes, is_planar, run_lengths = get_cell_slopes(heights, is_visible)
+		def get_slope_rectangle(i, j):
+			j1 = j + run_lengths[i, j]
+			used_cells = is_used[i, j:j1]
+			if used_cells.any():
+				j1 = j + int(used_cells.argmax())
+			i1 = i + 1
+			x_slope, y_slope = x_slopes[i, j], y_slopes[i, j]
+			while i1 < width and is_planar[i1, j] and x_slopes[i1, j] == x_slope and y_slopes[i1, j] == y_slope:
+				if run_lengths[i1, j] < j1 - j or is_used[i1, j:j1].any():
+					break
+				i1 += 1
+			return i1, j1
+
+		# single cells are fitted without arrays, with the same rounding as plane heights
+		def fit_cell(i, j):
+			h00, h10, h01, h11 = heights[i, j], heights[i + 1, j], heights[i, j + 1], heights[i + 1, j + 1]
+			p10 = h00 + (h10 - h00)
+			p01 = h00 + (h01 - h00)
+			p11 = p10 + (h01 - h00)
+			if abs(h10 - p10) > plane_epsilon or abs(h01 - p01) > plane_epsilon or abs(h11 - p11) > plane_epsilon:
+				return False
+			for corner, value in [((i, j), h00 + 0.0), ((i + 1, j), p10), ((i, j + 1), p01), ((i + 1, j + 1), p11)]:
+				if not is_fixed[corner]:
+					heights[corner] = value
+					is_fixed[corner] = True
+			is_used[i, j] = True
+			return True
+
+	rectangles = {}
+	for i, j in np.argwhere(is_planar if use_slopes else is_visible).tolist():
+		if is_used[i, j]:
+			continue
+		plane = None
+		if use_slopes:
+			i1, j1 = get_slope_rectangle(i, j)
+			if i1 - i == 1 and j1 - j == 1 and fit_cell(i, j):
+				rectangles[(i, j)] = (i1, j1)
+				continue
+			plane = get_plane(i, j, i1, j1)
+		if plane is None:
+			plane = get_plane(i, j, i + 1, j + 1)
+			if plane is None:
+				continue
+			i1, j1, plane = get_rectangle(i, j, plane)
+		v = heights[i:i1 + 1, j:j1 + 1]
+		fixed = is_fixed[i:i1 + 1, j:j1 + 1]
+		v[...] = np.where(fixed, v, plane)
+		fixed[...] = True
+		is_used[i:i1, j:j1] = True
+		rectangles[(i, j)] = (i1, j1)
+	return rectangles
+
+# chunks are generated by forked workers, which inherit the converter instead of pickling it,
+# pools are created under the lock so that conversions from other threads don't replace it first
+chunk_converter = None
+chunk_lock = threading.Lock()
+def generate_chunk(chunk):
+	return chunk_converter.get_chunk_text(*chunk)
+
+# arguments which don't change generated chunks
+update_ignored_arguments = ["input", "output", "update", "jobs", "tile_output", "profile", "profile_stage"]
+def get_update_arguments_hash(arguments):
+	update_arguments = [(key, value) for key, value in sorted(vars(arguments).items()) if not key in update_ignored_arguments]
+	return hashlib.sha1(repr(update_arguments).encode())
+
+# chunk entities written in update mode are tagged with the hash of their pixels and arguments,
+# old maps are mapped into memory and only searched for entity starts
+def read_update_blocks(paths, update_files):
+	update_blocks = {}
+	for path in paths:
+		if not os.path.isfile(path) or os.path.getsize(path) == 0:
+			continue
+		try:
+			with open(path, "rb") as input_file:
+				update_file = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+		except Exception:
+			raise ConversionError(f"Failed opening output file: {path}")
+		update_files.append(update_file)
+		starts = [0] if update_file[:3] == b'{\n"' else []
+		start = update_file.find(b'\n{\n"')
+		while start >= 0:
+			starts.append(start + 1)
+			start = update_file.find(b'\n{\n"', start + 1)
+		for start, end in zip(starts, starts[1:] + [len(update_file)]):
+			# properties end with the first brush
+			properties_end = update_file.find(b"\n{\n", start, end)
+			properties_end = end if properties_end < 0 else properties_end
+			hash_start = update_file.find(b'"_height2map_hash" "', start, properties_end)
+			if hash_start >= 0:
+				hash_start += 20
+				chunk_hash = update_file[hash_start:update_file.find(b'"', hash_start, properties_end)].decode()
+				update_blocks[chunk_hash] = (update_file, start, end)
+	return update_blocks
+
+# cells of invalid brushes printed at most
+max_reported_cells = 10
+
+raw_extensions = [".raw", ".r16", ".r32"]
+# cells read at once when chunks are not used
+window_size = 1 << 16
+def open_heightmap(arguments):
+	input = arguments.input
+	if arguments.raw_width != None or (is_path(input) and os.path.splitext(input)[1].lower() in raw_extensions):
+		# raw heightmaps are mapped into memory, only read windows are loaded
+		try:
+			dtype = np.dtype(arguments.raw_format)
+			if is_path(input):
+				values = np.memmap(input, dtype=dtype, mode="r")
+			else:
+				values = np.frombuffer(input.read(), dtype=dtype)
+		except Exception:
+			raise ConversionError(f"Failed loading raw heightmap: {arguments.input}")
+		width = arguments.raw_width
+		if width == None:
+			width = int(round(np.sqrt(len(values))))
+		if not width > 0 or len(values) % width != 0:
+			raise ConversionError("Raw heightmap size is not divisible by its width")
+		max_value = float(np.iinfo(dtype).max) if dtype.kind in "ui" else 1.0
+		return Heightmap(values.reshape(-1, width), None, max_value)
+
+	try:
+		image = input if isinstance(input, Image.Image) else Image.open(input)
+		# 16-bit images are read without converting them to 8 bits
+		if image.mode.startswith("I;16") or image.mode == "I":
+			return Heightmap(np.asarray(image), None, 65535.0)
+		if image.mode == "F":
+			return Heightmap(np.asarray(image), None, 1.0)
+		pixels = np.asarray(image.convert("LA"))
+		return Heightmap(pixels[:, :, 0], pixels[:, :, 1], 255.0)
+	except Exception:
+		raise ConversionError(f"Failed loading image: {arguments.input}")
+
+# converts a heightmap with parsed arguments, windows and chunks of cells are written by methods
+# returning their brush counts, which are summed by the converter for the final report
+class HeightmapConverter:
+	def __init__(self, arguments):
+		# validating input arguments
+		if arguments.profile_stage != None:
+			if not arguments.profile_stage in profile_stages:
+				raise ConversionError(f"Profile stage must be one of: {', '.join(profile_stages)}!")
+			if arguments.profile == None:
+				arguments.profile = ""
+		if arguments.jobs < 1:
+			arguments.jobs = os.cpu_count()
+		if arguments.jobs > 1 and not "fork" in multiprocessing.get_all_start_methods():
+			print("Parallel jobs are not supported on this platform, using a single process")
+			arguments.jobs = 1
+		self.arguments = arguments
+
+		# using input file name for the output if not provided
+		self.input_name = get_input_name(arguments.input)
+		if arguments.output == None:
+			arguments.output = self.input_name + ".map"
+		stats_path = (arguments.output if is_path(arguments.output) else self.input_name + ".map") + ".prof"
+		self.profiler = Profiler(arguments.profile != None, arguments.profile_stage, stats_path)
+
+		# shortcuts for easier reading
+		self.h = arguments.height
+		self.u = arguments.unit_size
+		self.sm = arguments.skip_material
+		self.o = -arguments.offset
+		# texts repeated in every brush
+		self.oo = f"{self.o:g}"
+		self.tm = f"{arguments.material} [ 1 0 0 {arguments.x_offset:g} ] [ 0 -1 0 {arguments.y_offset:g} ] 0 {arguments.x_scale:g} {arguments.y_scale:g}"
+
+		# trying to open input file
+		self.profiler.start("parse")
+		self.heightmap = open_heightmap(arguments)
+		self.iw, self.ih = self.heightmap.width, self.heightmap.height
+		self.profiler.count("pixels", self.iw * self.ih)
+		self.profiler.stop()
+		iw, ih = self.iw, self.ih
+		# disabling chunking
+		self.cs = min(iw, ih) if arguments.chunk_size <= 0 else arguments.chunk_size
+		cs = self.cs
+
+		# sanity checks
+		if iw % 2 != 0 or ih % 2 != 0:
+			raise ConversionError("Heightmap dimensions are not divisible by 2")
+		if arguments.chunk_size > 0:
+			if iw % cs != 0 or ih % cs != 0:
+				raise ConversionError("Heightmap dimensions are not divisible by the chunk size")
+		if arguments.tile_output:
+			if not arguments.chunk_size > 0:
+				raise ConversionError("Tile output requires a chunk size!")
+			if not is_path(arguments.output):
+				raise ConversionError("Tile output requires an output file!")
+		if arguments.update:
+			if not arguments.chunk_size > 0:
+				raise ConversionError("Update requires a chunk size!")
+			if not is_path(arguments.output):
+				raise ConversionError("Update requires an output file!")
+
+		# checking if grouping is necessary
+		self.use_group = False
+		if arguments.chunk_size > 0 and not arguments.tile_output:
+			if ((iw * ih) // (cs * cs)) > 1:
+				self.use_group = True
+
+		# brushes written, brushes of merged cells without merging and invalid brushes
+		self.brush_counts = [0, 0, 0]
+		# first cells of invalid brushes are reported
+		self.invalid_cells = []
+		# chunk hashes are only written in update mode
+		self.chunk_hashes = {}
+
+	# updated maps are written next to the old ones and replace them when finished
+	def open_output_file(self, output_path):
+		try:
+			if not is_path(output_path):
+				return MapWriter(output_path, profiler=self.profiler)
+			return MapWriter(open(output_path + ".update" if self.arguments.update else output_path, "w"), profiler=self.profiler)
+		except Exception:
+			raise ConversionError(f"Failed writing output file: {output_path}")
+
+	def close_output_file(self, output_file, output_path):
+		output_file.close()
+		if self.arguments.update:
+			os.replace(output_path + ".update", output_path)
+
+	def write_header(self, output_file):
+		output_file.write(f"// Game: {self.arguments.game}\n")
+		output_file.write("// Format: Valve\n")
+
+	def write_entity_properties(self, output_file, chunk_hash = None):
+		arguments = self.arguments
+		output_file.write(f'"classname" "{arguments.classname}"\n')
+		output_file.write(f'"_phong" "{int(not arguments.phong_disabled)}"\n')
+		if not arguments.phong_disabled:
+			output_file.write(f'"_phong_angle" "{arguments.phong_angle}"\n')
+		if self.use_group:
+			output_file.write(f'"_tb_group" "1"\n')
+		if chunk_hash != None:
+			output_file.write(f'"_height2map_hash" "{chunk_hash}"\n')
+
+	def add_brush_counts(self, brush_counts, invalid_cells):
+		for index, count in enumerate(brush_counts):
+			self.brush_counts[index] += count
+		self.invalid_cells.extend(invalid_cells[:max(0, max_reported_cells - len(self.invalid_cells))])
+
+	# side planes of brushes are degenerate or inverted unless top corners are above the bottom,
+	# other brushes are removed from visible cells and rectangles, returns their count and first cells
+	def validate_cells(self, x, y, heights, is_visible, rectangles):
+		o = self.o
+		is_valid = np.minimum(heights[1:, :-1], heights[:-1, 1:]) > o
+		is_valid_first = is_valid & (heights[:-1, :-1] > o)
+		is_valid_second = is_valid & (heights[1:, 1:] > o)
+		is_invalid = is_visible & ~(is_valid_first * 1 | is_valid_second * 2)
+		for (i, j), (i1, j1) in list(rectangles.items()):
+			if not np.all(heights[i:i1 + 1, j:j1 + 1] > o):
+				is_invalid[i, j] |= 4
+				del rectangles[(i, j)]
+		is_visible &= ~is_invalid
+		invalid_count = np.count_nonzero(is_invalid & 1) + np.count_nonzero(is_invalid & 2) + np.count_nonzero(is_invalid & 4)
+		invalid_cells = [(x + i, y + j) for i, j in np.argwhere(is_invalid)[:max_reported_cells].tolist()]
+		return invalid_count, invalid_cells
+
+	# reads cells of a window with one more wrapped row and column of corners, returns corner heights,
+	# visible halves of cells and merged rectangles with brush counts and first invalid cells
+	def get_window_cells(self, x, y, width, height):
+		arguments = self.arguments
+		self.profiler.start("parse")
+		values, alphas = self.heightmap.get_window(x, y, width + 1, height + 1)
+		self.profiler.stop()
+
+		# reading alpha and height values of all pixels at once
+		heights = alphas * self.h * values / self.heightmap.max_value
+		if not arguments.disable_grid_snap:
+			heights = grids_snap(heights, arguments.grid_snap_step)
+
+		# discarding brushes where image pixels are transparent,
+		# the first and the second bits are visible halves of cells
+		is_visible = np.where(alphas[:width, :height] != 0.0, 3, 0)
+		rectangles = {}
+		brush_counts = [0, 0, 0]
+		invalid_cells = []
+		if arguments.merge_coplanar:
+			# moves merged corners onto rectangle planes
+			rectangles = get_cell_rectangles(heights, is_visible != 0, arguments.merge_tolerance)
+			for (i, j), (i1, j1) in rectangles.items():
+				is_visible[i:i1, j:j1] = 0
+			rectangle_cells = sum([(i1 - i) * (j1 - j) for (i, j), (i1, j1) in rectangles.items()])
+			brush_counts[1] = (np.count_nonzero(is_visible) + rectangle_cells) * 2
+		if arguments.validate:
+			brush_counts[2], invalid_cells = self.validate_cells(x, y, heights, is_visible, rectangles)
+		if arguments.merge_coplanar:
+			brush_counts[0] = np.count_nonzero(is_visible & 1) + np.count_nonzero(is_visible & 2) + len(rectangles)
+		return heights, is_visible, rectangles, brush_counts, invalid_cells
+
+	# writes brushes of a window, returns its brush counts and first invalid cells
+	def write_window(self, output_file, x, y, width, height):
+		heights, is_visible, rectangles, brush_counts, invalid_cells = self.get_window_cells(x, y, width, height)
+		self.write_window_brushes(output_file, x, y, width, height, heights, is_visible, rectangles)
+		return brush_counts, invalid_cells
+
+	def write_window_brushes(self, output_file, x, y, width, height, heights, is_visible, rectangles):
+		iw, ih, u = self.iw, self.ih, self.u
+		oo, tm, sm = self.oo, self.tm, self.sm
+		# formatting numbers through the writer cache, cell corners are shifts of pixels
+		f = output_file.format_number
+		h00s = [[f(value) for value in column] for column in heights.tolist()]
+		h10s = h00s[1:]
+		h01s = [column[1:] for column in h00s]
+		h11s = h01s[1:]
+		x0s = [f((ix - iw // 2) * u) for ix in range(x, x + width)]
+		x1s = [f((ix - iw // 2) * u + u) for ix in range(x, x + width)]
+		y0s = [f((iy - ih // 2) * u) for iy in range(y, y + height)]
+		y1s = [f((iy - ih // 2) * u + u) for iy in range(y, y + height)]
+		is_visible = is_visible.tolist()
+
+		for i in range(width):
+			for j in range(height):
+				if (i, j) in rectangles:
+					# rectangle corners are coplanar, the top plane uses three of them
+					i1, j1 = rectangles[(i, j)]
+					x0, y0, x1, y1 = x0s[i], y0s[j], x1s[i1 - 1], y1s[j1 - 1]
+					h00, h10, h01 = h00s[i][j], h00s[i1][j], h00s[i][j1]
+					output_file.write(
+						"{\n"
+						f"( {x0} {y0} {oo} ) ( {x0} {y1} {oo} ) ( {x0} {y0} {h00} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x0} {y0} {oo} ) ( {x0} {y0} {h00} ) ( {x1} {y0} {oo} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x0} {y0} {oo} ) ( {x1} {y0} {oo} ) ( {x0} {y1} {oo} ) {sm} [ 1 0 0 0 ] [ 0 -1 0 0 ] 0 1 1\n"
+						f"( {x0} {y0} {h00} ) ( {x0} {y1} {h01} ) ( {x1} {y0} {h10} ) {tm}\n"
+						f"( {x0} {y1} {oo} ) ( {x1} {y1} {oo} ) ( {x0} {y1} {h01} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x1} {y0} {oo} ) ( {x1} {y0} {h10} ) ( {x1} {y1} {oo} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						"}\n"
+					)
+					continue
+				visible = is_visible[i][j]
+				if not visible:
+					continue
+				x0, y0, x1, y1 = x0s[i], y0s[j], x1s[i], y1s[j]
+				h00, h10, h01, h11 = h00s[i][j], h10s[i][j], h01s[i][j], h11s[i][j]
+				if visible & 1:
+					output_file.write(
+						"{\n"
+						f"( {x0} {y0} {oo} ) ( {x0} {y1} {oo} ) ( {x0} {y0} {h00} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x0} {y0} {oo} ) ( {x0} {y0} {h00} ) ( {x1} {y0} {oo} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x0} {y0} {oo} ) ( {x1} {y0} {oo} ) ( {x0} {y1} {oo} ) {sm} [ 1 0 0 0 ] [ 0 -1 0 0 ] 0 1 1\n"
+						f"( {x0} {y0} {h00} ) ( {x0} {y1} {h01} ) ( {x1} {y0} {h10} ) {tm}\n"
+						f"( {x0} {y1} {oo} ) ( {x1} {y0} {oo} ) ( {x1} {y0} {h10} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						"}\n"
+					)
+				if visible & 2:
+					output_file.write(
+						"{\n"
+						f"( {x0} {y1} {oo} ) ( {x1} {y0} {h10} ) ( {x1} {y0} {oo} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x0} {y0} {oo} ) ( {x1} {y0} {oo} ) ( {x0} {y1} {oo} ) {sm} [ 1 0 0 0 ] [ 0 -1 0 0 ] 0 1 1\n"
+						f"( {x1} {y1} {h11} ) ( {x1} {y0} {h10} ) ( {x0} {y1} {h01} ) {tm}\n"
+						f"( {x0} {y1} {oo} ) ( {x1} {y1} {oo} ) ( {x0} {y1} {h01} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						f"( {x1} {y0} {oo} ) ( {x1} {y0} {h10} ) ( {x1} {y1} {oo} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n"
+						"}\n"
+					)
+
+	def write_chunk(self, output_file, x_chunk, y_chunk):
+		cs = self.cs
+		output_file.write("{\n")
+		self.write_entity_properties(output_file, self.chunk_hashes.get((x_chunk, y_chunk)))
+		brush_counts, invalid_cells = self.write_window(output_file, x_chunk * cs, y_chunk * cs, cs, cs)
+		output_file.write("}\n")
+		return brush_counts, invalid_cells
+
+	# chunks are hashed with the window of pixels they read, including the wrapped border
+	def get_chunk_hash(self, arguments_hash, x_chunk, y_chunk):
+		cs = self.cs
+		values, alphas = self.heightmap.get_window(x_chunk * cs, y_chunk * cs, cs + 1, cs + 1)
+		chunk_hash = arguments_hash.copy()
+		chunk_hash.update(repr((x_chunk, y_chunk)).encode())
+		chunk_hash.update(values.tobytes())
+		chunk_hash.update(alphas.tobytes())
+		return chunk_hash.hexdigest()
+
+	# chunk texts generated by a worker with their brush counts
+	def get_chunk_text(self, x_chunk, y_chunk):
+		# worker stages are measured as brushes of the main process
+		self.profiler.enabled = False
+		chunk_file = MapWriter(io.StringIO())
+		brush_counts, invalid_cells = self.write_chunk(chunk_file, x_chunk, y_chunk)
+		chunk_file.flush()
+		return chunk_file.file.getvalue(), brush_counts, invalid_cells
+
+	# writes chunks in the order of their indices, opening an output file for each of them,
+	# unchanged chunks of updated maps reuse their old texts
+	def write_chunks(self, open_chunk_file, close_chunk_file, update_paths):
+		global chunk_converter
+		arguments, profiler, chunk_hashes = self.arguments, self.profiler, self.chunk_hashes
+		chunks = [(x_chunk, y_chunk) for x_chunk in range(self.iw // self.cs) for y_chunk in range(self.ih // self.cs)]
+		update_blocks = {}
+		update_files = []
+		if arguments.update:
+			profiler.start("update")
+			update_blocks = read_update_blocks(update_paths, update_files)
+			arguments_hash = get_update_arguments_hash(arguments)
+			arguments_hash.update(repr((self.iw, self.ih, self.heightmap.max_value, self.use_group)).encode())
+			for chunk in chunks:
+				chunk_hashes[chunk] = self.get_chunk_hash(arguments_hash, *chunk)
+			profiler.count("reused chunks", len([chunk for chunk in chunks if chunk_hashes[chunk] in update_blocks]))
+			profiler.stop()
+		generated_chunks = [chunk for chunk in chunks if not chunk_hashes.get(chunk) in update_blocks]
+
+		pool = None
+		if arguments.jobs > 1 and len(generated_chunks) > 1:
+			with chunk_lock:
+				chunk_converter = self
+				pool = multiprocessing.get_context("fork").Pool(arguments.jobs)
+				chunk_converter = None
+			chunk_texts = pool.imap(generate_chunk, generated_chunks)
+		try:
+			for chunk in chunks:
+				is_reused = chunk_hashes.get(chunk) in update_blocks
+				# unchanged tiles are kept as they are
+				if is_reused and arguments.tile_output:
+					continue
+				output_file = open_chunk_file(*chunk)
+				if is_reused:
+					update_file, start, end = update_blocks[chunk_hashes[chunk]]
+					output_file.write(update_file[start:end].decode())
+				elif pool != None:
+					text, brush_counts, invalid_cells = next(chunk_texts)
+					output_file.write(text)
+					self.add_brush_counts(brush_counts, invalid_cells)
+				else:
+					self.add_brush_counts(*self.write_chunk(output_file, *chunk))
+				close_chunk_file(output_file, *chunk)
+		finally:
+			if pool != None:
+				pool.terminate()
+				pool.join()
+			for update_file in update_files:
+				update_file.close()
+
+	def convert(self):
+		arguments, profiler = self.arguments, self.profiler
+		iw, ih, cs = self.iw, self.ih, self.cs
+		profiler.start("brushes")
+		if arguments.tile_output:
+			# every chunk is written into its own map, named after its indices
+			output_root, output_extension = os.path.splitext(arguments.output)
+			def get_tile_path(x_chunk, y_chunk):
+				return f"{output_root}_{x_chunk}_{y_chunk}{output_extension}"
+			def open_tile_file(x_chunk, y_chunk):
+				output_file = self.open_output_file(get_tile_path(x_chunk, y_chunk))
+				self.write_header(output_file)
+				return output_file
+			tile_paths = [get_tile_path(x_chunk, y_chunk) for x_chunk in range(iw // cs) for y_chunk in range(ih // cs)]
+			self.write_chunks(open_tile_file, lambda output_file, x_chunk, y_chunk: self.close_output_file(output_file, get_tile_path(x_chunk, y_chunk)), tile_paths)
+		else:
+			# writing output file
+			output_file = self.open_output_file(arguments.output)
+			self.write_header(output_file)
+			if self.use_group:
+				output_file.write("{\n")
+				output_file.write('"classname" "func_group"\n')
+				output_file.write('"_tb_type" "_tb_group"\n')
+				output_file.write(f'"_tb_name" "{self.input_name}"\n')
+				output_file.write('"_tb_id" "1"\n')
+				output_file.write("}\n")
+
+			if arguments.chunk_size > 0:
+				self.write_chunks(lambda x_chunk, y_chunk: output_file, lambda output_file, x_chunk, y_chunk: None, [arguments.output])
+			else:
+				# a single entity is written in strips of columns to keep memory bounded
+				output_file.write("{\n")
+				self.write_entity_properties(output_file)
+				strip_width = max(1, window_size // ih)
+				for x in range(0, iw, strip_width):
+					self.add_brush_counts(*self.write_window(output_file, x, 0, min(strip_width, iw - x), ih))
+				output_file.write("}\n")
+
+			# closing output file, streams are only flushed
+			if is_path(arguments.output):
+				self.close_output_file(output_file, arguments.output)
+			else:
+				output_file.flush()
+		profiler.stop()
+		self.report()
+
+	def report(self):
+		brush_counts, invalid_cells = self.brush_counts, self.invalid_cells
+		# reused chunks are not counted
+		if self.arguments.merge_coplanar and brush_counts[1] > 0:
+			print(f"{self.input_name}: {brush_counts[1]} -> {brush_counts[0]} brushes")
+		if brush_counts[2] > 0:
+			reported_cells = ", ".join([f"({x} {y})" for x, y in invalid_cells])
+			print(f"{self.input_name}: dropped {brush_counts[2]} invalid brushes, cells {reported_cells}{', ...' if brush_counts[2] > len(invalid_cells) else ''}")
+			self.profiler.count("invalid", brush_counts[2])
+		self.profiler.report(self.arguments.profile)
+
+def convert_arguments(arguments):
+	HeightmapConverter(arguments).convert()
+
+# converts a heightmap path, stream or image into a map file or a text stream,
+# options are named like command line arguments
+def convert(input, output = None, **options):
+	arguments = get_arguments(**options)
+	arguments.input, arguments.output = input, output
+	convert_arguments(arguments)
+
+# returns brushes of a window of heightmap cells as map text, the whole heightmap if no size is provided
+def generate_brushes(input, x = 0, y = 0, width = None, height = None, **options):
+	arguments = get_arguments(**options)
+	arguments.input = input
+	converter = HeightmapConverter(arguments)
+	width = converter.iw - x if width == None else width
+	height = converter.ih - y if height == None else height
+	output_file = MapWriter(io.StringIO())
+	converter.write_window(output_file, x, y, width, height)
+	output_file.flush()
+	return output_file.file.getvalue()
+
+def main():
+	try:
+		convert_arguments(get_arguments(sys.argv[1:]))
+	except ConversionError as error:
+		print(error)
 		quit()
 
-# trying to open output file
-output_file = None
-try:
-	output_file = open(arguments.output, "w")
-except Exception:
-	print(f"Failed writing output output_file: {arguments.output}")
-	quit()
-
-# checking if grouping is necessary
-use_group = False
-if arguments.chunk_size > 0:
-	if ((iw * ih) // (cs * cs)) > 1:
-		use_group = True
-
-# writing output file
-output_file.write(f"// Game: {arguments.game}\n")
-output_file.write("// Format: Valve\n")
-
-if use_group:
-	output_file.write("{\n")
-	output_file.write('"classname" "func_group"\n')
-	output_file.write('"_tb_type" "_tb_group"\n')
-	output_file.write(f'"_tb_name" "{input_name}"\n')
-	output_file.write('"_tb_id" "1"\n')
-	output_file.write("}\n")
-
-def write_entity_properties():
-	output_file.write(f'"classname" "{arguments.classname}"\n')
-	output_file.write(f'"_phong" "{int(not arguments.phong_disabled)}"\n')
-	if not arguments.phong_disabled:
-		output_file.write(f'"_phong_angle" "{arguments.phong_angle}"\n')
-	if use_group:
-		output_file.write(f'"_tb_group" "1"\n')
-
-def write_brush_at(i, j):
-	x, y, ix, iy = (i * u, j * u, i + iw // 2, j + ih // 2)
-
-	# discarding brushes where image pixels are transparent
-	a00 = pixels[(ix + 0) % iw, (iy + 0) % ih][1] / 255.0
-	a10 = pixels[(ix + 1) % iw, (iy + 0) % ih][1] / 255.0
-	a01 = pixels[(ix + 0) % iw, (iy + 1) % ih][1] / 255.0
-	a11 = pixels[(ix + 1) % iw, (iy + 1) % ih][1] / 255.0
-	if a00 == 0.0:
-		return
-
-	# reading height values from image pixels
-	h00 = a00 * h * pixels[(ix + 0) % iw, (iy + 0) % ih][0] / 255.0
-	h10 = a10 * h * pixels[(ix + 1) % iw, (iy + 0) % ih][0] / 255.0
-	h01 = a01 * h * pixels[(ix + 0) % iw, (iy + 1) % ih][0] / 255.0
-	h11 = a11 * h * pixels[(ix + 1) % iw, (iy + 1) % ih][0] / 255.0
-
-	# snapping height values
-	if not arguments.disable_grid_snap:
-		h00 = grid_snap(h00, arguments.grid_snap_step)
-		h10 = grid_snap(h10, arguments.grid_snap_step)
-		h01 = grid_snap(h01, arguments.grid_snap_step)
-		h11 = grid_snap(h11, arguments.grid_snap_step)
-
-	output_file.write("{\n")
-	output_file.write(f"( {x:g} {y:g} {o:g} ) ( {x:g} {y+u:g} {o:g} ) ( {x:g} {y:g} {h00:g} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write(f"( {x:g} {y:g} {o:g} ) ( {x:g} {y:g} {h00:g} ) ( {x+u:g} {y:g} {o:g} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write(f"( {x:g} {y:g} {o:g} ) ( {x+u:g} {y:g} {o:g} ) ( {x:g} {y+u:g} {o:g} ) {sm} [ 1 0 0 0 ] [ 0 -1 0 0 ] 0 1 1\n")
-	output_file.write(f"( {x:g} {y:g} {h00:g} ) ( {x:g} {y+u:g} {h01:g} ) ( {x+u:g} {y:g} {h10:g} ) {m} [ 1 0 0 {xo:g} ] [ 0 -1 0 {yo:g} ] 0 {xs:g} {ys:g}\n")
-	output_file.write(f"( {x:g} {y+u:g} {o:g} ) ( {x+u:g} {y:g} {o:g} ) ( {x+u:g} {y:g} {h10:g} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write("}\n")
-
-	output_file.write("{\n")
-	output_file.write(f"( {x:g} {y+u:g} {o:g} ) ( {x+u:g} {y:g} {h10:g} ) ( {x+u:g} {y:g} {o:g} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write(f"( {x:g} {y:g} {o:g} ) ( {x+u:g} {y:g} {o:g} ) ( {x:g} {y+u:g} {o:g} ) {sm} [ 1 0 0 0 ] [ 0 -1 0 0 ] 0 1 1\n")
-	output_file.write(f"( {x+u:g} {y+u:g} {h11:g} ) ( {x+u:g} {y:g} {h10:g} ) ( {x:g} {y+u:g} {h01:g} ) {m} [ 1 0 0 {xo:g} ] [ 0 -1 0 {yo:g} ] 0 {xs:g} {ys:g}\n")
-	output_file.write(f"( {x:g} {y+u:g} {o:g} ) ( {x+u:g} {y+u:g} {o:g} ) ( {x:g} {y+u:g} {h01:g} ) {sm} [ 1 0 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write(f"( {x+u:g} {y:g} {o:g} ) ( {x+u:g} {y:g} {h10:g} ) ( {x+u:g} {y+u:g} {o:g} ) {sm} [ 0 1 0 0 ] [ 0 0 -1 0 ] 0 1 1\n")
-	output_file.write("}\n")
-
-if arguments.chunk_size > 0:
-	for x_chunk in range(iw // cs):
-		for y_chunk in range(ih // cs):
-			output_file.write("{\n")
-			write_entity_properties()
-			for i in range(x_chunk * cs - iw // 2, (x_chunk + 1) * cs - iw // 2):
-				for j in range(y_chunk * cs - ih // 2, (y_chunk + 1) * cs - ih // 2):
-					write_brush_at(i, j)
-			output_file.write("}\n")
-else:
-	output_file.write("{\n")
-	write_entity_properties()
-	for i in range(-iw // 2, iw // 2):
-		for j in range(-ih // 2, ih // 2):
-			write_brush_at(i, j)
-	output_file.write("}\n")
-
-# closing output file
-output_file.close()
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,83 @@
+import numpy as np
+
+# written map text counted for profiling, planes and brushes start with their first vertex
+map_text_patterns = [("entities", '{\n"'), ("groups", '"classname" "func_group"'), ("brushes", "{\n( "), ("planes", "\n( ")]
+
+# raised by the converters instead of quitting, command lines print the message
+class ConversionError(Exception):
+	pass
+
+# buffered map file writer shared by the converters
+class MapWriter:
+	def __init__(self, file, buffer_size = 1 << 20, cache_size = 1 << 20, profiler = None):
+		self.file = file
+		self.profiler = profiler
+		# end of the previous text, patterns can be split between two flushes
+		self.text_tail = ""
+		self.buffer = []
+		self.buffered_size = 0
+		self.buffer_size = buffer_size
+		# formatted text of numbers, snapped coordinates repeat a lot
+		self.numbers = {}
+		self.cache_size = cache_size
+
+	def write(self, text):
+		self.buffer.append(text)
+		self.buffered_size += len(text)
+		if self.buffered_size >= self.buffer_size:
+			self.flush()
+
+	# texts generated elsewhere, like in worker processes, are written in order
+	# by calling the function returning them when the buffer is flushed
+	def write_deferred(self, function):
+		self.buffer.append(function)
+
+	def flush(self):
+		is_profiled = self.profiler != None and self.profiler.enabled
+		if is_profiled:
+			self.profiler.start("writing")
+		if len(self.buffer) > 0:
+			text = "".join([item if isinstance(item, str) else item() for item in self.buffer])
+			if is_profiled:
+				self.count_text(text)
+			self.file.write(text)
+			self.buffer.clear()
+			self.buffered_size = 0
+		self.file.flush()
+		if is_profiled:
+			self.profiler.stop()
+
+	def count_text(self, text):
+		for name, pattern in map_text_patterns:
+			tail = self.text_tail[max(0, len(self.text_tail) - len(pattern) + 1):]
+			self.profiler.count(name, (tail + text).count(pattern))
+		self.profiler.count("bytes", len(text.encode()))
+		self.text_tail = (self.text_tail + text)[-32:]
+
+	def close(self):
+		self.flush()
+		self.file.close()
+
+	def format_number(self, value):
+		text = self.numbers.get(value)
+		if text == None:
+			text = f"{value:g}"
+			# zeros are not cached, since -0.0 and 0.0 are equal keys
+			if value != 0.0:
+				if len(self.numbers) >= self.cache_size:
+					self.numbers.clear()
+				self.numbers[value] = text
+		return text
+
+	# formats each unique vector of an (n, 3) array once,
+	# returns the texts and the index of the text for every vector
+	def format_vectors(self, vectors):
+		vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(-1, 3)
+		# comparing raw bits keeps the sign of zeros
+		unique_numbers, number_indices = np.unique(vectors.view(np.int64), return_inverse=True)
+		n = [self.format_number(value) for value in unique_numbers.view(np.float64).tolist()]
+		rows = np.ascontiguousarray(number_indices.reshape(-1, 3), dtype=np.int64)
+		unique_rows, indices = np.unique(rows.view(np.dtype((np.void, 24))).reshape(-1), return_inverse=True)
+		unique_rows = unique_rows.view(np.int64).reshape(-1, 3).tolist()
+		texts = [f"( {n[row[0]]} {n[row[1]]} {n[row[2]]} )" for row in unique_rows]
+		return texts, indices.reshape(-1)
@@ -1,5 +1,8 @@
 #!/usr/bin/python
-import os, argparse, math, re
+import os, sys, argparse, math, re, array, io, mmap, multiprocessing, threading, hashlib, itertools, json
+import numpy as np
+from mapwriter import MapWriter, ConversionError
+from profiler import Profiler
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("input", type=str, help="input object or a directory of objects")
@@ -15,6 +18,7 @@ parser.add_argument("--material_list", type=str, default="", help="semicolon sep
 parser.add_argument("--skip_material", type=str, default="SKIP", help="material name for other pyramids faces")
 parser.add_argument("--skip_material_list", type=str, default="", help="same as material list, used for bipyramids")
 parser.add_argument("--vertex_color_materials", action="store_true", help="use unique vertex colors as materials")
+parser.add_argument("--max_color_materials", type=int, help="if provided, will reduce vertex colors to fewer materials")
 parser.add_argument("--phong_angle", type=float, default=89.0, help="smooth shading split angle")
 parser.add_argument("--uv_valve", action="store_true", help="use valve format when writing uvs")
 parser.add_argument("--disable_objects", action="store_true", help="merge objects into a single object")
@@ -25,572 +29,2560 @@ parser.add_argument("--disable_smooth_groups", action="store_true", help="don't
 parser.add_argument("--disable_grid_snap", action="store_true", help="use precise coordinates for geometry")
 parser.add_argument("--disable_layers", action="store_true", help="will not write TrechBroom layers")
 parser.add_argument("--epsilon", type=float, default=0.001, help="in map units for convex objects")
+parser.add_argument("--validate", action="store_true", help="drop and report brushes without volume")
+parser.add_argument("--weld_vertices", action="store_true", help="weld vertices within epsilon, remove degenerate and duplicate triangles")
+parser.add_argument("--convex_hull", action="store_true", help="use convex hull planes for convex objects")
+parser.add_argument("--merge_coplanar", action="store_true", help="merge coplanar triangles into prism brushes")
+parser.add_argument("--target_brushes", type=int, help="if provided, will decimate objects with more brushes")
+parser.add_argument("--partition_size", type=float, help="if provided, will split objects into entities by grid cells")
+parser.add_argument("--partition_brushes", type=int, help="if provided, will split objects into entities with fewer brushes")
 parser.add_argument("--game", type=str, default="Generic", help="game type for TrenchBroom")
 parser.add_argument("--info", action="store_true", help="print objects information")
+parser.add_argument("--info_json", action="store_true", help="print objects information as JSON")
+parser.add_argument("--stream", action="store_true", help="write objects while reading, without sorting")
+parser.add_argument("--cache_directory", type=str, help="reuse parsed objects between runs")
+parser.add_argument("--cache_size", type=float, default=1024.0, help="cache directory limit in megabytes")
+parser.add_argument("--jobs", type=int, default=1, help="processes for input files, ranges of big files or big objects, 0 uses all cores")
+parser.add_argument("--update", action="store_true", help="rewrite only changed objects of the output map")
+parser.add_argument("--profile", type=str, nargs="?", const="", help="print stage times to stderr or to a JSON file")
+parser.add_argument("--profile_stage", type=str, help="run cProfile for a single stage, stats are saved to output.prof")
 parser.add_argument("--append_to_output", action="store_true")
 parser.add_argument("--output", type=str)
-arguments = parser.parse_args()
-
-# validating input arguments
-if not abs(arguments.normal_offset) > 0.0:
-	print("Normal offset must be different from zero!")
-	quit()
-if arguments.secondary_normal_offset != None:
-	if not abs(arguments.secondary_normal_offset) > 0.0:
-		print("Secondary normal offset must be different from zero!")
-		quit()
-	if not arguments.secondary_normal_brush:
-		if not arguments.secondary_normal_offset * arguments.normal_offset > 0.0:
-			print("Normal offset and secondary normal offset must have different direction!")
-			quit()
-if not abs(arguments.grid_snap_step) > 0.0:
-	arguments.disable_grid_snap = True
-
-arguments.squared_epsilon = arguments.epsilon * arguments.epsilon
-arguments.material_list = (";" + arguments.material_list).split(";")
-arguments.skip_material_list = (";" + arguments.skip_material_list).split(";")
-
-# using input file name for the output if not provided
-input_basename = os.path.basename(arguments.input)
-input_name = os.path.splitext(input_basename)[0]
-if arguments.output == None:
-	arguments.output = input_name + ".map"
+profile_stages = ["parse", "vertex_colors", "sorting", "info", "update", "convexify", "decimate", "merge_coplanar", "brushes", "paths", "writing"]
+
+# parses command line arguments, library options override the defaults without reading the command line
+def get_arguments(argv = None, **options):
+	arguments = parser.parse_args(argv if argv != None else [""])
+	for key, value in options.items():
+		if not key in vars(arguments):
+			raise ConversionError(f"Unknown option: {key}")
+		setattr(arguments, key, value)
+	return arguments
+
+# inputs and outputs are paths or streams
+def is_path(value):
+	return value == None or isinstance(value, (str, os.PathLike))
+
+# streams are named after their files if they have any
+def get_input_name(input):
+	if is_path(input):
+		return os.path.splitext(os.path.basename(input))[0]
+	name = getattr(input, "name", None)
+	return os.path.splitext(os.path.basename(name))[0] if isinstance(name, str) else "input"
 
 def sorted_alphanumeric(data):
 	convert = lambda text: int(text) if text.isdigit() else text.lower()
 	alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
 	return sorted(data, key=alphanum_key, reverse=False)
 
-def vector3_substract(a, b):
-	return [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
-
-def vector3_multiply_by_scalar(a, s):
-	return [a[0] * s, a[1] * s, a[2] * s]
-
-def vector3_cross(a, b):
-	return [a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]]
-
-def vector3_length_squared(v):
-	return v[0] * v[0] + v[1] * v[1] + v[2] * v[2]
-
-def vector3_length(v):
-	return math.sqrt(vector3_length_squared(v))
-
-def vector3_normalize(v):
-	length = vector3_length(v)
-	if length:
-		return [(v[0] / length), (v[1] / length), (v[2] / length)]
-	return [0.0, 0.0, 0.0]
-
 def vector3_grid_snap(v, s):
 	return [math.floor(v[0] / s + 0.5) * s, math.floor(v[1] / s + 0.5) * s, math.floor(v[2] / s + 0.5) * s]
 
-def triangle_get_center(a, b, c):
-	return [(a[0] + b[0] + c[0]) / 3.0, (a[1] + b[1] + c[1]) / 3.0, (a[2] + b[2] + c[2]) / 3.0]
-
-def triangle_get_clockwise_normal(a, b, c):
-	return vector3_normalize(vector3_cross(vector3_substract(a, c), vector3_substract(a, b)))
-
-def triangle_get_counterclockwise_normal(a, b, c):
-	return vector3_normalize(vector3_cross(vector3_substract(a, b), vector3_substract(a, c)))
-
-def triangle_get_valve_uv(a, b, c):
-	normal = triangle_get_clockwise_normal(a, b, c)
-	if abs(normal[0]) > abs(normal[1]) and abs(normal[0]) > abs(normal[2]):
-		return "[ 0 1 0 0 ] [ 0 0 -1 0 ]"
-	elif abs(normal[1]) > abs(normal[0]) and abs(normal[1]) > abs(normal[2]):
-		return "[ 1 0 0 0 ] [ 0 0 -1 0 ]"
-	else:
-		return "[ 1 0 0 0 ] [ 0 -1 0 0 ]"
-
-def triangle_get_standard_uv(a, b, c):
-	return "0 0"
-
-# trying to get input file paths
-input_file_paths = []
-input_is_directory = False
-if os.path.isdir(arguments.input):
-	for path in os.listdir(arguments.input):
-		file_path = os.path.join(arguments.input, path)
-		if os.path.isfile(file_path) and file_path.endswith(".obj"):
-			input_file_paths.append(file_path)
-	input_file_paths = sorted_alphanumeric(input_file_paths)
-	input_is_directory = True
-else:
-	input_file_paths = [arguments.input]
-
-# processing input files
-input_data = []
-for input_file_path in input_file_paths:
+# batched versions operate on arrays of vectors with the shape (..., 3)
+def vectors3_cross(a, b):
+	x = a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1]
+	y = a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2]
+	z = a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+	return np.stack((x, y, z), axis=-1)
+
+def vectors3_length(v):
+	return np.sqrt(v[..., 0] * v[..., 0] + v[..., 1] * v[..., 1] + v[..., 2] * v[..., 2])
+
+def vectors3_normalize(v):
+	length = vectors3_length(v)[..., None]
+	return np.divide(v, length, out=np.zeros_like(v), where=(length != 0.0))
+
+def vectors3_grid_snap(v, s):
+	return np.floor(v / s + 0.5) * s
+
+def triangles_get_center(a, b, c):
+	return (a + b + c) / 3.0
+
+def triangles_get_clockwise_normal(a, b, c):
+	return vectors3_normalize(vectors3_cross(a - c, a - b))
+
+def triangles_get_counterclockwise_normal(a, b, c):
+	return vectors3_normalize(vectors3_cross(a - b, a - c))
+
+valve_uvs = ["[ 0 1 0 0 ] [ 0 0 -1 0 ]", "[ 1 0 0 0 ] [ 0 0 -1 0 ]", "[ 1 0 0 0 ] [ 0 -1 0 0 ]"]
+def triangles_get_valve_uv(a, b, c):
+	n = np.abs(triangles_get_clockwise_normal(a, b, c))
+	x_axis = (n[:, 0] > n[:, 1]) & (n[:, 0] > n[:, 2])
+	y_axis = (n[:, 1] > n[:, 0]) & (n[:, 1] > n[:, 2])
+	return [valve_uvs[index] for index in np.where(x_axis, 0, np.where(y_axis, 1, 2)).tolist()]
+
+def triangles_get_standard_uv(a, b, c):
+	return ["0 0"] * len(a)
+
+def get_smooth_groups(data, triangles):
+	smooth_groups = {}
+	triangle_smooth_groups = data["triangle_smooth_groups"][triangles]
+	order = np.argsort(triangle_smooth_groups, kind="stable")
+	groups, group_starts = np.unique(triangle_smooth_groups[order], return_index=True)
+	group_triangles = np.split(triangles[order], group_starts[1:])
+	# keeping smooth groups in the order of their first appearance
+	for index in np.argsort(order[group_starts], kind="stable").tolist():
+		smooth_groups[int(groups[index])] = group_triangles[index]
+	return smooth_groups
+
+def get_object_smooth_groups(data):
+	object_smooth_groups = {}
+	triangles = np.argsort(data["triangle_objects"], kind="stable")
+	objects, object_starts = np.unique(data["triangle_objects"][triangles], return_index=True)
+	for object_id, object_triangles in zip(objects.tolist(), np.split(triangles, object_starts[1:])):
+		object_smooth_groups[object_id] = get_smooth_groups(data, object_triangles)
+	return object_smooth_groups
+
+def create_obj_data(input_file_path):
+	data = {}
+	data["name"] = get_input_name(input_file_path)
+	data["path"] = input_file_path if is_path(input_file_path) else data["name"]
+	data["group_id"] = None
+	# objects and materials are interned, triangles store their indices
+	data["objects"] = [""]
+	data["object_ids"] = {"": 0}
+	data["materials"] = [""]
+	data["material_ids"] = {"": 0}
+	# mesh is stored as flat arrays instead of per vertex and triangle lists
+	data["vertex_buffer"] = array.array("d")
+	data["color_buffer"] = array.array("q")
+	data["triangle_buffer"] = array.array("q")
+	data["smooth_group_buffer"] = array.array("q")
+	data["material_buffer"] = array.array("q")
+	data["object_buffer"] = array.array("q")
+	data["lines"] = []
+	return data
+
+# vertex colors are stored as 24-bit integers, channels are clamped to bytes
+def pack_colors(colors):
+	colors = np.clip(colors, 0, 255)
+	return (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+
+def unpack_colors(colors):
+	return np.stack(((colors >> 16) & 255, (colors >> 8) & 255, colors & 255), axis=1)
+
+# reduces unique colors to a palette with median cut, boxes with the largest
+# weighted channel range are split at their weighted median until there are enough,
+# returns the weighted mean color of the box for every color
+def get_median_cut_colors(colors, weights, max_colors):
+	channels = unpack_colors(colors)
+	boxes = [np.arange(len(colors))]
+	def get_box_score(box):
+		if len(box) < 2:
+			return -1
+		ranges = np.ptp(channels[box], axis=0)
+		return int(np.max(ranges)) * int(np.sum(weights[box]))
+	scores = [get_box_score(boxes[0])]
+	while len(boxes) < max_colors:
+		box_index = int(np.argmax(scores))
+		if scores[box_index] <= 0:
+			break
+		box = boxes[box_index]
+		channel = int(np.argmax(np.ptp(channels[box], axis=0)))
+		box = box[np.argsort(channels[box, channel], kind="stable")]
+		box_weights = np.cumsum(weights[box])
+		split = int(np.searchsorted(box_weights, box_weights[-1] / 2.0, side="right"))
+		split = min(max(split, 1), len(box) - 1)
+		boxes[box_index], scores[box_index] = box[:split], get_box_score(box[:split])
+		boxes.append(box[split:])
+		scores.append(get_box_score(box[split:]))
+
+	box_ids = np.zeros(len(colors), dtype=np.int64)
+	for box_index, box in enumerate(boxes):
+		box_ids[box] = box_index
+	box_weights = np.bincount(box_ids, weights=weights, minlength=len(boxes))
+	box_colors = [np.bincount(box_ids, weights=channels[:, channel] * weights, minlength=len(boxes)) / box_weights for channel in range(3)]
+	box_colors = np.rint(np.stack(box_colors, axis=1)).astype(np.int64)
+	return pack_colors(box_colors)[box_ids]
+
+# changed when cached arrays change, older cache files are then left for eviction
+cache_version = 1
+
+def read_cache_file(cache_path, input_file_path):
 	try:
-		input_file = open(input_file_path, 'r')
+		arrays = np.load(cache_path, allow_pickle=False)
 	except Exception:
-		if not input_is_directory:
-			print(f"Failed opening input file: {arguments.input}")
-			quit()
+		return None
+	data = {}
+	data["name"] = os.path.splitext(os.path.basename(input_file_path))[0]
+	data["path"] = input_file_path
+	data["group_id"] = None
+	with arrays:
+		data["objects"] = arrays["objects"].tolist()
+		data["materials"] = arrays["materials"].tolist()
+		for key in ["vertices", "triangles", "triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+			data[key] = arrays[key]
+		line_objects = arrays["line_objects"].tolist()
+		line_offsets = arrays["line_offsets"].tolist()
+		line_vertices = arrays["line_vertices"].tolist()
+	data["object_ids"] = {name: index for index, name in enumerate(data["objects"])}
+	data["material_ids"] = {name: index for index, name in enumerate(data["materials"])}
+	data["lines"] = []
+	for index, object_id in enumerate(line_objects):
+		data["lines"].append([data["objects"][object_id]])
+		data["lines"][-1].extend(line_vertices[line_offsets[index]:line_offsets[index + 1]])
+	data["object_smooth_groups"] = get_object_smooth_groups(data)
+	# marking cache file as recently used for eviction
+	os.utime(cache_path)
+	return data
+
+# token columns read at once by the vectorized parsers
+token_window = 24
+token_chunk_size = 1 << 20
+token_powers = np.array([float(10 ** power) for power in range(token_window)])
+
+# reads characters of tokens into rows of columns, padded with spaces
+def get_token_columns(text, starts, lengths):
+	width = max(1, min(token_window, int(np.max(lengths, initial=1))))
+	rows = np.arange(width)[:, None]
+	columns = text[np.minimum(starts + rows, len(text) - 1)]
+	return np.where(rows < lengths, columns, ord(" "))
+
+# parses decimal numbers of up to 15 digits without exponents exactly like float(),
+# since both the mantissa and the power of ten are exact, other numbers use float()
+def parse_float_tokens(text, token_starts, token_ends):
+	values = np.zeros(len(token_starts), dtype=np.float64)
+	for start in range(0, len(token_starts), token_chunk_size):
+		starts = token_starts[start:start + token_chunk_size]
+		lengths = token_ends[start:start + token_chunk_size] - starts
+		columns = get_token_columns(text, starts, lengths)
+		is_negative = (columns[0] == ord("-"))
+		is_valid = (lengths <= token_window)
+		is_fraction = np.zeros(len(starts), dtype=bool)
+		digit_counts = np.zeros(len(starts), dtype=np.int64)
+		fraction_counts = np.zeros(len(starts), dtype=np.int64)
+		mantissas = np.zeros(len(starts), dtype=np.int64)
+		for index, column in enumerate(columns):
+			is_digit = (column >= ord("0")) & (column <= ord("9"))
+			is_dot = (column == ord("."))
+			mantissas = np.where(is_digit, mantissas * 10 + (column - ord("0")), mantissas)
+			digit_counts += is_digit
+			fraction_counts += is_digit & is_fraction
+			is_allowed = is_digit | (is_dot & ~is_fraction) | (column == ord(" "))
+			if index == 0:
+				is_allowed |= (column == ord("-")) | (column == ord("+"))
+			is_valid &= is_allowed
+			is_fraction |= is_dot
+		is_valid &= (digit_counts > 0) & (digit_counts <= 15)
+
+		chunk_values = mantissas / token_powers[fraction_counts]
+		chunk_values = np.where(is_negative, -chunk_values, chunk_values)
+		for index in np.flatnonzero(~is_valid).tolist():
+			chunk_values[index] = float(text[starts[index]:starts[index] + lengths[index]].tobytes())
+		values[start:start + token_chunk_size] = chunk_values
+	return values
+
+# parses leading integers of face vertices like "12/5/7"
+def parse_integer_tokens(text, token_starts, token_ends):
+	values = np.zeros(len(token_starts), dtype=np.int64)
+	for start in range(0, len(token_starts), token_chunk_size):
+		starts = token_starts[start:start + token_chunk_size]
+		is_negative = (text[starts] == ord("-"))
+		starts = starts + is_negative
+		columns = get_token_columns(text, starts, token_ends[start:start + token_chunk_size] - starts)
+		is_number = np.ones(len(starts), dtype=bool)
+		chunk_values = np.zeros(len(starts), dtype=np.int64)
+		for column in columns:
+			is_number &= (column >= ord("0")) & (column <= ord("9"))
+			chunk_values = np.where(is_number, chunk_values * 10 + (column - ord("0")), chunk_values)
+		values[start:start + token_chunk_size] = np.where(is_negative, -chunk_values, chunk_values)
+	return values
+
+# finds values of statements like "usemtl" for the lines following them
+def get_statement_values(statement_lines, statement_values, lines):
+	indices = np.searchsorted(statement_lines, lines, side="right") - 1
+	values = np.array([0] + statement_values, dtype=np.int64)
+	return values[indices + 1]
+
+# statements changing the object, smooth group or material of the following faces
+statement_types = {"o": "objects", "g": "objects", "s": "smooth_groups", "usemtl": "materials"}
+
+# bytes of files parsed at once, ranges end after the first newline following their size
+obj_range_size = 1 << 24
+def get_obj_ranges(input_file_path):
+	size = os.path.getsize(input_file_path)
+	if size == 0:
+		return []
+	file_ranges = []
+	with open(input_file_path, "rb") as input_file:
+		with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+			start = 0
+			while start < size:
+				end = mapped_file.find(b"\n", min(start + obj_range_size, size) - 1) + 1
+				end = size if end <= 0 else end
+				file_ranges.append((input_file_path, start, end))
+				start = end
+	return file_ranges
+# braces of blocks and properties of entities are found in a single pass over mapped files
+update_map_pattern = re.compile(rb'^[ \t]*(?:([{}])|"(.*?)" "(.*)")[ \t\r]*$', re.MULTILINE)
+
+
+
+# number of triangles converted into brushes at once
+brush_batch_size = 65536
+# smallest batch worth sending to a worker process
+min_brush_batch_size = 4096
+
+# brush planes as vertex indices, the last plane is facing outwards
+positive_brush_planes = [(0, 3, 2), (1, 3, 0), (2, 3, 1), (0, 2, 1)]
+negative_brush_planes = [(0, 2, 3), (1, 0, 3), (2, 1, 3), (0, 1, 2)]
+
+# triangles of invalid brushes printed at most for every object
+max_reported_triangles = 10
+
+
+
+# distance of c from the line through a and b, positive when turning counterclockwise around n
+def get_turn_distance(a, b, c, n):
+	u = [b[0] - a[0], b[1] - a[1], b[2] - a[2]]
+	v = [c[0] - b[0], c[1] - b[1], c[2] - b[2]]
+	length = math.sqrt(u[0] * u[0] + u[1] * u[1] + u[2] * u[2])
+	if length == 0.0:
+		return 0.0
+	x = u[1] * v[2] - u[2] * v[1]
+	y = u[2] * v[0] - u[0] * v[2]
+	z = u[0] * v[1] - u[1] * v[0]
+	return (x * n[0] + y * n[1] + z * n[2]) / length
+
+
+
+# spreads 10 bits of cell coordinates into every third bit of Morton codes
+partition_depth = 10
+def get_morton_bits(v):
+	v = (v | (v << 16)) & 0x030000FF
+	v = (v | (v << 8)) & 0x0300F00F
+	v = (v | (v << 4)) & 0x030C30C3
+	return (v | (v << 2)) & 0x09249249
+
+
+
+# hash grid cells are twice the epsilon wide, so planes or vertices closer than epsilon share a cell
+# or lie in one of the neighbouring cells on their near sides, 15 cells for planes and 7 for vertices
+grid_cell_offsets = {size: np.array(list(itertools.product([0, 1], repeat=size))[1:], dtype=np.int64) for size in [3, 4]}
+
+# cells are packed into integers when their ranges fit, with a margin for neighbouring cells,
+# otherwise their raw bytes are compared, which is much slower for sorting and searching
+def get_plane_keys(grid, cells):
+	if grid["radices"] is None:
+		return np.ascontiguousarray(cells).view(np.dtype((np.void, 8 * cells.shape[1]))).reshape(-1)
+	shifted_cells = cells - grid["origin"]
+	keys = shifted_cells @ grid["radices"]
+	# cells outside of the grid range don't match any key
+	keys[~np.all((shifted_cells >= 0) & (shifted_cells < grid["spans"]), axis=1)] = -1
+	return keys
+
+def get_triangle_planes(a, b, c):
+	normals = triangles_get_counterclockwise_normal(a, b, c)
+	distances = normals[:, 0] * a[:, 0] + normals[:, 1] * a[:, 1] + normals[:, 2] * a[:, 2]
+	return np.column_stack((normals, distances))
+
+
+
+# hull lattice spans below 2^19 keep the products of their coordinates in 64 bits
+max_hull_span = 1 << 19
+
+# returns integer normals, offsets and lengths of normals of faces,
+# distances of points are exact integers scaled by the lengths
+def get_hull_planes(lattice, faces):
+	a = np.take(lattice, faces[:, 0], axis=0)
+	normals = vectors3_cross(np.take(lattice, faces[:, 1], axis=0) - a, np.take(lattice, faces[:, 2], axis=0) - a)
+	return normals, np.einsum("ij,ij->i", normals, a), np.sqrt(np.sum(normals.astype(np.float64) ** 2, axis=1))
+
+def get_hull_distances(lattice, normals, offsets, point_indices, face_indices):
+	# taking rows is a lot faster than indexing them
+	return np.einsum("ij,ij->i", np.take(normals, face_indices, axis=0), np.take(lattice, point_indices, axis=0)) - offsets[face_indices]
+
+# returns the index of the face sharing each edge of every face in the opposite direction
+def get_face_neighbours(faces, vertex_count):
+	edge_starts = faces.reshape(-1)
+	edge_ends = faces[:, [1, 2, 0]].reshape(-1)
+	edge_keys = edge_starts * vertex_count + edge_ends
+	edge_order = np.argsort(edge_keys)
+	positions = np.searchsorted(edge_keys[edge_order], edge_ends * vertex_count + edge_starts)
+	return (edge_order[positions] // 3).reshape(-1, 3)
+
+def is_in_sorted(keys, sorted_keys):
+	positions = np.minimum(np.searchsorted(sorted_keys, keys), max(len(sorted_keys) - 1, 0))
+	return (sorted_keys[positions] == keys) if len(sorted_keys) > 0 else np.zeros(len(keys), dtype=bool)
+
+# candidates are added at once when no other one sees their visible or hidden faces, since hidden faces
+# stay below the cones of both, each pass accepts candidates coming first on all their faces
+def get_independent_candidates(candidate_count, face_count, visible_candidates, visible_faces, hidden_candidates, hidden_faces):
+	candidates = np.concatenate((visible_candidates, hidden_candidates))
+	faces = np.concatenate((visible_faces, hidden_faces))
+	is_visible = np.arange(len(faces)) < len(visible_faces)
+	is_accepted = np.zeros(candidate_count, dtype=bool)
+	# face arrays are only reset where they were changed, they can be a lot bigger than the candidates
+	owners = np.full(face_count, candidate_count, dtype=np.int64)
+	viewers = np.full(face_count, candidate_count, dtype=np.int64)
+	while len(candidates) > 0:
+		np.minimum.at(owners, faces, candidates)
+		np.minimum.at(viewers, faces[is_visible], candidates[is_visible])
+		is_first = np.ones(candidate_count, dtype=bool)
+		is_first[candidates[np.where(is_visible, owners[faces], viewers[faces]) < candidates]] = False
+		is_first_pair = is_first[candidates]
+		is_accepted[candidates[is_first_pair]] = True
+		owners[faces], viewers[faces] = candidate_count, candidate_count
+		# dropping candidates changing faces of accepted ones, visible faces of accepted ones
+		# are marked as seen by -1, their hidden faces as owned by -1
+		viewers[faces[is_first_pair & is_visible]] = -1
+		owners[faces[is_first_pair & ~is_visible]] = -1
+		is_dropped = is_first
+		is_dropped[candidates[(viewers[faces] < 0) | ((owners[faces] < 0) & is_visible)]] = True
+		owners[faces], viewers[faces] = candidate_count, candidate_count
+		is_kept = ~is_dropped[candidates]
+		candidates, faces, is_visible = candidates[is_kept], faces[is_kept], is_visible[is_kept]
+	return is_accepted
+
+# returns hull triangles as lattice point indices, counterclockwise seen from outside
+def get_convex_hull(lattice):
+	hull = np.zeros((0, 3), dtype=np.int64)
+	if len(lattice) < 4:
+		return hull
+
+	# starting from a tetrahedron of extreme points
+	i0 = int(np.argmin(lattice[:, 0]))
+	offsets = lattice - lattice[i0]
+	i1 = int(np.argmax(np.sum(offsets * offsets, axis=1)))
+	normals = vectors3_cross(offsets, offsets[i1][None])
+	i2 = int(np.argmax(np.sum(normals.astype(np.float64) ** 2, axis=1)))
+	if not np.any(normals[i2] != 0):
+		return hull
+	distances = np.sum(offsets * vectors3_cross(offsets[i1], offsets[i2]), axis=1)
+	i3 = int(np.argmax(np.abs(distances)))
+	if distances[i3] == 0:
+		return hull
+	if distances[i3] > 0:
+		i1, i2 = i2, i1
+
+	# faces are stored in arrays growing twice as big when they are full
+	capacity = max(64, 2 * len(lattice))
+	faces = np.zeros((capacity, 3), dtype=np.int64)
+	normals = np.zeros((capacity, 3), dtype=np.int64)
+	offsets = np.zeros(capacity, dtype=np.int64)
+	lengths = np.ones(capacity)
+	neighbours = np.zeros((capacity, 3), dtype=np.int64)
+	face_apexes = np.full(capacity, -1, dtype=np.int64)
+	apex_distances = np.zeros(capacity)
+	is_alive = np.zeros(capacity, dtype=bool)
+	faces[0:4] = [(i0, i1, i2), (i0, i3, i1), (i1, i3, i2), (i2, i3, i0)]
+	normals[0:4], offsets[0:4], lengths[0:4] = get_hull_planes(lattice, faces[0:4])
+	neighbours[0:4] = get_face_neighbours(faces[0:4], len(lattice))
+	is_alive[0:4] = True
+	face_count = 4
+
+	# every point outside of the hull is assigned to the first of the given faces it is outside of,
+	# so that few faces are tested for most of them, points on faces are inside and no point outside is ever dropped
+	point_faces = np.full(len(lattice), -1, dtype=np.int64)
+	def assign_points(point_indices, first_faces, face_counts):
+		point_faces[point_indices] = -1
+		remaining = np.arange(len(point_indices))
+		for index in range(int(np.max(face_counts, initial=0))):
+			remaining = remaining[face_counts[remaining] > index]
+			faces_to_test = first_faces[remaining] + index
+			is_outside = get_hull_distances(lattice, normals, offsets, point_indices[remaining], faces_to_test) > 0
+			point_faces[point_indices[remaining[is_outside]]] = faces_to_test[is_outside]
+			remaining = remaining[~is_outside]
+		point_indices = point_indices[point_faces[point_indices] >= 0]
+		assigned_faces = point_faces[point_indices]
+		scaled_distances = get_hull_distances(lattice, normals, offsets, point_indices, assigned_faces) / lengths[assigned_faces]
+		# the farthest point of each face is its apex
+		np.maximum.at(apex_distances, assigned_faces, scaled_distances)
+		is_farthest = (scaled_distances == apex_distances[assigned_faces])
+		face_apexes[assigned_faces[is_farthest]] = point_indices[is_farthest]
+	assign_points(np.arange(len(lattice)), np.zeros(len(lattice), dtype=np.int64), np.full(len(lattice), 4))
+
+	# every round the farthest point of each face with outside points is a candidate apex,
+	# candidates are ordered by hashes of their points, since ordering them by distances
+	# would let few of them come before all other candidates changing the same faces
+	while True:
+		seed_faces = np.flatnonzero(face_apexes[0:face_count] >= 0)
+		if len(seed_faces) == 0:
+			break
+		apexes = face_apexes[seed_faces]
+		order = np.argsort((apexes * 2654435761) & 0xffffffff, kind="stable")
+		apexes, seed_faces = apexes[order], seed_faces[order]
+		# walking over visible faces is costly, so candidates are first selected around their first faces,
+		# the neighbours they see are visible and the faces around those are likely hidden
+		candidate_count = len(apexes)
+		near_candidates = np.repeat(np.arange(candidate_count), 3)
+		near_faces = np.take(neighbours, seed_faces, axis=0).reshape(-1)
+		is_near_visible = get_hull_distances(lattice, normals, offsets, apexes[near_candidates], near_faces) > 0
+		ring_candidates = np.repeat(near_candidates[is_near_visible], 3)
+		ring_faces = np.take(neighbours, near_faces[is_near_visible], axis=0).reshape(-1)
+		is_walked = get_independent_candidates(candidate_count, face_count,
+			np.concatenate((np.arange(candidate_count), near_candidates[is_near_visible])), np.concatenate((seed_faces, near_faces[is_near_visible])),
+			np.concatenate((near_candidates[~is_near_visible], ring_candidates)), np.concatenate((near_faces[~is_near_visible], ring_faces)))
+		apexes, seed_faces = apexes[is_walked], seed_faces[is_walked]
+		candidate_count = len(apexes)
+
+		# finding faces visible from the apexes by walking over neighbours
+		visible_candidates, visible_faces = [np.arange(candidate_count)], [seed_faces]
+		checked_keys = np.sort(visible_candidates[0] * face_count + seed_faces)
+		frontier_candidates, frontier_faces = visible_candidates[0], seed_faces
+		while len(frontier_faces) > 0:
+			keys = np.sort(np.repeat(frontier_candidates, 3) * face_count + np.take(neighbours, frontier_faces, axis=0).reshape(-1))
+			keys = keys[np.r_[True, keys[1:] != keys[:-1]] & ~is_in_sorted(keys, checked_keys)]
+			checked_keys = np.sort(np.concatenate((checked_keys, keys)))
+			candidates, candidate_faces = keys // face_count, keys % face_count
+			is_visible = get_hull_distances(lattice, normals, offsets, apexes[candidates], candidate_faces) > 0
+			frontier_candidates, frontier_faces = candidates[is_visible], candidate_faces[is_visible]
+			visible_candidates.append(frontier_candidates)
+			visible_faces.append(frontier_faces)
+		visible_candidates, visible_faces = np.concatenate(visible_candidates), np.concatenate(visible_faces)
+		visible_keys = np.sort(visible_candidates * face_count + visible_faces)
+
+		# horizon edges of visible faces border faces hidden from the same apex
+		edge_candidates = np.repeat(visible_candidates, 3)
+		edge_faces = np.repeat(visible_faces, 3)
+		edge_corners = np.tile(np.arange(3), len(visible_faces))
+		hidden_faces = np.take(neighbours, visible_faces, axis=0).reshape(-1)
+		is_horizon = ~is_in_sorted(edge_candidates * face_count + hidden_faces, visible_keys)
+		edge_candidates, edge_faces = edge_candidates[is_horizon], edge_faces[is_horizon]
+		edge_corners, hidden_faces = edge_corners[is_horizon], hidden_faces[is_horizon]
+
+		is_accepted = get_independent_candidates(candidate_count, face_count, visible_candidates, visible_faces, edge_candidates, hidden_faces)
+		is_kept = is_accepted[visible_candidates]
+		visible_candidates, visible_faces = visible_candidates[is_kept], visible_faces[is_kept]
+		order = np.flatnonzero(is_accepted[edge_candidates])
+		order = order[np.argsort(edge_candidates[order], kind="stable")]
+		edge_candidates, edge_faces = edge_candidates[order], edge_faces[order]
+		edge_corners, hidden_faces = edge_corners[order], hidden_faces[order]
+
+		# replacing visible faces with cones from the horizons to the apexes
+		new_face_count = face_count + len(edge_faces)
+		if new_face_count > capacity:
+			capacity = max(2 * capacity, new_face_count)
+			faces, normals, neighbours = [np.resize(array, (capacity, 3)) for array in [faces, normals, neighbours]]
+			offsets, lengths, face_apexes, apex_distances, is_alive = [np.resize(array, capacity) for array in [offsets, lengths, face_apexes, apex_distances, is_alive]]
+		u = faces[edge_faces, edge_corners]
+		v = faces[edge_faces, (edge_corners + 1) % 3]
+		new_indices = np.arange(face_count, new_face_count)
+		faces[face_count:new_face_count] = np.column_stack((u, v, apexes[edge_candidates]))
+		normals[face_count:new_face_count], offsets[face_count:new_face_count], lengths[face_count:new_face_count] = get_hull_planes(lattice, faces[face_count:new_face_count])
+		neighbours[face_count:new_face_count, 0] = hidden_faces
+		hidden_corners = np.argmax(np.take(neighbours, hidden_faces, axis=0) == edge_faces[:, None], axis=1)
+		neighbours[hidden_faces, hidden_corners] = new_indices
+		# cone faces of an apex share the edges from the horizon vertices to the apex
+		start_keys = edge_candidates * len(lattice) + u
+		end_keys = edge_candidates * len(lattice) + v
+		starts_order, ends_order = np.argsort(start_keys), np.argsort(end_keys)
+		neighbours[face_count:new_face_count, 1] = new_indices[starts_order[np.searchsorted(start_keys[starts_order], end_keys)]]
+		neighbours[face_count:new_face_count, 2] = new_indices[ends_order[np.searchsorted(end_keys[ends_order], start_keys)]]
+		face_apexes[face_count:new_face_count] = -1
+		apex_distances[face_count:new_face_count] = 0.0
+		face_apexes[visible_faces] = -1
+		is_alive[face_count:new_face_count] = True
+		is_alive[visible_faces] = False
+
+		# points outside of removed faces are assigned to the cone faces of the same apex
+		point_faces[apexes[is_accepted]] = -1
+		face_candidates = np.full(face_count, -1, dtype=np.int64)
+		face_candidates[visible_faces] = visible_candidates
+		moved_points = np.flatnonzero(point_faces >= 0)
+		moved_points = moved_points[face_candidates[point_faces[moved_points]] >= 0]
+		moved_candidates = face_candidates[point_faces[moved_points]]
+		point_faces[moved_points] = -1
+		cone_starts = np.searchsorted(edge_candidates, np.arange(candidate_count + 1))
+		assign_points(moved_points, face_count + cone_starts[moved_candidates], np.diff(cone_starts)[moved_candidates])
+		face_count = new_face_count
+
+	return faces[0:face_count][is_alive[0:face_count]]
+
+
+
+def append_triangles(data, vertices, triangles, source_triangles):
+	first_triangle = len(data["triangles"])
+	triangles = triangles + len(data["vertices"])
+	data["vertices"] = np.concatenate((data["vertices"], vertices))
+	data["triangles"] = np.concatenate((data["triangles"], triangles))
+	for key in ["triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+		data[key] = np.concatenate((data[key], data[key][source_triangles]))
+	return np.arange(first_triangle, len(data["triangles"]))
+
+
+
+# arguments which don't change generated entities or are hashed with them
+update_ignored_arguments = ["input", "output", "update", "append_to_output", "info", "stream", "jobs", "cache_directory", "cache_size"]
+update_ignored_arguments += ["profile", "profile_stage"]
+update_ignored_arguments += ["material", "material_list", "skip_material", "skip_material_list"]
+
+
+
+group_id_pattern = re.compile(r'^("_tb_(?:id|layer|group)" ")([0-9]+)(")$', re.MULTILINE)
+def offset_group_ids(text, offset_group_id):
+	return group_id_pattern.sub(lambda m: m[1] + str(offset_group_id(int(m[2]))) + m[3], text)
+
+
+
+# workers are forked while a converter creates their pool, tasks name its methods since converters
+# can't be sent to workers, their profilers count from zero and the counts are returned with each result
+worker_converter = None
+worker_lock = threading.Lock()
+def run_worker_task(task):
+	method_name, argument = task
+	profiler = worker_converter.profiler
+	profiler.counters = {}
+	return (getattr(worker_converter, method_name)(argument), profiler.counters)
+
+
+
+# converts objects with parsed arguments, every conversion has its own converter,
+# so calls from other threads or nested in reading input streams don't share any state
+class ObjConverter:
+	def __init__(self, arguments):
+		# validating input arguments, they are copied since material lists are split
+		arguments = argparse.Namespace(**vars(arguments))
+		if not abs(arguments.normal_offset) > 0.0:
+			raise ConversionError("Normal offset must be different from zero!")
+		if arguments.secondary_normal_offset != None:
+			if not abs(arguments.secondary_normal_offset) > 0.0:
+				raise ConversionError("Secondary normal offset must be different from zero!")
+			if not arguments.secondary_normal_brush:
+				if not arguments.secondary_normal_offset * arguments.normal_offset > 0.0:
+					raise ConversionError("Normal offset and secondary normal offset must have different direction!")
+		if arguments.target_brushes != None and not arguments.target_brushes > 0:
+			raise ConversionError("Target brushes must be greater than zero!")
+		if arguments.partition_size != None and not arguments.partition_size > 0.0:
+			raise ConversionError("Partition size must be greater than zero!")
+		if arguments.partition_brushes != None and not arguments.partition_brushes > 0:
+			raise ConversionError("Partition brushes must be greater than zero!")
+		if arguments.max_color_materials != None and not arguments.max_color_materials > 0:
+			raise ConversionError("Max color materials must be greater than zero!")
+		if arguments.info_json:
+			arguments.info = True
+		if arguments.stream and arguments.info:
+			raise ConversionError("Objects information is not available in stream mode!")
+		if arguments.stream and arguments.update:
+			raise ConversionError("Updating output is not available in stream mode!")
+		if arguments.stream and arguments.max_color_materials != None:
+			raise ConversionError("Color palette is built per file, it is not available in stream mode!")
+		if arguments.append_to_output and arguments.update:
+			raise ConversionError("Output can't be appended and updated at the same time!")
+		if (arguments.append_to_output or arguments.update) and not is_path(arguments.output):
+			raise ConversionError("Output must be a file when appending or updating!")
+		if arguments.profile_stage != None:
+			if not arguments.profile_stage in profile_stages:
+				raise ConversionError(f"Profile stage must be one of: {', '.join(profile_stages)}!")
+			if arguments.profile == None:
+				arguments.profile = ""
+		if not abs(arguments.grid_snap_step) > 0.0:
+			arguments.disable_grid_snap = True
+		if arguments.jobs < 1:
+			arguments.jobs = os.cpu_count()
+		if arguments.jobs > 1 and not "fork" in multiprocessing.get_all_start_methods():
+			print("Parallel jobs are not supported on this platform, using a single process")
+			arguments.jobs = 1
+
+		arguments.material_list = (";" + arguments.material_list).split(";")
+		arguments.skip_material_list = (";" + arguments.skip_material_list).split(";")
+		self.arguments = arguments
+		self.input_name = ""
+		self.profiler = Profiler()
+
+		# input files are parsed by worker processes when there are more jobs
+		self.input_file_paths = []
+		self.input_is_directory = False
+		# directories are processed in parallel with one file per worker, single files by ranges
+		self.use_process_pool = False
+		self.parse_pool = None
+		self.input_data = []
+		self.map_materials = []
+		self.map_material_ids = {}
+
+		# group ids of the output start after the groups of appended or updated maps
+		self.output_file = None
+		self.output_group_count = 0
+		self.map_group_count = 0
+		self.reused_group_ids = []
+		self.layer_groups = {}
+		# entities written in update mode are tagged with their source and its hash
+		self.update_header = []
+		self.update_blocks = []
+		self.update_units = {}
+		self.update_texts = {}
+		self.update_keys = []
+		self.update_source = None
+		# brushes of large objects are formatted in tasks of the brush pool
+		self.brush_pool = None
+		self.brush_task = None
+		self.pending_brush_task_count = 0
+
+	# using input file name for the output if not provided
+	def set_output(self):
+		self.input_name = get_input_name(self.arguments.input)
+		if self.arguments.output == None:
+			self.arguments.output = self.input_name + ".map"
+		stats_path = (self.arguments.output if is_path(self.arguments.output) else self.input_name + ".map") + ".prof"
+		self.profiler = Profiler(self.arguments.profile != None, self.arguments.profile_stage, stats_path)
+
+	def read_obj_file(self, input_file, data, object_callback = None):
+		objects, object_ids = data["objects"], data["object_ids"]
+		materials, material_ids = data["materials"], data["material_ids"]
+		vertices, colors = data["vertex_buffer"], data["color_buffer"]
+		triangles = data["triangle_buffer"]
+		triangle_smooth_groups = data["smooth_group_buffer"]
+		triangle_materials = data["material_buffer"]
+		triangle_objects = data["object_buffer"]
+		lines = data["lines"]
+
+		current_object_id = 0
+		current_material_id = 0
+		current_smooth_group = 0
+		for line in input_file:
+			split = line.split()
+			if len(split) == 2 and split[0] in ["o", "g"]:
+				# handing over finished object blocks
+				if object_callback != None and len(triangles) > 0:
+					object_callback(data)
+				current_object = split[1]
+				if not current_object in object_ids:
+					object_ids[current_object] = len(objects)
+					objects.append(current_object)
+				current_object_id = object_ids[current_object]
+			elif len(split) == 2 and split[0] == "usemtl":
+				# scene materials are replaced by vertex colors
+				if self.arguments.vertex_color_materials:
+					continue
+				current_material = split[1]
+				if not current_material in material_ids:
+					material_ids[current_material] = len(materials)
+					materials.append(current_material)
+				current_material_id = material_ids[current_material]
+			elif len(split) == 2 and split[0] == "s":
+				if self.arguments.disable_smooth_groups:
+					continue
+				if split[1] in ["0", "off"]:
+					current_smooth_group = 0
+				elif split[1].isdigit():
+					current_smooth_group = int(split[1])
+			elif len(split) in [4, 7] and split[0] == "v":
+				vertices.append(float(split[1]))
+				vertices.append(float(split[2]))
+				vertices.append(float(split[3]))
+				# reading vertex colors for face materials
+				if self.arguments.vertex_color_materials:
+					if len(split) == 7:
+						r, g, b = [min(max(int(float(value) * 255.0), 0), 255) for value in split[4:7]]
+						colors.append((r << 16) | (g << 8) | b)
+					else:
+						colors.append(0xffffff)
+			elif len(split) >= 4 and split[0] == "f":
+				vertex_count = len(vertices) // 3
+				face_vertices = []
+				for index in range(1, len(split)):
+					vertex_index = int(split[index].split("/")[0])
+					# resolving relative vertex indices
+					if vertex_index < 0:
+						face_vertices.append(vertex_count + vertex_index)
+					else:
+						face_vertices.append(vertex_index - 1)
+				# converting n-gons to triangles
+				for index in range(1, len(face_vertices) - 1):
+					triangles.append(face_vertices[0])
+					triangles.append(face_vertices[index])
+					triangles.append(face_vertices[index + 1])
+					triangle_smooth_groups.append(current_smooth_group)
+					triangle_materials.append(current_material_id)
+					triangle_objects.append(current_object_id)
+			elif len(split) >= 3 and split[0] == "l":
+				lines.append([objects[current_object_id]])
+				for index in range(1, len(split)):
+					lines[-1].append(int(split[index]) - 1)
+		if object_callback != None and len(triangles) > 0:
+			object_callback(data)
+
+	def get_vertices(self, vertex_buffer, indices = slice(None)):
+		vertices = np.frombuffer(vertex_buffer, dtype=np.float64).reshape(-1, 3)[indices]
+		# converting coordinate system for all vertices at once
+		scale = self.arguments.scale * self.arguments.unit_size
+		return np.stack((+vertices[:, 0] * scale, -vertices[:, 2] * scale, +vertices[:, 1] * scale), axis=1)
+
+	def get_vertex_color_materials(self, data, colors, triangles):
+		triangle_colors = colors[triangles]
+		is_colored = (triangle_colors[:, 0] == triangle_colors[:, 1]) & (triangle_colors[:, 0] == triangle_colors[:, 2])
+		unique_colors, first_indices, inverse, counts = np.unique(triangle_colors[is_colored, 0], return_index=True, return_inverse=True, return_counts=True)
+		if self.arguments.max_color_materials != None and len(unique_colors) > self.arguments.max_color_materials:
+			unique_colors = get_median_cut_colors(unique_colors, counts, self.arguments.max_color_materials)
+
+		# interning material names of the palette in the order of their first appearance
+		palette, palette_indices = np.unique(unique_colors, return_inverse=True)
+		palette_first_indices = np.full(len(palette), len(triangles), dtype=np.int64)
+		np.minimum.at(palette_first_indices, palette_indices.reshape(-1), first_indices)
+		palette_ids = np.zeros(len(palette), dtype=np.int64)
+		for palette_index in np.argsort(palette_first_indices, kind="stable").tolist():
+			material_name = f"#{int(palette[palette_index]):06x}"
+			if not material_name in data["material_ids"]:
+				data["material_ids"][material_name] = len(data["materials"])
+				data["materials"].append(material_name)
+			palette_ids[palette_index] = data["material_ids"][material_name]
+		triangle_materials = np.zeros(len(triangles), dtype=np.int64)
+		triangle_materials[is_colored] = palette_ids[palette_indices.reshape(-1)][inverse.reshape(-1)]
+		return triangle_materials
+
+	def load_mesh_arrays(self, data, is_object_block = False):
+		triangles = np.frombuffer(data["triangle_buffer"], dtype=np.int64).reshape(-1, 3)
+		vertex_indices = slice(None)
+		if is_object_block:
+			# keeping only vertices used by the object block
+			vertex_indices, triangles = np.unique(triangles, return_inverse=True)
+			triangles = triangles.reshape(-1, 3)
+		data["vertices"] = self.get_vertices(data["vertex_buffer"], vertex_indices)
+		data["triangles"] = triangles
+		data["triangle_smooth_groups"] = np.frombuffer(data["smooth_group_buffer"], dtype=np.int64)
+		data["triangle_materials"] = np.frombuffer(data["material_buffer"], dtype=np.int64)
+		data["triangle_objects"] = np.frombuffer(data["object_buffer"], dtype=np.int64)
+
+		# finding vertex color materials
+		if self.arguments.vertex_color_materials:
+			colors = np.frombuffer(data["color_buffer"], dtype=np.int64)[vertex_indices]
+			self.profiler.start("vertex_colors")
+			data["triangle_materials"] = self.get_vertex_color_materials(data, colors, triangles)
+			self.profiler.stop()
+
+		if self.arguments.weld_vertices:
+			self.clean_mesh_arrays(data)
+
+		# indexing triangles by object and smooth group in a single pass
+		if not is_object_block:
+			data["object_smooth_groups"] = get_object_smooth_groups(data)
+			# arrays were created, parsed buffers are no longer needed
+			for key in ["vertex_buffer", "color_buffer", "triangle_buffer", "smooth_group_buffer", "material_buffer", "object_buffer"]:
+				del data[key]
+
+	# objects information only needs parsed triangles to be counted,
+	# so they are neither welded nor indexed by object and smooth group
+	def load_info_arrays(self, data):
+		data["vertices"] = self.get_vertices(data["vertex_buffer"])
+		data["triangles"] = np.frombuffer(data["triangle_buffer"], dtype=np.int64).reshape(-1, 3)
+		data["triangle_smooth_groups"] = np.frombuffer(data["smooth_group_buffer"], dtype=np.int64)
+		data["triangle_materials"] = np.frombuffer(data["material_buffer"], dtype=np.int64)
+		data["triangle_objects"] = np.frombuffer(data["object_buffer"], dtype=np.int64)
+		# vertex color materials are listed like the ones of faces
+		if self.arguments.vertex_color_materials:
+			colors = np.frombuffer(data["color_buffer"], dtype=np.int64)
+			self.profiler.start("vertex_colors")
+			data["triangle_materials"] = self.get_vertex_color_materials(data, colors, data["triangles"])
+			self.profiler.stop()
+		for key in ["vertex_buffer", "color_buffer", "triangle_buffer", "smooth_group_buffer", "material_buffer", "object_buffer"]:
+			del data[key]
+
+	# welding vertices after snapping and removing triangles without planes or repeating earlier ones,
+	# duplicates are searched in the same object with the same winding
+	def clean_mesh_arrays(self, data):
+		vertices = data["vertices"]
+		if not self.arguments.disable_grid_snap:
+			vertices = vectors3_grid_snap(vertices, self.arguments.grid_snap_step)
+		welded_vertices = self.get_welded_vertices(vertices)
+		triangles = welded_vertices[data["triangles"]]
+		a, b, c = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+		is_degenerate = np.all(vectors3_cross(a - b, a - c) == 0.0, axis=1)
+		# later steps use the same snapped positions that kept triangles have planes at
+		data["vertices"] = vertices
+
+		# rotating triangles to start from their smallest vertex index keeps their winding
+		rotations = np.argmin(triangles, axis=1)[:, None]
+		rotated_triangles = np.take_along_axis(triangles, (rotations + np.arange(3)[None]) % 3, axis=1)
+		keys = np.column_stack((data["triangle_objects"], rotated_triangles))[~is_degenerate]
+		# stable sorting keeps the first triangle of every run of equal keys
+		order = np.lexsort(keys.T[::-1])
+		is_first = np.ones(len(order), dtype=bool)
+		is_first[1:] = np.any(keys[order[1:]] != keys[order[:-1]], axis=1)
+		is_kept = np.zeros(len(triangles), dtype=bool)
+		is_kept[np.flatnonzero(~is_degenerate)[order[is_first]]] = True
+
+		data["triangles"] = triangles[is_kept]
+		for key in ["triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+			data[key] = data[key][is_kept]
+		welded_count = int(np.count_nonzero(welded_vertices != np.arange(len(vertices))))
+		degenerate_count = int(np.count_nonzero(is_degenerate))
+		duplicate_count = len(triangles) - degenerate_count - int(np.count_nonzero(is_kept))
+		if welded_count + degenerate_count + duplicate_count > 0:
+			print(f'{data["name"]}: {welded_count} vertices welded, {degenerate_count} degenerate and {duplicate_count} duplicate triangles removed')
+		self.profiler.count("welded", welded_count)
+		self.profiler.count("removed", degenerate_count + duplicate_count)
+
+	# counting read triangles for profiling, degenerate ones have no plane after snapping
+	def count_triangles(self, data):
+		if not self.profiler.enabled:
+			return
+		triangle_vertices = data["vertices"][data["triangles"]]
+		if not self.arguments.disable_grid_snap:
+			triangle_vertices = vectors3_grid_snap(triangle_vertices, self.arguments.grid_snap_step)
+		a, b, c = triangle_vertices[:, 0], triangle_vertices[:, 1], triangle_vertices[:, 2]
+		is_degenerate = np.all(vectors3_cross(a - b, a - c) == 0.0, axis=1)
+		self.profiler.count("triangles", len(is_degenerate))
+		self.profiler.count("degenerate", int(np.count_nonzero(is_degenerate)))
+
+	# trying to get input file paths
+	def set_input_file_paths(self):
+		self.input_file_paths = []
+		self.input_is_directory = False
+		if is_path(self.arguments.input) and os.path.isdir(self.arguments.input):
+			for path in os.listdir(self.arguments.input):
+				file_path = os.path.join(self.arguments.input, path)
+				if os.path.isfile(file_path) and file_path.endswith(".obj"):
+					self.input_file_paths.append(file_path)
+			self.input_file_paths = sorted_alphanumeric(self.input_file_paths)
+			self.input_is_directory = True
 		else:
-			continue
-	input_file_basename = os.path.basename(input_file_path)
-	input_file_name = os.path.splitext(input_file_basename)[0]
-
-	objects = [""]
-	materials = [""]
-	vertices = []
-	triangles = []
-	colors = []
-	lines = []
-
-	input_data.append({})
-	input_data[-1]["name"] = input_file_name
-	input_data[-1]["path"] = input_file_path
-	input_data[-1]["objects"] = objects
-	input_data[-1]["materials"] = materials
-	input_data[-1]["vertices"] = vertices
-	input_data[-1]["triangles"] = triangles
-	input_data[-1]["lines"] = lines
-
-	current_object = ""
-	current_material = ""
-	current_smooth_group = 0
-	for line in input_file:
-		split = line.split()
-		if len(split) == 2 and split[0] in ["o", "g"]:
-			current_object = split[1]
-			if not current_object in objects:
-				objects.append(current_object)
-		elif len(split) == 2 and split[0] == "usemtl":
-			current_material = split[1]
-			if not current_material in materials:
-				materials.append(current_material)
-		elif len(split) == 2 and split[0] == "s":
-			if arguments.disable_smooth_groups:
+			self.input_file_paths = [self.arguments.input]
+
+	def open_input_file(self, input_file_path, mode = 'r'):
+		# streams are read at once, so they are parsed like files and left open
+		if not is_path(input_file_path):
+			text = input_file_path.read()
+			if mode == 'rb':
+				return io.BytesIO(text.encode() if isinstance(text, str) else text)
+			return io.StringIO(text.decode() if isinstance(text, bytes) else text)
+		try:
+			return open(input_file_path, mode)
+		except Exception:
+			if not self.input_is_directory:
+				raise ConversionError(f"Failed opening input file: {self.arguments.input}")
+		return None
+
+	# cached files depend on the input file and arguments affecting parsing
+	def get_cache_path(self, input_file_path):
+		if self.arguments.cache_directory == None or not is_path(input_file_path) or not os.path.isfile(input_file_path):
+			return None
+		stat = os.stat(input_file_path)
+		key = [os.path.abspath(input_file_path), stat.st_size, stat.st_mtime_ns, self.arguments.scale, self.arguments.unit_size]
+		key += [self.arguments.vertex_color_materials, self.arguments.disable_smooth_groups, cache_version]
+		if self.arguments.vertex_color_materials:
+			key += [self.arguments.max_color_materials]
+		if self.arguments.weld_vertices:
+			key += [self.arguments.epsilon, self.arguments.grid_snap_step, self.arguments.disable_grid_snap]
+		key_hash = hashlib.sha1(repr(key).encode()).hexdigest()
+		input_file_name = os.path.splitext(os.path.basename(input_file_path))[0]
+		return os.path.join(self.arguments.cache_directory, f"{input_file_name}-{key_hash}.npz")
+
+	def write_cache_file(self, cache_path, data):
+		lines = data["lines"]
+		arrays = {}
+		arrays["objects"] = np.array(data["objects"], dtype=str)
+		arrays["materials"] = np.array(data["materials"], dtype=str)
+		for key in ["vertices", "triangles", "triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+			arrays[key] = data[key]
+		# lines are stored as flat vertex indices with offsets
+		arrays["line_objects"] = np.array([data["object_ids"][line[0]] for line in lines], dtype=np.int64)
+		arrays["line_offsets"] = np.cumsum([0] + [len(line) - 1 for line in lines], dtype=np.int64)
+		arrays["line_vertices"] = np.array([index for line in lines for index in line[1:]], dtype=np.int64)
+		try:
+			os.makedirs(self.arguments.cache_directory, exist_ok=True)
+			temporary_cache_path = f"{cache_path}.{os.getpid()}.tmp"
+			with open(temporary_cache_path, "wb") as cache_file:
+				np.savez(cache_file, **arrays)
+			os.replace(temporary_cache_path, cache_path)
+		except Exception:
+			print(f"Failed writing cache file: {cache_path}")
+
+	# removing least recently used cache files over the size limit
+	def evict_cache_files(self):
+		if self.arguments.cache_directory == None or not os.path.isdir(self.arguments.cache_directory):
+			return
+		cache_files = []
+		for path in os.listdir(self.arguments.cache_directory):
+			cache_path = os.path.join(self.arguments.cache_directory, path)
+			if path.endswith(".npz") and os.path.isfile(cache_path):
+				stat = os.stat(cache_path)
+				cache_files.append((stat.st_mtime, stat.st_size, cache_path))
+		cache_files.sort()
+		cache_size = sum([cache_file[1] for cache_file in cache_files])
+		for mtime, size, cache_path in cache_files:
+			if cache_size <= self.arguments.cache_size * 1024 * 1024:
+				break
+			try:
+				os.remove(cache_path)
+				cache_size -= size
+			except Exception:
 				continue
-			if split[1] in ["0", "off"]:
-				current_smooth_group = 0
-			elif split[1].isdigit():
-				current_smooth_group = int(split[1])
-		elif len(split) in [4, 7] and split[0] == "v":
-			vertices.append([])
-			# immediately converting coordinate system
-			scale = arguments.scale * arguments.unit_size
-			vertices[-1].append(+float(split[1]) * scale)
-			vertices[-1].append(-float(split[3]) * scale)
-			vertices[-1].append(+float(split[2]) * scale)
-			# reading vertex colors for face materials
-			if arguments.vertex_color_materials:
-				colors.append([255, 255, 255])
-				if len(split) == 7:
-					colors[-1][0] = int(float(split[4]) * 255.0)
-					colors[-1][1] = int(float(split[5]) * 255.0)
-					colors[-1][2] = int(float(split[6]) * 255.0)
-		elif len(split) >= 4 and split[0] == "f":
-			face_vertices, face_colors = [], []
-			for index in range(1, len(split)):
-				face_data = split[index].split("/")
-				vertex_index = int(face_data[0]) - 1
-				face_vertices.append(vertices[vertex_index])
-				if arguments.vertex_color_materials:
-					face_colors.append(colors[vertex_index])
-			# converting n-gons to triangles
-			for index in range(1, len(face_vertices) - 1):
-				triangles.append([])
-				triangles[-1].append(face_vertices[0])
-				triangles[-1].append(face_vertices[index])
-				triangles[-1].append(face_vertices[index + 1])
-				triangles[-1].append(current_smooth_group)
-				triangles[-1].append(current_material)
-				triangles[-1].append(current_object)
-				if arguments.vertex_color_materials:
-					if face_colors[0] != face_colors[index]:
-						triangles[-1].append(None)
-					elif face_colors[0] != face_colors[index + 1]:
-						triangles[-1].append(None)
+
+	def load_input_file(self, input_file_path):
+		cache_path = self.get_cache_path(input_file_path)
+		if cache_path != None and os.path.isfile(cache_path):
+			data = read_cache_file(cache_path, input_file_path)
+			if data != None:
+				return data
+		try:
+			data = create_obj_data(input_file_path)
+			self.read_obj_ranges(input_file_path, data)
+		except OSError:
+			if not self.input_is_directory:
+				raise ConversionError(f"Failed opening input file: {self.arguments.input}")
+			return None
+		if self.arguments.info:
+			self.load_info_arrays(data)
+			return data
+		self.load_mesh_arrays(data)
+		if cache_path != None:
+			self.write_cache_file(cache_path, data)
+		return data
+
+	# splits lines of a byte range into tokens like str.split() in a few vectorized passes,
+	# names and vertex indices are resolved when ranges are merged, line numbers are local to the range
+	def read_obj_text(self, text):
+		text = np.frombuffer(text + b"\n", dtype=np.uint8)
+		is_space = (text <= ord(" "))
+		newlines = np.flatnonzero(text == ord("\n"))
+		token_starts = np.flatnonzero(~is_space & np.concatenate(([True], is_space[:-1])))
+		token_ends = np.flatnonzero(~is_space & np.concatenate((is_space[1:], [True]))) + 1
+		token_lines = np.searchsorted(newlines, token_starts)
+		line_token_counts = np.bincount(token_lines, minlength=len(newlines))
+		line_tokens = np.minimum(np.searchsorted(token_lines, np.arange(len(newlines))), max(len(token_starts) - 1, 0))
+		first_lengths = np.where(line_token_counts > 0, (token_ends - token_starts)[line_tokens] if len(token_starts) > 0 else 0, 0)
+		first_bytes = text[token_starts[line_tokens]] if len(token_starts) > 0 else np.zeros(len(newlines), dtype=np.uint8)
+		is_short = (first_lengths == 1)
+		obj_range = {"line_count": len(newlines)}
+
+		# collecting object, material and smooth group statements in order
+		obj_range["statements"] = []
+		is_statement = (line_token_counts == 2) & ((is_short & np.isin(first_bytes, list(b"ogs"))) | ((first_lengths == 6) & (first_bytes == ord("u"))))
+		for line in np.flatnonzero(is_statement).tolist():
+			first_token = line_tokens[line]
+			statement = text[token_starts[first_token]:token_ends[first_token]].tobytes().decode()
+			value = text[token_starts[first_token + 1]:token_ends[first_token + 1]].tobytes().decode()
+			if statement in statement_types:
+				obj_range["statements"].append((line, statement, value))
+
+		# reading vertex coordinates and colors
+		is_vertex = is_short & (first_bytes == ord("v")) & ((line_token_counts == 4) | (line_token_counts == 7))
+		vertex_lines = np.flatnonzero(is_vertex)
+		vertex_tokens = line_tokens[vertex_lines][:, None] + np.arange(1, 4)
+		obj_range["vertex_lines"] = vertex_lines
+		obj_range["vertices"] = parse_float_tokens(text, token_starts[vertex_tokens].reshape(-1), token_ends[vertex_tokens].reshape(-1))
+		obj_range["colors"] = np.zeros(0, dtype=np.int64)
+		if self.arguments.vertex_color_materials:
+			colors = np.full(len(vertex_lines), 0xffffff, dtype=np.int64)
+			is_colored = (line_token_counts[vertex_lines] == 7)
+			color_tokens = line_tokens[vertex_lines[is_colored]][:, None] + np.arange(4, 7)
+			color_values = parse_float_tokens(text, token_starts[color_tokens].reshape(-1), token_ends[color_tokens].reshape(-1))
+			colors[is_colored] = pack_colors((color_values * 255.0).astype(np.int64).reshape(-1, 3))
+			obj_range["colors"] = colors
+
+		# reading face vertices as written, relative indices depend on vertices of previous ranges
+		face_lines = np.flatnonzero(is_short & (first_bytes == ord("f")) & (line_token_counts >= 4))
+		face_sizes = line_token_counts[face_lines] - 1
+		face_starts = np.cumsum(face_sizes) - face_sizes
+		face_tokens = np.repeat(line_tokens[face_lines] + 1 - face_starts, face_sizes) + np.arange(np.sum(face_sizes))
+		obj_range["face_lines"] = face_lines
+		obj_range["face_sizes"] = face_sizes
+		obj_range["face_vertices"] = parse_integer_tokens(text, token_starts[face_tokens], token_ends[face_tokens])
+		obj_range["face_vertex_counts"] = np.searchsorted(vertex_lines, face_lines)
+
+		# line objects are rare, their vertices are read one by one
+		obj_range["paths"] = []
+		path_lines = np.flatnonzero(is_short & (first_bytes == ord("l")) & (line_token_counts >= 3))
+		for line in path_lines.tolist():
+			first_token = line_tokens[line]
+			tokens = range(first_token + 1, first_token + line_token_counts[line])
+			obj_range["paths"].append((line, [int(text[token_starts[token]:token_ends[token]].tobytes()) - 1 for token in tokens]))
+		return obj_range
+
+	# parses a newline-aligned byte range of a mapped file, called by worker processes
+	def read_obj_range(self, file_range):
+		input_file_path, start, end = file_range
+		with open(input_file_path, "rb") as input_file:
+			with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+				text = mapped_file[start:end]
+		return self.read_obj_text(text)
+
+	# merges parsed ranges in order into the buffers of the line parser, carrying the current
+	# object, material and smooth group over range boundaries like a single pass would
+	def merge_obj_ranges(self, data, obj_ranges):
+		statements = {"objects": ([], []), "materials": ([], []), "smooth_groups": ([], [])}
+		vertices, colors, face_lines, face_sizes, face_vertices, paths = [], [], [], [], [], []
+		line_offset, vertex_offset = 0, 0
+		for obj_range in obj_ranges:
+			for line, statement, value in obj_range["statements"]:
+				if statement == "usemtl":
+					if self.arguments.vertex_color_materials:
+						continue
+					if not value in data["material_ids"]:
+						data["material_ids"][value] = len(data["materials"])
+						data["materials"].append(value)
+					value = data["material_ids"][value]
+				elif statement == "s":
+					if self.arguments.disable_smooth_groups:
+						continue
+					if value in ["0", "off"]:
+						value = 0
+					elif value.isdigit():
+						value = int(value)
 					else:
-						triangles[-1].append(face_colors[0])
-		elif len(split) >= 3 and split[0] == "l":
-			lines.append([current_object])
-			for index in range(1, len(split)):
-				lines[-1].append(int(split[index]) - 1)
-	input_file.close()
-
-	# finding vertex color materials
-	if arguments.vertex_color_materials:
-		materials.clear()
-		materials.append("")
-		for triangle in triangles:
-			triangle[4] = ""
-			if triangle[6] == None:
-				continue
-			r, g, b = tuple(triangle[6])
-			material_name = f"#{r:02x}{g:02x}{b:02x}"
-			if not material_name in materials:
-				materials.append(material_name)
-			triangle[4] = material_name
-
-# sorting objects by name
-if not arguments.disable_sorting_objects:
-	for data in input_data:
-		data["objects"] = sorted_alphanumeric(data["objects"])
-
-# collecting map materials
-map_materials = []
-for data in input_data:
-	for material in data["materials"]:
-		if not material in map_materials:
-			map_materials.append(material)
-
-# sorting materials by name for material lists
-if not arguments.disable_sorting_materials:
-	for data in input_data:
-		data["materials"] = sorted_alphanumeric(data["materials"])
-	map_materials = sorted_alphanumeric(map_materials)
-
-if arguments.info:
-	gbox = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-	for data_index, data in enumerate(input_data):
-		print(f'{data["path"]}:')
-
-		print("  Objects:")
-		if input_is_directory:
-			frames = len(str(len(input_data)))
-			for object_index in range(1, len(data["objects"])):
-				print(f"    [{str(data_index + 1).zfill(frames)}]", end = " ")
-				print(data["objects"][object_index])
+						continue
+				else:
+					if not value in data["object_ids"]:
+						data["object_ids"][value] = len(data["objects"])
+						data["objects"].append(value)
+					value = data["object_ids"][value]
+				statement_lines, statement_values = statements[statement_types[statement]]
+				statement_lines.append(line_offset + line)
+				statement_values.append(value)
+
+			# resolving relative vertex indices with vertices of previous ranges
+			range_face_vertices = obj_range["face_vertices"]
+			vertex_counts = np.repeat(obj_range["face_vertex_counts"] + vertex_offset, obj_range["face_sizes"])
+			face_vertices.append(np.where(range_face_vertices < 0, vertex_counts + range_face_vertices, range_face_vertices - 1))
+			face_lines.append(obj_range["face_lines"] + line_offset)
+			face_sizes.append(obj_range["face_sizes"])
+			paths += [(line_offset + line, path_vertices) for line, path_vertices in obj_range["paths"]]
+			vertices.append(obj_range["vertices"])
+			colors.append(obj_range["colors"])
+			line_offset += obj_range["line_count"]
+			vertex_offset += len(obj_range["vertex_lines"])
+
+		# converting faces into fans of triangles
+		face_lines = np.concatenate([np.zeros(0, dtype=np.int64)] + face_lines)
+		face_sizes = np.concatenate([np.zeros(0, dtype=np.int64)] + face_sizes)
+		face_vertices = np.concatenate([np.zeros(0, dtype=np.int64)] + face_vertices)
+		face_starts = np.cumsum(face_sizes) - face_sizes
+		triangle_counts = face_sizes - 2
+		triangle_faces = np.repeat(np.arange(len(face_lines)), triangle_counts)
+		triangle_corners = np.arange(len(triangle_faces)) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+		first_corners = face_starts[triangle_faces]
+		triangles = np.column_stack((face_vertices[first_corners], face_vertices[first_corners + triangle_corners + 1], face_vertices[first_corners + triangle_corners + 2]))
+		triangle_lines = face_lines[triangle_faces]
+		data["vertex_buffer"] = np.concatenate([np.zeros(0, dtype=np.float64)] + vertices)
+		data["color_buffer"] = np.concatenate([np.zeros(0, dtype=np.int64)] + colors)
+		data["triangle_buffer"] = np.ascontiguousarray(triangles, dtype=np.int64).reshape(-1)
+		data["object_buffer"] = get_statement_values(*statements["objects"], triangle_lines)
+		data["material_buffer"] = get_statement_values(*statements["materials"], triangle_lines)
+		data["smooth_group_buffer"] = get_statement_values(*statements["smooth_groups"], triangle_lines)
+		path_objects = get_statement_values(*statements["objects"], np.array([line for line, path_vertices in paths], dtype=np.int64))
+		data["lines"] = [[data["objects"][object_id]] + path_vertices for object_id, (line, path_vertices) in zip(path_objects.tolist(), paths)]
+
+	# files are mapped into memory and their ranges are parsed by the parse pool, streams are parsed at once
+	def read_obj_ranges(self, input_file_path, data):
+		if not is_path(input_file_path):
+			input_file = self.open_input_file(input_file_path, "rb")
+			obj_ranges = [self.read_obj_text(input_file.read())]
+		elif self.parse_pool != None:
+			obj_ranges = self.get_worker_results(self.parse_pool, "read_obj_range", get_obj_ranges(input_file_path))
 		else:
-			frames = len(str(len(data["objects"]) - 1))
-			for object_index in range(1, len(data["objects"])):
-				print(f"    [{str(object_index).zfill(frames)}]", end = " ")
-				print(data["objects"][object_index])
-
-		print("  Materials:")
-		for material_index in range(1, len(data["materials"])):
-			print("    " + data["materials"][material_index])
-
-		# calculating AABB
-		box = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-		for vertex in data["vertices"]:
-			for index in range(3):
-				box[index] = min(box[index], vertex[index])
-				gbox[index] = min(gbox[index], vertex[index])
-			for index in range(3, 6):
-				box[index] = max(box[index], vertex[index % 3])
-				gbox[index] = max(gbox[index], vertex[index % 3])
-
-		if not arguments.disable_grid_snap:
-			box[0], box[1], box[2] = tuple(vector3_grid_snap(box[0:3], arguments.grid_snap_step))
-			box[3], box[4], box[5] = tuple(vector3_grid_snap(box[3:6], arguments.grid_snap_step))
-		print(f"  AABB: ({box[0]:g} {box[1]:g} {box[2]:g}, {box[3]:g} {box[4]:g} {box[5]:g})")
-		print(f"  Size: ({(box[3] - box[0]):g}, {(box[4] - box[1]):g}, {(box[5] - box[2]):g})\n")
-
-	print('Material List: "', end = "")
-	for material_index in range(1, len(map_materials)):
-		print(map_materials[material_index] + ";", end = "")
-	print('"')
-
-	if not arguments.disable_grid_snap:
-		gbox[0], gbox[1], gbox[2] = tuple(vector3_grid_snap(gbox[0:3], arguments.grid_snap_step))
-		gbox[3], gbox[4], gbox[5] = tuple(vector3_grid_snap(gbox[3:6], arguments.grid_snap_step))
-	print(f"AABB: ({gbox[0]:g} {gbox[1]:g} {gbox[2]:g}, {gbox[3]:g} {gbox[4]:g} {gbox[5]:g})")
-	print(f"Size: ({(gbox[3] - gbox[0]):g}, {(gbox[4] - gbox[1]):g}, {(gbox[5] - gbox[2]):g})")
-	quit()
-
-# creating material lists
-for index in range(len(map_materials)):
-	if index >= len(arguments.material_list):
-		arguments.material_list.append(arguments.material)
-	elif arguments.material_list[index].strip() == "":
-		arguments.material_list[index] = arguments.material
-	if index >= len(arguments.skip_material_list):
-		arguments.skip_material_list.append(arguments.skip_material)
-	elif arguments.skip_material_list[index].strip() == "":
-		arguments.skip_material_list[index] = arguments.skip_material
-
-# trying to open output file to read map group count
-output_group_count = 0
-if arguments.append_to_output:
-	try:
-		input_file = open(arguments.output, 'r')
-	except Exception:
-		print(f"Failed opening output file: {arguments.output}")
-		quit()
-
-	for line in input_file:
-		split = line.strip().replace('"', ' ').split()
-		if len(split) >= 2 and split[0] == "_tb_id" and split[-1].isnumeric():
-			output_group_count = max(output_group_count, int(split[-1]))
-	input_file.close()
-map_group_count = output_group_count
-
-# trying to open output file for writing
-output_file = None
-try:
-	if arguments.append_to_output:
-		output_file = open(arguments.output, "a")
-	else:
-		output_file = open(arguments.output, "w")
-except Exception:
-	print(f"Failed writing output file: {arguments.output}")
-	quit()
-
-
-
-def write_group_entity(name, parent_group_id = None, parent_group_is_layer = False):
-	global map_group_count
-	map_group_count += 1
-	output_file.write("{\n")
-	output_file.write('"classname" "func_group"\n')
-	output_file.write('"_tb_type" "_tb_group"\n')
-	output_file.write(f'"_tb_name" "{name}"\n')
-	output_file.write(f'"_tb_id" "{map_group_count}"\n')
-	if parent_group_id != None:
-		if parent_group_is_layer:
-			output_file.write(f'"_tb_layer" "{parent_group_id}"\n')
+			obj_ranges = map(self.read_obj_range, get_obj_ranges(input_file_path))
+		self.merge_obj_ranges(data, obj_ranges)
+
+	# workers are forked to inherit the converter with its arguments and already loaded input data
+	def create_process_pool(self):
+		global worker_converter
+		with worker_lock:
+			worker_converter = self
+			try:
+				return multiprocessing.get_context("fork").Pool(self.arguments.jobs)
+			finally:
+				worker_converter = None
+
+	def get_worker_results(self, pool, method_name, values):
+		for result, counters in pool.imap(run_worker_task, ((method_name, value) for value in values)):
+			self.profiler.add_counters(counters)
+			yield result
+
+	# collecting map materials
+	def add_map_materials(self, materials):
+		for material in materials:
+			if not material in self.map_material_ids:
+				self.map_material_ids[material] = len(self.map_materials)
+				self.map_materials.append(material)
+
+	# processing input files, streaming reads them while writing
+	def load_input_data(self):
+		self.use_process_pool = self.input_is_directory and self.arguments.jobs > 1 and not self.arguments.stream and not self.arguments.update
+		self.input_data = []
+		if not self.arguments.stream:
+			self.profiler.start("parse")
+			if self.use_process_pool:
+				with self.create_process_pool() as pool:
+					loaded_data = list(self.get_worker_results(pool, "load_input_file", self.input_file_paths))
+			else:
+				# ranges of every file are parsed in parallel instead
+				try:
+					if self.arguments.jobs > 1:
+						self.parse_pool = self.create_process_pool()
+					loaded_data = list(map(self.load_input_file, self.input_file_paths))
+				finally:
+					if self.parse_pool != None:
+						self.parse_pool.terminate()
+						self.parse_pool.join()
+						self.parse_pool = None
+			self.input_data = [data for data in loaded_data if data != None]
+			self.evict_cache_files()
+			self.profiler.stop()
+			for data in self.input_data:
+				self.count_triangles(data)
+
+		# sorting objects by name
+		self.profiler.start("sorting")
+		if not self.arguments.disable_sorting_objects:
+			for data in self.input_data:
+				data["objects"] = sorted_alphanumeric(data["objects"])
+
+		self.map_materials = []
+		self.map_material_ids = {}
+		for data in self.input_data:
+			self.add_map_materials(data["materials"])
+
+		# sorting materials by name for material lists
+		if not self.arguments.disable_sorting_materials:
+			for data in self.input_data:
+				data["materials"] = sorted_alphanumeric(data["materials"])
+			self.map_materials = sorted_alphanumeric(self.map_materials)
+			self.map_material_ids = {material: index for index, material in enumerate(self.map_materials)}
+		self.profiler.stop()
+
+	def is_convex_object(self, data, object_name):
+		if self.arguments.disable_convex_objects:
+			return False
+		if "convex" in data["name"] and not "concave" in object_name and object_name != "":
+			return True
+		return "convex" in object_name
+
+	# split bipyramids write two brushes for every triangle
+	def get_triangle_brush_count(self):
+		if self.arguments.secondary_normal_offset != None and self.arguments.secondary_normal_brush:
+			return 2
+		return 1
+
+	# statistics of objects for the current brush mode, convex objects count their unique planes
+	# without wrapping concave parts of --convex_hull
+	def get_object_statistics(self, data):
+		statistics = {}
+		triangle_objects = data["triangle_objects"]
+		order = np.argsort(triangle_objects, kind="stable")
+		objects, object_starts, triangle_counts = np.unique(triangle_objects[order], return_index=True, return_counts=True)
+		smooth_group_range = np.max(data["triangle_smooth_groups"], initial=0) + 1
+		smooth_groups = np.unique(triangle_objects * smooth_group_range + data["triangle_smooth_groups"])
+		smooth_group_counts = np.bincount(smooth_groups // smooth_group_range, minlength=len(data["objects"]))
+
+		# object AABBs of vertices used by their triangles
+		corners = data["vertices"][data["triangles"][order].reshape(-1)]
+		box_min = np.minimum.reduceat(corners, object_starts * 3) if len(corners) > 0 else corners
+		box_max = np.maximum.reduceat(corners, object_starts * 3) if len(corners) > 0 else corners
+		if not self.arguments.disable_grid_snap:
+			box_min = vectors3_grid_snap(box_min, self.arguments.grid_snap_step)
+			box_max = vectors3_grid_snap(box_max, self.arguments.grid_snap_step)
+
+		object_names = {object_id: object_name for object_name, object_id in data["object_ids"].items()}
+		for object_id, object_start, triangle_count, box in zip(objects.tolist(), object_starts.tolist(), triangle_counts.tolist(), np.column_stack((box_min, box_max)).tolist()):
+			object_name = object_names[object_id]
+			if self.arguments.disable_objects:
+				brushes, planes = int(smooth_group_counts[object_id]), triangle_count
+			elif self.is_convex_object(data, object_name):
+				triangle_planes = self.get_valid_triangle_planes(data, order[object_start:object_start + triangle_count])[1]
+				brushes, planes = 1, len(self.get_unique_planes(triangle_planes))
+			else:
+				brushes = triangle_count * self.get_triangle_brush_count()
+				if self.arguments.target_brushes != None:
+					brushes = min(brushes, self.arguments.target_brushes)
+				planes = brushes * (6 if self.arguments.secondary_normal_offset != None and not self.arguments.secondary_normal_brush else 4)
+			statistics[object_id] = {"triangles": triangle_count, "brushes": brushes, "planes": planes, "aabb": box}
+		return statistics
+
+	def get_info_box(self, box):
+		if not self.arguments.disable_grid_snap:
+			box[0], box[1], box[2] = tuple(vector3_grid_snap(box[0:3], self.arguments.grid_snap_step))
+			box[3], box[4], box[5] = tuple(vector3_grid_snap(box[3:6], self.arguments.grid_snap_step))
+		return box
+
+	def get_objects_info(self):
+		self.profiler.start("info")
+		info = {"files": [], "material_list": "", "triangles": 0, "brushes": 0, "planes": 0}
+		gbox = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+		for data_index, data in enumerate(self.input_data):
+			statistics = self.get_object_statistics(data)
+			file_info = {"path": data["path"], "objects": [], "materials": data["materials"][1:]}
+			for object_id, object_name in enumerate(data["objects"]):
+				object_info = {"name": object_name, "triangles": 0, "brushes": 0, "planes": 0, "aabb": None}
+				object_info.update(statistics.get(data["object_ids"][object_name], {}))
+				file_info["objects"].append(object_info)
+			for key in ["triangles", "brushes", "planes"]:
+				file_info[key] = sum([object_info[key] for object_info in file_info["objects"]])
+				info[key] += file_info[key]
+
+			# calculating AABB
+			box = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+			if len(data["vertices"]) > 0:
+				box_min = data["vertices"].min(axis=0).tolist()
+				box_max = data["vertices"].max(axis=0).tolist()
+				for index in range(3):
+					box[index] = min(box[index], box_min[index])
+					gbox[index] = min(gbox[index], box_min[index])
+				for index in range(3, 6):
+					box[index] = max(box[index], box_max[index % 3])
+					gbox[index] = max(gbox[index], box_max[index % 3])
+			file_info["aabb"] = self.get_info_box(box)
+			info["files"].append(file_info)
+		info["material_list"] = "".join([material + ";" for material in self.map_materials[1:]])
+		info["aabb"] = self.get_info_box(gbox)
+
+		self.profiler.stop()
+		return info
+
+	def print_objects_info(self, info):
+		if self.arguments.info_json:
+			print(json.dumps(info, indent = 2))
+			return
+
+		for data_index, file_info in enumerate(info["files"]):
+			print(f'{file_info["path"]}:')
+
+			print("  Objects:")
+			object_infos = file_info["objects"][1:]
+			frames = len(str(len(info["files"]))) if self.input_is_directory else len(str(len(object_infos)))
+			for object_index, object_info in enumerate(object_infos):
+				print(f"    [{str(data_index + 1 if self.input_is_directory else object_index + 1).zfill(frames)}]", end = " ")
+				print(f'{object_info["name"]} ({object_info["triangles"]} triangles, {object_info["brushes"]} brushes, {object_info["planes"]} planes)')
+
+			print("  Materials:")
+			for material in file_info["materials"]:
+				print("    " + material)
+
+			box = file_info["aabb"]
+			print(f'  Triangles: {file_info["triangles"]}, brushes: {file_info["brushes"]}, planes: {file_info["planes"]}')
+			print(f"  AABB: ({box[0]:g} {box[1]:g} {box[2]:g}, {box[3]:g} {box[4]:g} {box[5]:g})")
+			print(f"  Size: ({(box[3] - box[0]):g}, {(box[4] - box[1]):g}, {(box[5] - box[2]):g})\n")
+
+		print(f'Material List: "{info["material_list"]}"')
+		gbox = info["aabb"]
+		print(f'Triangles: {info["triangles"]}, brushes: {info["brushes"]}, planes: {info["planes"]}')
+		print(f"AABB: ({gbox[0]:g} {gbox[1]:g} {gbox[2]:g}, {gbox[3]:g} {gbox[4]:g} {gbox[5]:g})")
+		print(f"Size: ({(gbox[3] - gbox[0]):g}, {(gbox[4] - gbox[1]):g}, {(gbox[5] - gbox[2]):g})")
+
+	# creating material lists
+	def update_material_lists(self):
+		for index in range(len(self.map_materials)):
+			if index >= len(self.arguments.material_list):
+				self.arguments.material_list.append(self.arguments.material)
+			elif self.arguments.material_list[index].strip() == "":
+				self.arguments.material_list[index] = self.arguments.material
+			if index >= len(self.arguments.skip_material_list):
+				self.arguments.skip_material_list.append(self.arguments.skip_material)
+			elif self.arguments.skip_material_list[index].strip() == "":
+				self.arguments.skip_material_list[index] = self.arguments.skip_material
+
+	# mapping interned materials to map materials
+	def get_material_map(self, data):
+		material_map = np.zeros(len(data["material_ids"]), dtype=np.int64)
+		for material, material_id in data["material_ids"].items():
+			material_map[material_id] = self.map_material_ids[material]
+		return material_map
+
+	# trying to open output file to read map group count
+	def read_output_group_count(self):
+		self.output_group_count = 0
+		try:
+			input_file = open(self.arguments.output, 'r')
+		except Exception:
+			raise ConversionError(f"Failed opening output file: {self.arguments.output}")
+
+		for line in input_file:
+			split = line.strip().replace('"', ' ').split()
+			if len(split) >= 2 and split[0] == "_tb_id" and split[-1].isnumeric():
+				self.output_group_count = max(self.output_group_count, int(split[-1]))
+		input_file.close()
+
+	# texts of blocks of the old map reach up to the next block, like lines between blocks were kept before
+	def read_update_map(self, input_file):
+		if os.fstat(input_file.fileno()).st_size == 0:
+			return
+		with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+			depth = 0
+			block_starts = []
+			block_properties = []
+			for match in update_map_pattern.finditer(mapped_file):
+				if match[1] == b"{":
+					if depth == 0:
+						block_starts.append(match.start())
+						block_properties.append({})
+					depth += 1
+				elif match[1] == b"}":
+					depth = max(depth - 1, 0)
+				elif depth == 1:
+					block_properties[-1][match[2].decode()] = match[3].decode()
+			block_ends = block_starts[1:] + [len(mapped_file)]
+			header_end = block_starts[0] if len(block_starts) > 0 else len(mapped_file)
+			if header_end > 0:
+				self.update_header.append(mapped_file[0:header_end].decode())
+			block_texts = [mapped_file[start:end].decode() for start, end in zip(block_starts, block_ends)]
+
+		# collecting group ids of every source in the order of writing
+		for text, properties in zip(block_texts, block_properties):
+			block = {"text": text, "key": None}
+			group_id = properties.get("_tb_id", "")
+			if group_id.isnumeric():
+				self.output_group_count = max(self.output_group_count, int(group_id))
+			if "_obj2map_source" in properties:
+				block["key"] = (properties["_obj2map_source"], properties.get("_obj2map_unit", ""))
+				unit = self.update_units.setdefault(block["key"], {"hash": properties.get("_obj2map_hash", ""), "group_ids": []})
+				if group_id.isnumeric():
+					unit["group_ids"].append(int(group_id))
+			self.update_blocks.append(block)
+
+	# trying to open output file for writing
+	def open_output_file(self):
+		self.update_material_lists()
+		for data in self.input_data:
+			data["material_map"] = self.get_material_map(data)
+
+		self.output_group_count = 0
+		if self.arguments.append_to_output:
+			self.read_output_group_count()
+		self.update_header.clear()
+		self.update_blocks.clear()
+		self.update_units.clear()
+		if self.arguments.update and os.path.isfile(self.arguments.output):
+			try:
+				input_file = open(self.arguments.output, 'rb')
+			except Exception:
+				raise ConversionError(f"Failed opening output file: {self.arguments.output}")
+			self.profiler.start("update")
+			self.read_update_map(input_file)
+			self.profiler.stop()
+			input_file.close()
+		self.map_group_count = self.output_group_count
+
+		self.output_file = None
+		try:
+			if not is_path(self.arguments.output):
+				self.output_file = MapWriter(self.arguments.output, profiler=self.profiler)
+			elif self.arguments.append_to_output:
+				self.output_file = MapWriter(open(self.arguments.output, "a"), profiler=self.profiler)
+			elif self.arguments.update:
+				self.output_file = MapWriter(open(self.arguments.output + ".update", "w"), profiler=self.profiler)
+			else:
+				self.output_file = MapWriter(open(self.arguments.output, "w"), profiler=self.profiler)
+		except Exception:
+			raise ConversionError(f"Failed writing output file: {self.arguments.output}")
+
+	# sources rewritten in update mode keep ids of their groups
+	def get_next_group_id(self):
+		if len(self.reused_group_ids) > 0:
+			return self.reused_group_ids.pop(0)
+		self.map_group_count += 1
+		return self.map_group_count
+
+	def write_update_source(self):
+		if self.update_source != None:
+			self.output_file.write(f'"_obj2map_source" "{self.update_source[0]}"\n')
+			self.output_file.write(f'"_obj2map_unit" "{self.update_source[1]}"\n')
+			self.output_file.write(f'"_obj2map_hash" "{self.update_source[2]}"\n')
+
+	def write_group_entity(self, name, parent_group_id = None, parent_group_is_layer = False):
+		group_id = self.get_next_group_id()
+		self.output_file.write("{\n")
+		self.output_file.write('"classname" "func_group"\n')
+		self.output_file.write('"_tb_type" "_tb_group"\n')
+		self.output_file.write(f'"_tb_name" "{name}"\n')
+		self.output_file.write(f'"_tb_id" "{group_id}"\n')
+		if parent_group_id != None:
+			if parent_group_is_layer:
+				self.output_file.write(f'"_tb_layer" "{parent_group_id}"\n')
+			else:
+				self.output_file.write(f'"_tb_group" "{parent_group_id}"\n')
+		self.write_update_source()
+		self.output_file.write("}\n")
+		return group_id
+
+	def write_layer_group_entity(self, name):
+		group_id = self.get_next_group_id()
+		self.output_file.write("{\n")
+		self.output_file.write('"classname" "func_group"\n')
+		self.output_file.write('"_tb_type" "_tb_layer"\n')
+		self.output_file.write(f'"_tb_name" "{name}"\n')
+		self.output_file.write(f'"_tb_id" "{group_id}"\n')
+		self.write_update_source()
+		self.output_file.write("}\n")
+		return group_id
+
+	# brush batches are self-contained so they can be sent to worker processes
+	def get_brush_batch(self, data, triangles):
+		batch = {}
+		vertices = data["vertices"]
+		triangle_indices = data["triangles"][triangles]
+		batch["a"] = vertices[triangle_indices[:, 0]]
+		batch["b"] = vertices[triangle_indices[:, 1]]
+		batch["c"] = vertices[triangle_indices[:, 2]]
+		batch["material_indices"] = data["material_map"][data["triangle_materials"][triangles]]
+		batch["material_list"] = self.arguments.material_list
+		batch["skip_material_list"] = self.arguments.skip_material_list
+		if self.arguments.validate:
+			# invalid brushes are reported with their objects and triangle indices
+			batch["triangles"] = triangles
+			batch["triangle_objects"] = data["triangle_objects"][triangles]
+			batch["objects"] = data["objects"]
+		return batch
+
+	def get_brush_vertices(self, batch, normal_offset):
+		a, b, c = batch["a"], batch["b"], batch["c"]
+		center = triangles_get_center(a, b, c)
+		normal = triangles_get_counterclockwise_normal(a, b, c)
+		bv = np.stack((a, b, c, center - normal * normal_offset), axis=1)
+
+		# snapping brush vertices to grid
+		if not self.arguments.disable_grid_snap:
+			bv = vectors3_grid_snap(bv, self.arguments.grid_snap_step)
+		return bv
+
+	def format_brushes(self, batch, normal_offset, mode = 0):
+		bv = self.get_brush_vertices(batch, normal_offset)
+
+		# formatting brush vertices for writing, shared vertices only once
+		vertex_texts, vertex_indices = self.output_file.format_vectors(bv)
+		fbv = [vertex_texts[index] for index in vertex_indices.tolist()]
+
+		uv = triangles_get_standard_uv
+		if self.arguments.uv_valve:
+			uv = triangles_get_valve_uv
+
+		material_indices = batch["material_indices"].tolist()
+		material_names = [batch["material_list"][index] for index in material_indices]
+		skip_material_names = [batch["skip_material_list"][index] for index in material_indices]
+		if mode == 1:
+			skip_material_names = material_names
+
+		# collecting brush planes with their materials and uvs
+		brush_planes = positive_brush_planes if normal_offset > 0.0 else negative_brush_planes
+		planes = []
+		for plane_index, plane in enumerate(brush_planes):
+			if plane_index < 3 and not (mode == 0 or mode == 1):
+				continue
+			if plane_index == 3 and not (mode == 0 or mode == 2):
+				continue
+			plane_material_names = skip_material_names if plane_index < 3 else material_names
+			plane_uvs = uv(bv[:, plane[0]], bv[:, plane[1]], bv[:, plane[2]])
+			planes.append((plane, plane_material_names, plane_uvs))
+
+		# writing brush planes
+		plane_lines = []
+		for plane, plane_material_names, plane_uvs in planes:
+			plane_vertices = zip(fbv[plane[0]::4], fbv[plane[1]::4], fbv[plane[2]::4], plane_material_names, plane_uvs)
+			plane_lines.append([f"{a} {b} {c} {m} {uv} 0 1 1\n" for a, b, c, m, uv in plane_vertices])
+		if mode == 0:
+			return ["{\n" + "".join(lines) + "}\n" for lines in zip(*plane_lines)]
+		return ["".join(lines) for lines in zip(*plane_lines)]
+
+	# pyramids need their snapped apex at least epsilon behind the snapped triangle, which rules out
+	# collinear points and pyramids inverted or flattened by grid snapping
+	def get_valid_brushes(self, batch):
+		is_valid = np.ones(len(batch["a"]), dtype=bool)
+		normal_offsets = [self.arguments.normal_offset]
+		if self.arguments.secondary_normal_offset != None:
+			normal_offsets.append(-self.arguments.secondary_normal_offset)
+		for normal_offset in normal_offsets:
+			bv = self.get_brush_vertices(batch, normal_offset)
+			a, b, c, apex = bv[:, 0], bv[:, 1], bv[:, 2], bv[:, 3]
+			normals = vectors3_cross(b - a, c - a)
+			distances = np.einsum("ij,ij->i", normals, apex - a) * np.sign(normal_offset)
+			is_valid &= (distances < -self.arguments.epsilon * vectors3_length(normals))
+		return is_valid
+
+	# removes invalid brushes from a batch and prints up to ten of their triangles for every object
+	def validate_brush_batch(self, batch):
+		is_valid = self.get_valid_brushes(batch)
+		if np.all(is_valid):
+			return batch
+		invalid_objects = batch["triangle_objects"][~is_valid]
+		invalid_triangles = batch["triangles"][~is_valid]
+		for object_id in np.unique(invalid_objects).tolist():
+			triangles = invalid_triangles[invalid_objects == object_id].tolist()
+			reported_triangles = ", ".join([str(triangle) for triangle in triangles[:max_reported_triangles]])
+			if len(triangles) > max_reported_triangles:
+				reported_triangles += ", ..."
+			print(f'{batch["objects"][object_id]}: dropped {len(triangles)} invalid brushes, triangles {reported_triangles}')
+		self.profiler.count("invalid", len(invalid_triangles))
+		batch = dict(batch)
+		for key in ["a", "b", "c", "material_indices", "triangles", "triangle_objects"]:
+			batch[key] = batch[key][is_valid]
+		return batch
+
+	def format_brush_batch(self, batch):
+		if self.arguments.validate:
+			batch = self.validate_brush_batch(batch)
+		if self.arguments.secondary_normal_offset != None:
+			if not self.arguments.secondary_normal_brush:
+				secondary_brushes = self.format_brushes(batch, -self.arguments.secondary_normal_offset, 1)
+				brushes = self.format_brushes(batch, self.arguments.normal_offset, 1)
+				return "".join(["{\n" + s + b + "}\n" for s, b in zip(secondary_brushes, brushes)])
+			else:
+				secondary_brushes = self.format_brushes(batch, -self.arguments.secondary_normal_offset, 0)
+				brushes = self.format_brushes(batch, self.arguments.normal_offset, 0)
+				return "".join([s + b for s, b in zip(secondary_brushes, brushes)])
+		return "".join(self.format_brushes(batch, self.arguments.normal_offset, 0))
+
+	def format_brush_batches(self, batches):
+		return [self.format_brush_batch(batch) for batch in batches]
+
+	# batches of consecutive smooth groups are collected into tasks of the brush pool until they have
+	# enough triangles, texts of the tasks are written in order when the output buffer is flushed
+	def submit_brush_task(self):
+		task, self.brush_task = self.brush_task, None
+		task["result"] = self.brush_pool.apply_async(run_worker_task, (("format_brush_batches", task["batches"]),))
+		task["batches"] = None
+		self.pending_brush_task_count += 1
+
+	def get_brush_task_text(self, task, index):
+		if task is self.brush_task:
+			self.submit_brush_task()
+		if task["texts"] == None:
+			self.profiler.start("brushes")
+			task["texts"], counters = task["result"].get()
+			self.profiler.add_counters(counters)
+			self.profiler.stop()
+			self.pending_brush_task_count -= 1
+		return task["texts"][index]
+
+	def write_pool_brush_batch(self, batch):
+		if self.brush_task == None:
+			self.brush_task = {"batches": [], "triangle_count": 0, "result": None, "texts": None}
+		task, index = self.brush_task, len(self.brush_task["batches"])
+		task["batches"].append(batch)
+		task["triangle_count"] += len(batch["a"])
+		self.output_file.write_deferred(lambda: self.get_brush_task_text(task, index))
+		if task["triangle_count"] >= min_brush_batch_size:
+			self.submit_brush_task()
+			# waiting for submitted tasks keeps their texts from piling up
+			if self.pending_brush_task_count >= 2 * self.arguments.jobs:
+				self.output_file.flush()
+
+	# groups adjacent coplanar triangles of the same material into convex polygons,
+	# returns triangles left for pyramids and a batch of polygons for prisms
+	def get_coplanar_polygons(self, data, triangles):
+		vertices = data["vertices"]
+		triangle_indices = data["triangles"][triangles]
+		a = vertices[triangle_indices[:, 0]]
+		b = vertices[triangle_indices[:, 1]]
+		c = vertices[triangle_indices[:, 2]]
+		planes = get_triangle_planes(a, b, c)
+		materials = data["triangle_materials"][triangles]
+
+		# finding neighbours sharing an edge in the opposite direction
+		edge_starts = triangle_indices.reshape(-1)
+		edge_ends = triangle_indices[:, [1, 2, 0]].reshape(-1)
+		edge_keys = edge_starts * len(vertices) + edge_ends
+		edge_order = np.argsort(edge_keys, kind="stable")
+		sorted_keys = edge_keys[edge_order]
+		twin_keys = edge_ends * len(vertices) + edge_starts
+		positions = np.minimum(np.searchsorted(sorted_keys, twin_keys), max(len(sorted_keys) - 1, 0))
+		neighbours = np.where(sorted_keys[positions] == twin_keys, edge_order[positions] // 3, -1).reshape(-1, 3)
+
+		# neighbours worth merging with are valid, coplanar and have the same material
+		is_valid = np.any(planes[:, 0:3] != 0.0, axis=1)
+		is_mergeable = (neighbours >= 0) & is_valid[:, None]
+		other = np.maximum(neighbours, 0)
+		is_mergeable &= is_valid[other] & (materials[other] == materials[:, None])
+		is_mergeable &= np.all(np.abs(planes[other] - planes[:, None]) < self.arguments.epsilon, axis=2)
+		neighbours = np.where(is_mergeable, neighbours, -1)
+
+		epsilon = self.arguments.epsilon
+		vertex_list = vertices.tolist()
+		plane_list = planes.tolist()
+		triangle_list = triangle_indices.tolist()
+		neighbour_list = neighbours.tolist()
+		is_merged = [False] * len(triangles)
+		polygons, polygon_members = [], []
+		for triangle in np.flatnonzero(np.any(is_mergeable, axis=1)).tolist():
+			if is_merged[triangle]:
+				continue
+			is_merged[triangle] = True
+			x, y, z = triangle_list[triangle]
+			next_vertices = {x: y, y: z, z: x}
+			previous_vertices = {y: x, z: y, x: z}
+			seed_plane = plane_list[triangle]
+			n = seed_plane[0:3]
+			members = [triangle]
+			edges = [(x, y, neighbour_list[triangle][0]), (y, z, neighbour_list[triangle][1]), (z, x, neighbour_list[triangle][2])]
+			while len(edges) > 0:
+				u, v, other = edges.pop()
+				if other < 0 or is_merged[other] or next_vertices.get(u) != v:
+					continue
+				other_plane = plane_list[other]
+				if any(abs(other_plane[i] - seed_plane[i]) >= epsilon for i in range(4)):
+					continue
+				other_vertices = triangle_list[other]
+				edge = other_vertices.index(v)
+				p = other_vertices[(edge + 2) % 3]
+				if p in next_vertices:
+					continue
+
+				# keeping polygon convex after inserting the vertex between u and v
+				w, t = previous_vertices[u], next_vertices[v]
+				u_turn = get_turn_distance(vertex_list[w], vertex_list[u], vertex_list[p], n)
+				v_turn = get_turn_distance(vertex_list[p], vertex_list[v], vertex_list[t], n)
+				if u_turn < -epsilon or v_turn < -epsilon:
+					continue
+				next_vertices[u], previous_vertices[p] = p, u
+				next_vertices[p], previous_vertices[v] = v, p
+				is_merged[other] = True
+				members.append(other)
+				edges.append((u, p, neighbour_list[other][(edge + 1) % 3]))
+				edges.append((p, v, neighbour_list[other][(edge + 2) % 3]))
+
+				# removing vertices in the middle of straight edges
+				for q, turn in [(u, u_turn), (v, v_turn)]:
+					if turn <= epsilon and len(next_vertices) > 3:
+						next_vertices[previous_vertices[q]] = next_vertices[q]
+						previous_vertices[next_vertices[q]] = previous_vertices[q]
+						del next_vertices[q], previous_vertices[q]
+
+			if len(members) > 1:
+				# the last visited vertex might have been rejected or removed from the polygon
+				polygon = [p if p in next_vertices else next(iter(next_vertices))]
+				while next_vertices[polygon[-1]] != polygon[0]:
+					polygon.append(next_vertices[polygon[-1]])
+				polygons.append(polygon)
+				polygon_members.append(members)
+			else:
+				is_merged[triangle] = False
+
+		polygon_triangles = np.array([members[0] for members in polygon_members], dtype=np.int64)
+		prisms = {}
+		prisms["points"] = vertices[np.array(list(itertools.chain.from_iterable(polygons)), dtype=np.int64)]
+		prisms["sizes"] = np.array([len(polygon) for polygon in polygons], dtype=np.int64)
+		prisms["normals"] = planes[polygon_triangles, 0:3]
+		prisms["material_indices"] = data["material_map"][materials[polygon_triangles]]
+		prisms["material_list"] = self.arguments.material_list
+		prisms["skip_material_list"] = self.arguments.skip_material_list
+
+		# polygons moved off their cap planes by snapping are left for pyramids
+		is_flat = self.is_prism_flat(prisms, self.arguments.normal_offset)
+		if self.arguments.secondary_normal_offset != None:
+			is_flat &= self.is_prism_flat(prisms, -self.arguments.secondary_normal_offset)
+		if not np.all(is_flat):
+			for polygon in np.flatnonzero(~is_flat).tolist():
+				for member in polygon_members[polygon]:
+					is_merged[member] = False
+			prisms["points"] = prisms["points"][np.repeat(is_flat, prisms["sizes"])]
+			for key in ["sizes", "normals", "material_indices"]:
+				prisms[key] = prisms[key][is_flat]
+		return triangles[~np.array(is_merged, dtype=bool)], prisms
+
+	# returns front and back points of prisms, snapped like the points of pyramids
+	def get_prism_points(self, prisms, normal_offset):
+		points = prisms["points"]
+		back_points = points - np.repeat(prisms["normals"], prisms["sizes"], axis=0) * normal_offset
+		if not self.arguments.disable_grid_snap:
+			points = vectors3_grid_snap(points, self.arguments.grid_snap_step)
+			back_points = vectors3_grid_snap(back_points, self.arguments.grid_snap_step)
+		return points, back_points
+
+	# caps are planes of three points of each polygon, checking that the other points stay on them
+	def is_prism_flat(self, prisms, normal_offset):
+		sizes = prisms["sizes"]
+		starts = np.cumsum(sizes) - sizes
+		polygon_indices = np.repeat(np.arange(len(sizes)), sizes)
+		is_flat = np.ones(len(sizes), dtype=bool)
+		for points in self.get_prism_points(prisms, normal_offset):
+			a = points[starts]
+			normals = vectors3_cross(points[starts + sizes // 3] - a, points[starts + 2 * sizes // 3] - a)
+			lengths = vectors3_length(normals)
+			distances = np.abs(np.sum((points - a[polygon_indices]) * normals[polygon_indices], axis=1))
+			is_flat &= (lengths > 0.0)
+			is_flat[polygon_indices[distances > self.arguments.epsilon * lengths[polygon_indices]]] = False
+		return is_flat
+
+	# extrudes polygons into prisms along the back-facing normal,
+	# faces are written like the faces of pyramids in the same order
+	def format_prisms(self, prisms, normal_offset):
+		sizes = prisms["sizes"]
+		if len(sizes) == 0:
+			return []
+		starts = np.cumsum(sizes) - sizes
+		points, back_points = self.get_prism_points(prisms, normal_offset)
+
+		# polygon edges go from each point to the next one in the same polygon
+		point_indices = np.arange(len(points))
+		next_indices = point_indices + 1
+		next_indices[starts + sizes - 1] = starts
+		caps = [starts, starts + sizes // 3, starts + 2 * sizes // 3]
+		if normal_offset > 0.0:
+			sides = (points[next_indices], back_points, points)
+			back_cap = (back_points[caps[0]], back_points[caps[1]], back_points[caps[2]])
+			front_cap = (points[caps[0]], points[caps[2]], points[caps[1]])
 		else:
-			output_file.write(f'"_tb_group" "{parent_group_id}"\n')
-	output_file.write("}\n")
-	return map_group_count
-
-
-
-def write_layer_group_entity(name):
-	global map_group_count
-	map_group_count += 1
-	output_file.write("{\n")
-	output_file.write('"classname" "func_group"\n')
-	output_file.write('"_tb_type" "_tb_layer"\n')
-	output_file.write(f'"_tb_name" "{name}"\n')
-	output_file.write(f'"_tb_id" "{map_group_count}"\n')
-	output_file.write("}\n")
-	return map_group_count
-
-
-
-def write_brush(triangle, normal_offset, mode = 0):
-	a, b, c = triangle[0], triangle[1], triangle[2]
-	center = triangle_get_center(a, b, c)
-	normal = triangle_get_counterclockwise_normal(a, b, c)
-	d_direction = vector3_multiply_by_scalar(normal, normal_offset)
-	bv = [a, b, c, vector3_substract(center, d_direction)]
-
-	# snapping brush vertices to grid
-	if not arguments.disable_grid_snap:
-		for index in range(len(bv)):
-			bv[index] = vector3_grid_snap(bv[index], arguments.grid_snap_step)
-
-	# formatting brush vertices for writing
-	fbv = []
-	for index in range(len(bv)):
-		fbv.append(f"( {bv[index][0]:g} {bv[index][1]:g} {bv[index][2]:g} )")
-
-	uv = triangle_get_standard_uv
-	if arguments.uv_valve:
-		uv = triangle_get_valve_uv
-
-	material_index = map_materials.index(triangle[4])
-	material_name = arguments.material_list[material_index]
-	skip_material_name = arguments.skip_material_list[material_index]
-	if mode == 1:
-		skip_material_name = material_name
-
-	# writing brush planes
-	if mode == 0:
-		output_file.write("{\n")
-	if normal_offset > 0.0:
-		if mode == 0 or mode == 1:
-			output_file.write(f"{fbv[0]} {fbv[3]} {fbv[2]} {skip_material_name} {uv(bv[0], bv[3], bv[2])} 0 1 1\n")
-			output_file.write(f"{fbv[1]} {fbv[3]} {fbv[0]} {skip_material_name} {uv(bv[1], bv[3], bv[0])} 0 1 1\n")
-			output_file.write(f"{fbv[2]} {fbv[3]} {fbv[1]} {skip_material_name} {uv(bv[2], bv[3], bv[1])} 0 1 1\n")
-		if mode == 0 or mode == 2:
-			output_file.write(f"{fbv[0]} {fbv[2]} {fbv[1]} {material_name} {uv(bv[0], bv[2], bv[1])} 0 1 1\n")
-	else:
-		if mode == 0 or mode == 1:
-			output_file.write(f"{fbv[0]} {fbv[2]} {fbv[3]} {skip_material_name} {uv(bv[0], bv[2], bv[3])} 0 1 1\n")
-			output_file.write(f"{fbv[1]} {fbv[0]} {fbv[3]} {skip_material_name} {uv(bv[1], bv[0], bv[3])} 0 1 1\n")
-			output_file.write(f"{fbv[2]} {fbv[1]} {fbv[3]} {skip_material_name} {uv(bv[2], bv[1], bv[3])} 0 1 1\n")
-		if mode == 0 or mode == 2:
-			output_file.write(f"{fbv[0]} {fbv[1]} {fbv[2]} {material_name} {uv(bv[0], bv[1], bv[2])} 0 1 1\n")
-	if mode == 0:
-		output_file.write("}\n")
-
-
-
-def write_entity(name, smooth_groups, parent_group_id = None, is_convex = False):
-	entity_group_id = parent_group_id
-	if len(smooth_groups) > 1:
-		entity_group_id = write_group_entity(name, parent_group_id)
-	for smooth_group in smooth_groups:
-		triangles = smooth_groups[smooth_group]
-
-		output_file.write("{\n")
-		output_file.write(f'"classname" "{arguments.classname}"\n')
-		output_file.write(f'"_phong" "{int(smooth_group != 0)}"\n')
-		if arguments.phong_angle != 89.0:
-			output_file.write(f'"_phong_angle" "{arguments.phong_angle}"\n')
-		if entity_group_id != None:
-			output_file.write(f'"_tb_group" "{entity_group_id}"\n')
-
-		if is_convex and len(triangles) > 0:
-			output_file.write("{\n")
-			for triangle in triangles:
-				write_brush(triangle, 1.0, 2)
-			output_file.write("}\n")
-		elif arguments.secondary_normal_offset != None:
-			for triangle in triangles:
-				if not arguments.secondary_normal_brush:
-					output_file.write("{\n")
-					write_brush(triangle, -arguments.secondary_normal_offset, 1)
-					write_brush(triangle, arguments.normal_offset, 1)
-					output_file.write("}\n")
+			sides = (points, back_points, points[next_indices])
+			back_cap = (back_points[caps[0]], back_points[caps[2]], back_points[caps[1]])
+			front_cap = (points[caps[0]], points[caps[1]], points[caps[2]])
+
+		uv = triangles_get_standard_uv
+		if self.arguments.uv_valve:
+			uv = triangles_get_valve_uv
+
+		material_indices = prisms["material_indices"].tolist()
+		material_names = [prisms["material_list"][index] for index in material_indices]
+		skip_material_names = [prisms["skip_material_list"][index] for index in material_indices]
+		polygon_indices = np.repeat(np.arange(len(sizes)), sizes).tolist()
+		side_material_names = [skip_material_names[index] for index in polygon_indices]
+
+		lines = []
+		for plane, plane_material_names in [(sides, side_material_names), (back_cap, skip_material_names), (front_cap, material_names)]:
+			vertex_texts, vertex_indices = self.output_file.format_vectors(np.stack(plane, axis=1))
+			fv = [vertex_texts[index] for index in vertex_indices.tolist()]
+			plane_vertices = zip(fv[0::3], fv[1::3], fv[2::3], plane_material_names, uv(*plane))
+			lines.append([f"{a} {b} {c} {m} {uv} 0 1 1\n" for a, b, c, m, uv in plane_vertices])
+		side_lines, back_cap_lines, front_cap_lines = lines
+		starts, ends = starts.tolist(), (starts + sizes).tolist()
+		return ["{\n" + "".join(side_lines[start:end]) + back + front + "}\n" for start, end, back, front in zip(starts, ends, back_cap_lines, front_cap_lines)]
+
+	# bipyramids are replaced with pairs of prisms, since both halves share their sides
+	def format_prism_batch(self, prisms):
+		if self.arguments.secondary_normal_offset != None:
+			secondary_brushes = self.format_prisms(prisms, -self.arguments.secondary_normal_offset)
+			brushes = self.format_prisms(prisms, self.arguments.normal_offset)
+			return "".join([s + b for s, b in zip(secondary_brushes, brushes)])
+		return "".join(self.format_prisms(prisms, self.arguments.normal_offset))
+
+	# splits triangles into uniform grid cells or octree cells with limited brushes, sorting them once by their centers
+	def get_triangle_partitions(self, data, triangles):
+		if len(triangles) == 0 or (self.arguments.partition_size == None and self.arguments.partition_brushes == None):
+			return [triangles]
+		triangle_vertices = data["vertices"][data["triangles"][triangles]]
+		centers = triangles_get_center(triangle_vertices[:, 0], triangle_vertices[:, 1], triangle_vertices[:, 2])
+		if self.arguments.partition_size != None:
+			cells = np.floor(centers / self.arguments.partition_size).astype(np.int64)
+			order = np.lexsort(cells.T[::-1])
+			cells = cells[order]
+			return np.split(triangles[order], np.flatnonzero(np.any(cells[1:] != cells[:-1], axis=1)) + 1)
+
+		# octree cells are ranges of triangles sorted by Morton codes
+		box_min = centers.min(axis=0)
+		box_size = max(float((centers.max(axis=0) - box_min).max()), self.arguments.epsilon)
+		cells = np.minimum(((centers - box_min) * ((1 << partition_depth) / box_size)).astype(np.int64), (1 << partition_depth) - 1)
+		codes = get_morton_bits(cells[:, 0]) | (get_morton_bits(cells[:, 1]) << 1) | (get_morton_bits(cells[:, 2]) << 2)
+		order = np.argsort(codes, kind="stable")
+		codes, triangles = codes[order], triangles[order]
+		brushes_per_triangle = 2 if self.arguments.secondary_normal_offset != None and self.arguments.secondary_normal_brush else 1
+		max_triangles = max(1, self.arguments.partition_brushes // brushes_per_triangle)
+
+		partitions = []
+		def split_cell(level, code, start, end):
+			if end - start <= max_triangles or level == partition_depth:
+				if end > start:
+					partitions.append(triangles[start:end])
+				return
+			shift = 3 * (partition_depth - level - 1)
+			bounds = np.searchsorted(codes[start:end], (code * 8 + np.arange(9)) << shift) + start
+			for child in range(8):
+				split_cell(level + 1, code * 8 + child, int(bounds[child]), int(bounds[child + 1]))
+		split_cell(0, 0, 0, len(triangles))
+		return partitions
+
+	# smooth groups are written as entities, partitioned objects write an entity for every cell
+	def write_entity(self, data, name, smooth_groups, parent_group_id = None, is_convex = False):
+		entity_triangles = []
+		for smooth_group in smooth_groups:
+			partitions = [smooth_groups[smooth_group]] if is_convex else self.get_triangle_partitions(data, smooth_groups[smooth_group])
+			entity_triangles += [(smooth_group, triangles) for triangles in partitions]
+		entity_group_id = parent_group_id
+		if len(entity_triangles) > 1:
+			entity_group_id = self.write_group_entity(name, parent_group_id)
+		# merged brushes are counted for whole smooth groups
+		merged_brush_counts = {}
+		for smooth_group, triangles in entity_triangles:
+			self.output_file.write("{\n")
+			self.output_file.write(f'"classname" "{self.arguments.classname}"\n')
+			self.output_file.write(f'"_phong" "{int(smooth_group != 0)}"\n')
+			if self.arguments.phong_angle != 89.0:
+				self.output_file.write(f'"_phong_angle" "{self.arguments.phong_angle}"\n')
+			if entity_group_id != None:
+				self.output_file.write(f'"_tb_group" "{entity_group_id}"\n')
+			self.write_update_source()
+
+			if self.arguments.merge_coplanar and not is_convex:
+				self.profiler.start("merge_coplanar")
+				brush_count = len(triangles)
+				triangles, prisms = self.get_coplanar_polygons(data, triangles)
+				self.output_file.write(self.format_prism_batch(prisms))
+				self.profiler.stop()
+				if self.arguments.secondary_normal_offset != None:
+					brush_count *= 2 if self.arguments.secondary_normal_brush else 1
+					merged_brush_count = len(triangles) * (2 if self.arguments.secondary_normal_brush else 1) + len(prisms["sizes"]) * 2
 				else:
-					write_brush(triangle, -arguments.secondary_normal_offset, 0)
-					write_brush(triangle, arguments.normal_offset, 0)
+					merged_brush_count = len(triangles) + len(prisms["sizes"])
+				brush_counts = merged_brush_counts.setdefault(smooth_group, [0, 0])
+				brush_counts[0] += brush_count
+				brush_counts[1] += merged_brush_count
+
+			self.profiler.start("brushes")
+			if is_convex and len(triangles) > 0:
+				self.output_file.write("{\n")
+				self.output_file.write("".join(self.format_brushes(self.get_brush_batch(data, triangles), 1.0, 2)))
+				self.output_file.write("}\n")
+			elif self.brush_pool != None:
+				# splitting big groups into ranges formatted by worker processes, small ones share tasks
+				batch_size = -(-len(triangles) // self.arguments.jobs)
+				batch_size = max(min_brush_batch_size, min(brush_batch_size, batch_size))
+				for start in range(0, len(triangles), batch_size):
+					self.write_pool_brush_batch(self.get_brush_batch(data, triangles[start:start + batch_size]))
+			else:
+				# generating brushes in batches to keep memory usage bounded
+				for start in range(0, len(triangles), brush_batch_size):
+					self.output_file.write(self.format_brush_batch(self.get_brush_batch(data, triangles[start:start + brush_batch_size])))
+			self.profiler.stop()
+			self.output_file.write("}\n")
+		for smooth_group, (brush_count, merged_brush_count) in merged_brush_counts.items():
+			print(f'{name if name != "" else data["name"]} [{smooth_group}]: {brush_count} -> {merged_brush_count} brushes')
+
+	def get_plane_grid(self, planes):
+		grid = {}
+		scaled_planes = planes / (2.0 * self.arguments.epsilon)
+		grid["cells"] = np.floor(scaled_planes).astype(np.int64)
+		grid["sides"] = np.where(scaled_planes - grid["cells"] < 0.5, -1, 1)
+		grid["radices"] = None
+		if len(planes) > 0:
+			grid["origin"] = grid["cells"].min(axis=0) - 1
+			grid["spans"] = grid["cells"].max(axis=0) - grid["origin"] + 2
+			radices = np.cumprod([1] + grid["spans"].tolist()[:-1], dtype=object)
+			if radices[-1] * grid["spans"].tolist()[-1] < (1 << 62):
+				grid["radices"] = radices.astype(np.int64)
+		grid["keys"], grid["planes"], grid["plane_cells"] = np.unique(get_plane_keys(grid, grid["cells"]), return_index=True, return_inverse=True)
+		return grid
+
+	# finds pairs of query planes and the first grid planes of neighbouring cells closer than epsilon
+	def find_close_grid_planes(self, grid, planes, query_planes, query_cells, query_sides):
+		query_indices, grid_indices = [], []
+		for offset in grid_cell_offsets[query_cells.shape[1]]:
+			keys = get_plane_keys(grid, query_cells + offset * query_sides)
+			# sorted keys are searched a lot faster
+			order = np.argsort(keys)
+			positions = np.empty_like(order)
+			positions[order] = np.minimum(np.searchsorted(grid["keys"], keys[order]), len(grid["keys"]) - 1)
+			is_found = (grid["keys"][positions] == keys)
+			found_queries = np.flatnonzero(is_found)
+			found_planes = grid["planes"][positions[is_found]]
+			is_close = np.all(np.abs(query_planes[found_queries] - planes[found_planes]) < self.arguments.epsilon, axis=1)
+			query_indices.append(found_queries[is_close])
+			grid_indices.append(found_planes[is_close])
+		return np.concatenate(query_indices), np.concatenate(grid_indices)
+
+	# returns indices of unique planes in the order of their first appearance
+	def get_unique_planes(self, planes):
+		if len(planes) == 0:
+			return np.zeros(0, dtype=np.int64)
+		grid = self.get_plane_grid(planes)
+		# planes sharing a cell are duplicates of the first one
+		unique_planes = np.sort(grid["planes"])
+		query_cells, query_sides = grid["cells"][unique_planes], grid["sides"][unique_planes]
+		queries, others = self.find_close_grid_planes(grid, planes, planes[unique_planes], query_cells, query_sides)
+		queries = unique_planes[queries]
+
+		# planes close to an earlier kept plane in a neighbouring cell are duplicates too
+		is_kept = np.zeros(len(planes), dtype=bool)
+		is_kept[unique_planes] = True
+		later, earlier = np.maximum(queries, others), np.minimum(queries, others)
+		order = np.argsort(later, kind="stable")
+		for later_plane, earlier_plane in zip(later[order].tolist(), earlier[order].tolist()):
+			if is_kept[earlier_plane]:
+				is_kept[later_plane] = False
+		return np.flatnonzero(is_kept)
+
+	# returns the index of the welded vertex for every vertex, vertices closer than epsilon are welded to earlier ones like planes
+	def get_welded_vertices(self, vertices):
+		welded_vertices = np.arange(len(vertices))
+		if len(vertices) == 0:
+			return welded_vertices
+		# equal vertices are welded to the first one of them, others are compared with all vertices of neighbouring cells
+		unique_vertices, first_vertices, unique_indices = np.unique(vertices, axis=0, return_index=True, return_inverse=True)
+		grid = self.get_plane_grid(unique_vertices)
+		cell_order = np.argsort(grid["plane_cells"], kind="stable")
+		cell_starts = np.searchsorted(grid["plane_cells"][cell_order], np.arange(len(grid["keys"]) + 1))
+		queries, others = [], []
+		for offset in np.concatenate((np.zeros((1, 3), dtype=np.int64), grid_cell_offsets[3])):
+			keys = get_plane_keys(grid, grid["cells"] + offset * grid["sides"])
+			positions = np.minimum(np.searchsorted(grid["keys"], keys), len(grid["keys"]) - 1)
+			found_queries = np.flatnonzero(grid["keys"][positions] == keys)
+			found_cells = positions[found_queries]
+			sizes = cell_starts[found_cells + 1] - cell_starts[found_cells]
+			member_offsets = np.arange(np.sum(sizes)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+			queries.append(np.repeat(found_queries, sizes))
+			others.append(cell_order[np.repeat(cell_starts[found_cells], sizes) + member_offsets])
+		queries, others = np.concatenate(queries), np.concatenate(others)
+		is_close = (queries != others) & (vectors3_length(unique_vertices[queries] - unique_vertices[others]) < self.arguments.epsilon)
+		queries, others = first_vertices[queries[is_close]], first_vertices[others[is_close]]
+
+		# vertices are welded to the first earlier vertex close to them that isn't welded itself
+		later, earlier = np.maximum(queries, others), np.minimum(queries, others)
+		order = np.lexsort((earlier, later))
+		for later_vertex, earlier_vertex in zip(later[order].tolist(), earlier[order].tolist()):
+			if welded_vertices[earlier_vertex] == earlier_vertex and welded_vertices[later_vertex] == later_vertex:
+				welded_vertices[later_vertex] = earlier_vertex
+		return welded_vertices[first_vertices[unique_indices.reshape(-1)]]
+
+	# hull points are rounded to integers of the snapping grid, or of a grid finer than epsilon without snapping,
+	# so that the side of a plane a point lies on is exact
+	def get_hull_lattice(self, points):
+		step = self.arguments.epsilon / 8.0
+		if not self.arguments.disable_grid_snap:
+			step = abs(self.arguments.grid_snap_step)
+		origin = points.min(axis=0)
+		step = max(step, float(np.max(points.max(axis=0) - origin)) / max_hull_span)
+		return np.rint((points - origin) / step).astype(np.int64)
+
+	# replaces object triangles with hull planes of all their vertices, reusing triangles of unique planes lying exactly on them
+	def get_convex_hull_triangles(self, data, all_triangles, object_triangles, triangle_planes):
+		vertex_indices, first_indices = np.unique(data["triangles"][all_triangles].reshape(-1), return_index=True)
+		triangle_points = np.searchsorted(vertex_indices, data["triangles"][object_triangles])
+		points = data["vertices"][vertex_indices]
+		if not self.arguments.disable_grid_snap:
+			points = vectors3_grid_snap(points, self.arguments.grid_snap_step)
+		lattice = self.get_hull_lattice(points)
+		hull = get_convex_hull(lattice)
+		if len(hull) == 0:
+			return object_triangles
+
+		# merging coplanar hull faces into single planes
+		hull_planes = get_triangle_planes(points[hull[:, 0]], points[hull[:, 1]], points[hull[:, 2]])
+		unique_hull_faces = self.get_unique_planes(hull_planes)
+		hull, hull_planes = hull[unique_hull_faces], hull_planes[unique_hull_faces]
+
+		# finding object triangles on hull planes
+		grid = self.get_plane_grid(triangle_planes)
+		scaled_planes = hull_planes / (2.0 * self.arguments.epsilon)
+		query_cells = np.floor(scaled_planes).astype(np.int64)
+		query_sides = np.where(scaled_planes - query_cells < 0.5, -1, 1)
+		hull_triangles = np.full(len(hull), -1, dtype=np.int64)
+		keys = get_plane_keys(grid, query_cells)
+		positions = np.minimum(np.searchsorted(grid["keys"], keys), len(grid["keys"]) - 1)
+		is_found = (grid["keys"][positions] == keys)
+		hull_triangles[is_found] = grid["planes"][positions[is_found]]
+		queries, others = self.find_close_grid_planes(grid, triangle_planes, hull_planes, query_cells, query_sides)
+		hull_triangles[queries] = np.where(hull_triangles[queries] < 0, others, hull_triangles[queries])
+
+		# close object triangles are reused only when their points lie exactly on the hull planes,
+		# since planes within epsilon can still tilt far enough to cut off other points
+		found_faces = np.flatnonzero(hull_triangles >= 0)
+		found_triangles = hull_triangles[found_faces]
+		normals, offsets = get_hull_planes(lattice, hull[found_faces])[0:2]
+		is_exact = np.sum(triangle_planes[found_triangles, 0:3] * hull_planes[found_faces, 0:3], axis=1) > 0.0
+		for corner in range(3):
+			corner_points = triangle_points[found_triangles, corner]
+			is_exact &= (get_hull_distances(lattice, normals, offsets, corner_points, np.arange(len(found_faces))) == 0)
+		is_reused = np.zeros(len(hull), dtype=bool)
+		is_reused[found_faces[is_exact]] = True
+
+		# creating triangles for other hull planes, like the ones bridging concave parts,
+		# they take materials of close object triangles or of triangles of their first points
+		source_triangles = all_triangles[first_indices[hull[:, 0]] // 3]
+		source_triangles[hull_triangles >= 0] = object_triangles[hull_triangles[hull_triangles >= 0]]
+		hull_triangles[is_reused] = source_triangles[is_reused]
+		if not np.all(is_reused):
+			new_faces = hull[~is_reused]
+			new_vertices = points[new_faces.reshape(-1)]
+			new_triangles = np.arange(len(new_vertices), dtype=np.int64).reshape(-1, 3)
+			hull_triangles[~is_reused] = append_triangles(data, new_vertices, new_triangles, source_triangles[~is_reused])
+		return np.sort(hull_triangles)
+
+	# returns triangles having planes after snapping and their planes, degenerate triangles are skipped
+	def get_valid_triangle_planes(self, data, triangles):
+		vertices = data["vertices"]
+		triangle_indices = data["triangles"][triangles]
+		a = vertices[triangle_indices[:, 0]]
+		b = vertices[triangle_indices[:, 1]]
+		c = vertices[triangle_indices[:, 2]]
+		if not self.arguments.disable_grid_snap:
+			a = vectors3_grid_snap(a, self.arguments.grid_snap_step)
+			b = vectors3_grid_snap(b, self.arguments.grid_snap_step)
+			c = vectors3_grid_snap(c, self.arguments.grid_snap_step)
+		triangle_planes = get_triangle_planes(a, b, c)
+		is_valid = np.any(triangle_planes[:, 0:3] != 0.0, axis=1)
+		return triangles[is_valid], triangle_planes[is_valid]
+
+	def convexify_smooth_groups(self, data, smooth_groups):
+		if not len(smooth_groups) > 0:
+			return
+		object_smooth_group = 0
+		if (not 0 in smooth_groups) or (len(smooth_groups) > 1):
+			object_smooth_group = 1
+		all_triangles = np.concatenate(list(smooth_groups.values()))
+		object_triangles, triangle_planes = self.get_valid_triangle_planes(data, all_triangles)
+
+		# hull planes are merged on their own, so object triangles are only searched for close planes
+		if self.arguments.convex_hull:
+			object_planes = self.get_convex_hull_triangles(data, all_triangles, object_triangles, triangle_planes)
 		else:
-			for triangle in triangles:
-				write_brush(triangle, arguments.normal_offset, 0)
-		output_file.write("}\n")
-
-
-
-def convexify_smooth_groups(smooth_groups):
-	if not len(smooth_groups) > 0:
-		return
-	object_smooth_group = 0
-	if (not 0 in smooth_groups) or (len(smooth_groups) > 1):
-		object_smooth_group = 1
-	object_triangles = []
-	for smooth_group_triangles in smooth_groups.values():
-		object_triangles.extend(smooth_group_triangles)
-	object_normals, object_planes = [], []
-	for triangle in object_triangles:
-		a, b, c = triangle[0], triangle[1], triangle[2]
-		if not arguments.disable_grid_snap:
-			a = vector3_grid_snap(a, arguments.grid_snap_step)
-			b = vector3_grid_snap(b, arguments.grid_snap_step)
-			c = vector3_grid_snap(c, arguments.grid_snap_step)
-		normal = triangle_get_counterclockwise_normal(a, b, c)
-		is_unique_normal = True
-		for object_normal in object_normals:
-			d = vector3_substract(object_normal, normal)
-			if vector3_length_squared(d) < arguments.squared_epsilon:
-				is_unique_normal = False
+			object_planes = object_triangles[self.get_unique_planes(triangle_planes)]
+		smooth_groups.clear()
+		smooth_groups[object_smooth_group] = object_planes
+
+	# vertex clustering keeping vertices on object, material and smooth group boundaries,
+	# returns data of the decimated object with its own vertices and triangles
+	def decimate_smooth_groups(self, data, name, smooth_groups):
+		triangles = np.sort(np.concatenate(list(smooth_groups.values())))
+		target_triangle_count = max(1, self.arguments.target_brushes // self.get_triangle_brush_count())
+		if not len(triangles) > target_triangle_count:
+			return data
+		vertex_indices, triangle_indices = np.unique(data["triangles"][triangles], return_inverse=True)
+		triangle_indices = triangle_indices.reshape(-1, 3)
+		points = data["vertices"][vertex_indices]
+
+		# vertices shared by triangles of different materials or smooth groups are locked
+		triangle_classes = np.column_stack((data["triangle_smooth_groups"][triangles], data["triangle_materials"][triangles]))
+		triangle_classes = np.unique(triangle_classes, axis=0, return_inverse=True)[1].reshape(-1)
+		vertex_min_classes = np.full(len(points), len(triangles), dtype=np.int64)
+		vertex_max_classes = np.full(len(points), -1, dtype=np.int64)
+		for corner in range(3):
+			np.minimum.at(vertex_min_classes, triangle_indices[:, corner], triangle_classes)
+			np.maximum.at(vertex_max_classes, triangle_indices[:, corner], triangle_classes)
+		is_locked = (vertex_min_classes != vertex_max_classes)
+
+		# vertices of open or non-manifold edges are locked too
+		edges = np.sort(np.stack((triangle_indices, triangle_indices[:, [1, 2, 0]]), axis=2).reshape(-1, 2), axis=1)
+		edges, edge_counts = np.unique(edges[:, 0] * len(points) + edges[:, 1], return_counts=True)
+		border_edges = edges[edge_counts != 2]
+		is_locked[border_edges // len(points)] = True
+		is_locked[border_edges % len(points)] = True
+
+		# locked vertices get their own clusters, others are clustered within their class and cells of their level,
+		# each level halving the cell size
+		vertex_levels = np.zeros(len(points), dtype=np.int64)
+		boundary_count = np.count_nonzero(is_locked)
+		def get_clusters(cell_size):
+			cells = np.floor(points * (np.exp2(vertex_levels) / cell_size)[:, None]).astype(np.int64)
+			keys = np.column_stack((cells, vertex_levels, vertex_min_classes))
+			locked_vertices = np.flatnonzero(is_locked)
+			keys[locked_vertices] = np.column_stack((locked_vertices, np.zeros((len(locked_vertices), 3), dtype=np.int64), np.full(len(locked_vertices), -1)))
+			clusters = np.unique(np.ascontiguousarray(keys).view(np.dtype((np.void, 40))).reshape(-1), return_inverse=True)[1].reshape(-1)
+			clustered_triangles = clusters[triangle_indices]
+			t0, t1, t2 = clustered_triangles[:, 0], clustered_triangles[:, 1], clustered_triangles[:, 2]
+			is_valid = (t0 != t1) & (t1 != t2) & (t2 != t0)
+			valid_triangles = np.flatnonzero(is_valid)
+			triangle_keys = np.ascontiguousarray(np.sort(clustered_triangles[valid_triangles], axis=1))
+			unique_triangles = np.unique(triangle_keys.view(np.dtype((np.void, 24))).reshape(-1), return_index=True)[1]
+			return clusters, valid_triangles[np.sort(unique_triangles)]
+
+		# searching for the smallest cell size within the budget
+		low_cell_size = np.max(np.max(points, axis=0) - np.min(points, axis=0))
+		high_cell_size = low_cell_size
+		low_cell_size /= 65536.0
+		clusters, kept_triangles = get_clusters(high_cell_size)
+		for iteration in range(16):
+			cell_size = math.sqrt(low_cell_size * high_cell_size)
+			cell_clusters, cell_triangles = get_clusters(cell_size)
+			if len(cell_triangles) > target_triangle_count:
+				low_cell_size = cell_size
+			else:
+				high_cell_size = cell_size
+				clusters, kept_triangles = cell_clusters, cell_triangles
+
+		# placing clusters at the average of their vertices, clusters turning kept triangles against
+		# their original normals are split into the cells of the next level, since locked vertices
+		# keep their positions, every flipped triangle has a vertex that can still be split
+		triangle_normals = triangles_get_counterclockwise_normal(points[triangle_indices[:, 0]], points[triangle_indices[:, 1]], points[triangle_indices[:, 2]])
+		while True:
+			cluster_sizes = np.bincount(clusters)
+			cluster_points = np.column_stack([np.bincount(clusters, points[:, axis]) / cluster_sizes for axis in range(3)])
+			cluster_points[clusters[is_locked]] = points[is_locked]
+			kept_points = cluster_points[clusters[triangle_indices[kept_triangles]]]
+			kept_normals = vectors3_cross(kept_points[:, 1] - kept_points[:, 0], kept_points[:, 2] - kept_points[:, 0])
+			is_flipped = (np.sum(kept_normals * triangle_normals[kept_triangles], axis=1) < 0.0)
+			if not np.any(is_flipped):
 				break
-		if is_unique_normal:
-			object_normals.append(normal)
-			object_planes.append(triangle)
-	smooth_groups.clear()
-	smooth_groups[object_smooth_group] = object_planes
-
-
-
-def write_path_corner_enity(origin, targetname, target, parent_group_id = None, flag = None):
-	o = origin
-	if not arguments.disable_grid_snap:
-		o = vector3_grid_snap(origin, 1.0)
-	output_file.write("{\n")
-	output_file.write('"classname" "path_corner"\n')
-	output_file.write(f'"origin" "{o[0]:g} {o[1]:g} {o[2]:g}"\n')
-	output_file.write(f'"targetname" "{targetname}"\n')
-	output_file.write(f'"target" "{target}"\n')
-	output_file.write(f'"wait" "{0 if flag != None else -1}"\n')
-	output_file.write(f'"_tb_group" "{parent_group_id}"\n')
-	output_file.write("}\n")
-
-
-
-# starting to write output file
-if not arguments.append_to_output:
-	output_file.write(f"// Game: {arguments.game}\n")
-	if arguments.uv_valve:
-		output_file.write("// Format: Valve\n")
-	else:
-		output_file.write("// Format: Standard\n")
-
-# writing entities
-layer_groups = {}
-if arguments.disable_objects:
-	for data_index, data in enumerate(input_data):
-		smooth_groups = {}
-		for triangle in data["triangles"]:
-			if not triangle[3] in smooth_groups:
-				smooth_groups[triangle[3]] = []
-			smooth_groups[triangle[3]].append(triangle)
-		write_entity(data["name"], smooth_groups, None, data_index + 1)
-else:
-	for data_index, data in enumerate(input_data):
-		data_group_id = None
-		data_is_convex = ("convex" in data["name"])
-		for object_index, object_name in enumerate(data["objects"]):
-			smooth_groups = {}
-			for triangle in data["triangles"]:
-				if triangle[5] == object_name:
-					if not triangle[3] in smooth_groups:
-						smooth_groups[triangle[3]] = []
-					smooth_groups[triangle[3]].append(triangle)
-
-			if input_is_directory and len(smooth_groups) > 0 and data_group_id == None:
-				layer_group_id = None
-				if not arguments.disable_layers:
-					layer_group_id = write_layer_group_entity(data["name"])
-				data_group_id = write_group_entity(data["name"], layer_group_id, layer_group_id != None)
-				layer_groups[data["name"]] = layer_group_id
-
-			object_is_convex = False
-			if not arguments.disable_convex_objects and len(smooth_groups) > 0:
-				if (data_is_convex and not "concave" in object_name):
-					if object_name != "":
-						object_is_convex = True
-				if "convex" in object_name:
-					object_is_convex = True
-				if object_is_convex:
-					convexify_smooth_groups(smooth_groups)
-
-			write_entity(object_name, smooth_groups, data_group_id, object_is_convex)
-
-# writing path corner entities
-for data_index, data in enumerate(input_data):
-	path_corners = {}
-	targeted_path_corners = {}
-	for line in data["lines"]:
-		line_object = ""
-		if not arguments.disable_objects:
-			line_object = line[0]
-		if not line_object in path_corners:
-			path_corners[line_object] = {}
-			targeted_path_corners[line_object] = set()
-		for index in range(1, len(line)):
-			vertex_index = line[index]
-			vertex = data["vertices"][vertex_index]
-			if not vertex_index in path_corners[line_object]:
-				path_corners[line_object][vertex_index] = [vertex, None]
-			# some targets have to be skipped for branching paths
-			if index < len(line) - 1:
-				next_vertex_index = line[index + 1]
-				next_vertex = data["vertices"][next_vertex_index]
-				path_corners[line_object][vertex_index][1] = next_vertex_index
-				targeted_path_corners[line_object].add(next_vertex_index)
-
-	layer_group_id = layer_groups.get(data["name"], None)
-	for object_name in path_corners:
-		path_group_name = object_name if object_name != "" else "paths"
-		adjusted_object_name = object_name if object_name != "" else "unnamed"
-		path_group_id = write_group_entity(path_group_name, layer_group_id, layer_group_id != None)
-
-		path_start_index = -1
-		for index in path_corners[object_name]:
-			if not index in targeted_path_corners[object_name]:
-				path_start_index = index
-		if path_start_index == -1 and len(path_corners[object_name].keys()):
-			path_start_index = list(path_corners[object_name].keys())[0]
-
-		for index in path_corners[object_name]:
-			origin, target_index = tuple(path_corners[object_name][index])
-			targetname = f'{data["name"]}/{adjusted_object_name}-{index}'
-			target = f'{data["name"]}/{adjusted_object_name}-{target_index}'
-			if index == path_start_index:
-				targetname = f'{data["name"]}/{adjusted_object_name}'
-			if target_index == path_start_index:
-				target = f'{data["name"]}/{adjusted_object_name}'
-			write_path_corner_enity(origin, targetname, target, path_group_id, target_index)
-
-# closing output file
-output_file.close()
+			is_split = np.isin(clusters, clusters[triangle_indices[kept_triangles[is_flipped]]]) & ~is_locked
+			vertex_levels[is_split] += 1
+			# vertices split down to the smallest cells of the search are reverted
+			is_locked |= (vertex_levels > 16)
+			clusters, kept_triangles = get_clusters(high_cell_size)
+		errors = vectors3_length(points - cluster_points[clusters])
+
+		object_data = dict(data)
+		object_data["vertices"] = cluster_points
+		object_data["triangles"] = clusters[triangle_indices[kept_triangles]]
+		for key in ["triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+			object_data[key] = data[key][triangles[kept_triangles]]
+		smooth_groups.clear()
+		smooth_groups.update(get_smooth_groups(object_data, np.arange(len(kept_triangles))))
+		name = name if name != "" else data["name"]
+		print(f'{name}: {len(triangles)} -> {len(kept_triangles)} triangles, error {np.max(errors):g} max, {np.mean(errors):g} mean')
+		# locked vertices can keep the object over the budget even with the largest cells, split ones add triangles too
+		brush_count = len(kept_triangles) * self.get_triangle_brush_count()
+		if brush_count > self.arguments.target_brushes:
+			over_count = brush_count - self.arguments.target_brushes
+			text = f'{name}: {brush_count} brushes are {over_count} ({over_count * 100.0 / self.arguments.target_brushes:.0f}%) over the target, {boundary_count} vertices are locked on boundaries'
+			split_count = np.count_nonzero(is_locked | (vertex_levels > 0)) - boundary_count
+			print(text + (f", {split_count} are split to keep triangles from flipping" if split_count > 0 else ""))
+		return object_data
+
+	def write_path_corner_enity(self, origin, targetname, target, parent_group_id = None, flag = None):
+		o = origin
+		if not self.arguments.disable_grid_snap:
+			o = vector3_grid_snap(origin, 1.0)
+		self.output_file.write("{\n")
+		self.output_file.write('"classname" "path_corner"\n')
+		self.output_file.write(f'"origin" "{o[0]:g} {o[1]:g} {o[2]:g}"\n')
+		self.output_file.write(f'"targetname" "{targetname}"\n')
+		self.output_file.write(f'"target" "{target}"\n')
+		self.output_file.write(f'"wait" "{0 if flag != None else -1}"\n')
+		self.output_file.write(f'"_tb_group" "{parent_group_id}"\n')
+		self.write_update_source()
+		self.output_file.write("}\n")
+
+	def write_file_group_entities(self, data):
+		layer_group_id = None
+		if not self.arguments.disable_layers:
+			layer_group_id = self.write_layer_group_entity(data["name"])
+		data["group_id"] = self.write_group_entity(data["name"], layer_group_id, layer_group_id != None)
+		self.layer_groups[data["name"]] = layer_group_id
+
+	def write_object(self, data, object_name, smooth_groups):
+		if self.input_is_directory and len(smooth_groups) > 0 and data["group_id"] == None:
+			self.write_file_group_entities(data)
+
+		object_is_convex = len(smooth_groups) > 0 and self.is_convex_object(data, object_name)
+		if object_is_convex:
+			self.profiler.start("convexify")
+			self.convexify_smooth_groups(data, smooth_groups)
+			self.profiler.stop()
+		if self.arguments.target_brushes != None and not object_is_convex and len(smooth_groups) > 0:
+			self.profiler.start("decimate")
+			data = self.decimate_smooth_groups(data, object_name, smooth_groups)
+			self.profiler.stop()
+
+		self.write_entity(data, object_name, smooth_groups, data["group_id"], object_is_convex)
+
+	def write_object_block(self, data):
+		self.profiler.start("parse")
+		self.load_mesh_arrays(data, True)
+		self.profiler.stop()
+		self.count_triangles(data)
+		self.add_map_materials(data["materials"])
+		self.update_material_lists()
+		data["material_map"] = self.get_material_map(data)
+
+		smooth_groups = get_smooth_groups(data, np.arange(len(data["triangles"])))
+		if self.arguments.disable_objects:
+			self.write_entity(data, data["name"], smooth_groups, None, True)
+		else:
+			object_name = data["objects"][data["triangle_objects"][0]]
+			self.write_object(data, object_name, smooth_groups)
+
+		# releasing object block arrays before clearing its buffers
+		for key in ["vertices", "triangles", "triangle_smooth_groups", "triangle_materials", "triangle_objects"]:
+			del data[key]
+		for key in ["triangle_buffer", "smooth_group_buffer", "material_buffer", "object_buffer"]:
+			del data[key][:]
+
+	def write_path_corners(self, data):
+		self.profiler.start("paths")
+		path_corners = {}
+		targeted_path_corners = {}
+		for line in data["lines"]:
+			line_object = ""
+			if not self.arguments.disable_objects:
+				line_object = line[0]
+			if not line_object in path_corners:
+				path_corners[line_object] = {}
+				targeted_path_corners[line_object] = set()
+			for index in range(1, len(line)):
+				vertex_index = line[index]
+				vertex = data["vertices"][vertex_index].tolist()
+				if not vertex_index in path_corners[line_object]:
+					path_corners[line_object][vertex_index] = [vertex, None]
+				# some targets have to be skipped for branching paths
+				if index < len(line) - 1:
+					next_vertex_index = line[index + 1]
+					path_corners[line_object][vertex_index][1] = next_vertex_index
+					targeted_path_corners[line_object].add(next_vertex_index)
+
+		layer_group_id = self.layer_groups.get(data["name"], None)
+		for object_name in path_corners:
+			path_group_name = object_name if object_name != "" else "paths"
+			adjusted_object_name = object_name if object_name != "" else "unnamed"
+			path_group_id = self.write_group_entity(path_group_name, layer_group_id, layer_group_id != None)
+
+			path_start_index = -1
+			for index in path_corners[object_name]:
+				if not index in targeted_path_corners[object_name]:
+					path_start_index = index
+			if path_start_index == -1 and len(path_corners[object_name].keys()):
+				path_start_index = list(path_corners[object_name].keys())[0]
+
+			for index in path_corners[object_name]:
+				origin, target_index = tuple(path_corners[object_name][index])
+				targetname = f'{data["name"]}/{adjusted_object_name}-{index}'
+				target = f'{data["name"]}/{adjusted_object_name}-{target_index}'
+				if index == path_start_index:
+					targetname = f'{data["name"]}/{adjusted_object_name}'
+				if target_index == path_start_index:
+					target = f'{data["name"]}/{adjusted_object_name}'
+				self.write_path_corner_enity(origin, targetname, target, path_group_id, target_index)
+		self.profiler.stop()
+
+	def write_data(self, data, data_index):
+		if self.arguments.disable_objects:
+			smooth_groups = get_smooth_groups(data, np.arange(len(data["triangles"])))
+			self.write_entity(data, data["name"], smooth_groups, None, data_index + 1)
+		else:
+			for object_name in data["objects"]:
+				object_id = data["object_ids"][object_name]
+				smooth_groups = dict(data["object_smooth_groups"].get(object_id, {}))
+				self.write_object(data, object_name, smooth_groups)
+
+	# group ids of each buffer start from one and are offset when writing
+	def write_data_to_buffers(self, data_index):
+		data = self.input_data[data_index]
+		self.output_file, self.map_group_count = MapWriter(io.StringIO()), 0
+		self.write_data(data, data_index)
+		self.output_file.flush()
+		entities, entity_group_count = self.output_file.file.getvalue(), self.map_group_count
+		self.output_file = MapWriter(io.StringIO())
+		self.write_path_corners(data)
+		self.output_file.flush()
+		path_group_count = self.map_group_count - entity_group_count
+		return (entities, entity_group_count, self.output_file.file.getvalue(), path_group_count)
+
+	def get_update_arguments_hash(self):
+		update_arguments = [(key, value) for key, value in sorted(vars(self.arguments).items()) if not key in update_ignored_arguments]
+		return hashlib.sha1(repr(update_arguments).encode())
+
+	# writes entities of a source unless its hash has not changed since the last update
+	def write_update_unit(self, data, unit, content, write_function):
+		key = (data["name"], unit)
+		self.update_keys.append(key)
+		content_hash = self.get_update_arguments_hash()
+		content_hash.update(content)
+		content_hash = content_hash.hexdigest()
+		old_unit = self.update_units.get(key)
+		if old_unit != None and old_unit["hash"] == content_hash:
+			return False
+
+		map_file, self.output_file = self.output_file, MapWriter(io.StringIO())
+		self.reused_group_ids[:] = old_unit["group_ids"] if old_unit != None else []
+		self.update_source = (data["name"], unit, content_hash)
+		write_function()
+		self.update_source = None
+		self.reused_group_ids.clear()
+		self.output_file.flush()
+		self.update_texts[key] = self.output_file.file.getvalue()
+		self.output_file = map_file
+		return True
+
+	def get_object_content(self, data, object_name, smooth_groups):
+		triangles = np.zeros(0, dtype=np.int64)
+		if len(smooth_groups) > 0:
+			triangles = np.concatenate(list(smooth_groups.values()))
+		material_indices = data["material_map"][data["triangle_materials"][triangles]]
+		materials, material_indices = np.unique(material_indices, return_inverse=True)
+		material_names = [self.arguments.material_list[index] + ";" + self.arguments.skip_material_list[index] for index in materials.tolist()]
+		content = [object_name, str(data["group_id"]), str(list(smooth_groups.keys()))] + material_names
+		content = ["\n".join(content).encode(), data["vertices"][data["triangles"][triangles]].tobytes()]
+		content += [data["triangle_smooth_groups"][triangles].tobytes(), material_indices.astype(np.int64).tobytes()]
+		return b"".join(content)
+
+	def write_data_units(self, data, data_index):
+		if self.arguments.disable_objects:
+			smooth_groups = get_smooth_groups(data, np.arange(len(data["triangles"])))
+			content = self.get_object_content(data, "", smooth_groups)
+			self.write_update_unit(data, "objects", content, lambda: self.write_entity(data, data["name"], smooth_groups, None, data_index + 1))
+			return
+
+		# restoring file groups of unchanged sources
+		if self.input_is_directory and len(data["triangles"]) > 0:
+			if not self.write_update_unit(data, "group", b"", lambda: self.write_file_group_entities(data)):
+				group_ids = self.update_units[(data["name"], "group")]["group_ids"]
+				data["group_id"] = group_ids[-1]
+				self.layer_groups[data["name"]] = group_ids[0] if len(group_ids) > 1 else None
+
+		for object_name in data["objects"]:
+			object_id = data["object_ids"][object_name]
+			smooth_groups = dict(data["object_smooth_groups"].get(object_id, {}))
+			if len(smooth_groups) > 0:
+				content = self.get_object_content(data, object_name, smooth_groups)
+				self.write_update_unit(data, "object " + object_name, content, lambda: self.write_object(data, object_name, smooth_groups))
+
+	def write_path_corner_units(self, data):
+		if len(data["lines"]) > 0:
+			content = [repr(data["lines"]), str(self.layer_groups.get(data["name"], None))]
+			# corners only depend on the vertices of paths
+			path_vertices = np.unique(np.array([index for line in data["lines"] for index in line[1:]], dtype=np.int64))
+			content = ["\n".join(content).encode(), data["vertices"][path_vertices].tobytes()]
+			self.write_update_unit(data, "paths", b"".join(content), lambda: self.write_path_corners(data))
+
+	# replacing changed sources in place, removed sources are dropped and new ones appended
+	def write_update_blocks(self):
+		input_names = set([data["name"] for data in self.input_data])
+		current_keys = set(self.update_keys)
+		written_keys = set()
+		for block in self.update_blocks:
+			key = block["key"]
+			if key in self.update_texts:
+				if not key in written_keys:
+					self.output_file.write(self.update_texts[key])
+					written_keys.add(key)
+			elif key == None or key in current_keys or not key[0] in input_names:
+				self.output_file.write(block["text"])
+		for key in self.update_keys:
+			if key in self.update_texts and not key in written_keys:
+				self.output_file.write(self.update_texts[key])
+
+	def write_output_file(self):
+		# starting to write output file
+		if len(self.update_header) > 0 or len(self.update_blocks) > 0:
+			self.output_file.write("".join(self.update_header))
+		elif not self.arguments.append_to_output:
+			self.output_file.write(f"// Game: {self.arguments.game}\n")
+			if self.arguments.uv_valve:
+				self.output_file.write("// Format: Valve\n")
+			else:
+				self.output_file.write("// Format: Standard\n")
+
+		# brushes of large objects are formatted in parallel when files are not
+		if self.arguments.jobs > 1 and not self.use_process_pool:
+			self.output_file.flush()
+			self.brush_pool = self.create_process_pool()
+
+		# writing entities
+		self.layer_groups = {}
+		self.update_texts.clear()
+		self.update_keys.clear()
+		try:
+			if self.arguments.stream:
+				# objects are written as soon as their blocks are read
+				for input_file_path in self.input_file_paths:
+					input_file = self.open_input_file(input_file_path)
+					if input_file == None:
+						continue
+					data = create_obj_data(input_file_path)
+					self.profiler.start("parse")
+					if self.arguments.disable_objects:
+						self.read_obj_file(input_file, data)
+						if len(data["triangle_buffer"]) > 0:
+							self.write_object_block(data)
+					else:
+						self.read_obj_file(input_file, data, self.write_object_block)
+					input_file.close()
+					self.profiler.stop()
+					if len(data["lines"]) > 0:
+						data["vertices"] = self.get_vertices(data["vertex_buffer"])
+						self.write_path_corners(data)
+			elif self.use_process_pool:
+				# layer blocks are generated by workers and written in the input order,
+				# their stages are profiled as a whole
+				self.output_file.flush()
+				self.profiler.start("brushes")
+				path_blocks = []
+				with self.create_process_pool() as pool:
+					for block in self.get_worker_results(pool, "write_data_to_buffers", range(len(self.input_data))):
+						entities, entity_group_count, path_corners, path_group_count = block
+						entity_group_offset = self.map_group_count
+						self.output_file.write(offset_group_ids(entities, lambda group_id: group_id + entity_group_offset))
+						self.map_group_count += entity_group_count
+						path_blocks.append((entity_group_offset, block))
+
+				# path corner groups come after all entity groups, like in a single process
+				for entity_group_offset, block in path_blocks:
+					entities, entity_group_count, path_corners, path_group_count = block
+					path_group_offset = self.map_group_count - entity_group_count
+					def offset_path_group_id(group_id):
+						if group_id > entity_group_count:
+							return group_id + path_group_offset
+						return group_id + entity_group_offset
+					self.output_file.write(offset_group_ids(path_corners, offset_path_group_id))
+					self.map_group_count += path_group_count
+				self.profiler.stop()
+			elif self.arguments.update:
+				for data_index, data in enumerate(self.input_data):
+					self.write_data_units(data, data_index)
+				for data in self.input_data:
+					self.write_path_corner_units(data)
+				self.write_update_blocks()
+			else:
+				for data_index, data in enumerate(self.input_data):
+					self.write_data(data, data_index)
+
+				# writing path corner entities
+				for data in self.input_data:
+					self.write_path_corners(data)
+
+			# waiting for brushes of the pool before closing it
+			if self.brush_pool != None:
+				self.output_file.flush()
+		finally:
+			if self.brush_pool != None:
+				self.brush_pool.close()
+				self.brush_pool.join()
+				self.brush_pool = None
+				self.brush_task, self.pending_brush_task_count = None, 0
+
+		# closing output file, streams are only flushed
+		if is_path(self.arguments.output):
+			self.output_file.close()
+		else:
+			self.output_file.flush()
+		if self.arguments.update:
+			os.replace(self.arguments.output + ".update", self.arguments.output)
+
+	# loads objects of the input into arrays, they are sorted like for writing
+	def load_scene(self):
+		self.set_output()
+		self.set_input_file_paths()
+		self.load_input_data()
+		return self.input_data
+
+	# returns objects information instead of writing it
+	def convert(self):
+		self.set_output()
+		self.set_input_file_paths()
+		self.load_input_data()
+		if self.arguments.info:
+			info = self.get_objects_info()
+			self.profiler.report(self.arguments.profile)
+			return info
+		self.open_output_file()
+		self.write_output_file()
+		self.profiler.report(self.arguments.profile)
+		return None
+
+
+
+# converts parsed arguments, returns objects information instead of writing it
+def convert_arguments(arguments):
+	return ObjConverter(arguments).convert()
+
+# converts an object file, a directory of them or a text stream into a map file or a text stream,
+# options are named like command line arguments
+def convert(input, output = None, **options):
+	arguments = get_arguments(**options)
+	arguments.input, arguments.output = input, output
+	return convert_arguments(arguments)
+
+# returns objects information printed by --info option
+def get_info(input, **options):
+	return convert(input, info=True, **options)
+
+# loads objects of a file, a directory or a text stream into arrays, they are sorted like for writing
+def load_scene(input, **options):
+	arguments = get_arguments(**options)
+	arguments.input = input
+	return ObjConverter(arguments).load_scene()
+
+# formats brushes of triangles indexing object vertices, materials are names of triangles
+def generate_brushes(vertices, triangles, materials = None, **options):
+	converter = ObjConverter(get_arguments(**options))
+	arguments = converter.arguments
+	triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+	if materials is None:
+		materials = [arguments.material] * len(triangles)
+	material_list, material_indices = np.unique(np.array(materials, dtype=str), return_inverse=True)
+	data = {"vertices": converter.get_vertices(np.asarray(vertices, dtype=np.float64).reshape(-1))}
+	data["triangles"] = triangles
+	data["triangle_materials"] = material_indices.reshape(-1)
+	data["material_map"] = np.arange(len(material_list))
+	# invalid brushes are reported as triangles of a single object
+	data["triangle_objects"] = np.zeros(len(triangles), dtype=np.int64)
+	data["objects"] = ["brushes"]
+	arguments.material_list = material_list.tolist()
+	arguments.skip_material_list = [arguments.skip_material] * len(material_list)
+	converter.output_file = MapWriter(io.StringIO())
+	return converter.format_brush_batch(converter.get_brush_batch(data, np.arange(len(triangles))))
+
+def main():
+	try:
+		converter = ObjConverter(get_arguments(sys.argv[1:]))
+		info = converter.convert()
+	except ConversionError as error:
+		print(error)
+		quit()
+	if info != None:
+		converter.print_objects_info(info)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,123 @@
+import sys, time, json, cProfile
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# wall and CPU time of script stages with counters, shared by the converters
+class Profiler:
+	def __init__(self, enabled = False, profile_stage = None, stats_path = None):
+		self.enabled = enabled
+		self.stages = {}
+		self.counters = {}
+		# stages are exclusive, a nested stage pauses the one it was started from
+		self.stack = []
+		self.hooks = []
+		if profile_stage != None:
+			self.add_stage_hook(profile_stage, *self.get_cprofile_hook(stats_path))
+		self.start_times = self.get_times()
+
+	# CPU time includes worker processes after they were joined
+	def get_times(self):
+		cpu_time = time.process_time()
+		if resource != None:
+			usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+			cpu_time += usage.ru_utime + usage.ru_stime
+		return (time.perf_counter(), cpu_time)
+
+	# functions called when the stage starts and stops, for cProfile or sampling profilers
+	def add_stage_hook(self, stage, start_function, stop_function):
+		self.hooks.append((stage, start_function, stop_function))
+
+	def get_cprofile_hook(self, stats_path):
+		profile = cProfile.Profile()
+		def stop_function():
+			profile.disable()
+			if stats_path != None:
+				profile.dump_stats(stats_path)
+		return (profile.enable, stop_function)
+
+	def add_times(self, name, start_times, times):
+		stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+		stage["wall"] += times[0] - start_times[0]
+		stage["cpu"] += times[1] - start_times[1]
+
+	def start(self, name):
+		if not self.enabled:
+			return
+		times = self.get_times()
+		if len(self.stack) > 0:
+			self.add_times(self.stack[-1][0], self.stack[-1][1], times)
+		self.stack.append((name, times))
+		self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})["calls"] += 1
+		for stage, start_function, stop_function in self.hooks:
+			if stage == name and not name in [entry[0] for entry in self.stack[:-1]]:
+				start_function()
+
+	def stop(self):
+		if not self.enabled:
+			return
+		times = self.get_times()
+		name, start_times = self.stack.pop()
+		self.add_times(name, start_times, times)
+		if len(self.stack) > 0:
+			self.stack[-1] = (self.stack[-1][0], times)
+		for stage, start_function, stop_function in self.hooks:
+			if stage == name and not name in [entry[0] for entry in self.stack]:
+				stop_function()
+
+	def count(self, name, value = 1):
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	# counters of worker processes are returned with their results and summed by the parent
+	def add_counters(self, counters):
+		for name, value in counters.items():
+			self.count(name, value)
+
+	# maximum resident size of the script or its largest worker in megabytes
+	def get_peak_memory(self):
+		if resource == None:
+			return None
+		scale = 1.0 / (1 << 20) if sys.platform == "darwin" else 1.0 / (1 << 10)
+		sizes = [resource.getrusage(usage).ru_maxrss for usage in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+		return max(sizes) * scale
+
+	def get_report(self):
+		times = self.get_times()
+		report = {"wall": times[0] - self.start_times[0], "cpu": times[1] - self.start_times[1]}
+		report["peak_rss_mb"] = self.get_peak_memory()
+		report["stages"] = {name: dict(stage) for name, stage in self.stages.items()}
+		# time spent outside of stages
+		other = {"wall": report["wall"], "cpu": report["cpu"], "calls": 1}
+		for stage in self.stages.values():
+			other["wall"] -= stage["wall"]
+			other["cpu"] -= stage["cpu"]
+		report["stages"]["other"] = other
+		report["counters"] = dict(self.counters)
+		return report
+
+	# writes the report as JSON when a path is provided, otherwise prints it to stderr
+	def report(self, path = None):
+		if not self.enabled:
+			return
+		while len(self.stack) > 0:
+			self.stop()
+		report = self.get_report()
+		if path != None and path != "":
+			try:
+				with open(path, "w") as output_file:
+					json.dump(report, output_file, indent = 2)
+			except Exception:
+				print(f"Failed writing profile: {path}", file=sys.stderr)
+			return
+
+		print("Profile:", file=sys.stderr)
+		for name, stage in report["stages"].items():
+			print(f'  {name:<16} {stage["wall"]:>9.3f}s wall {stage["cpu"]:>9.3f}s CPU {stage["calls"]:>8} calls', file=sys.stderr)
+		print(f'  {"total":<16} {report["wall"]:>9.3f}s wall {report["cpu"]:>9.3f}s CPU', file=sys.stderr)
+		if report["peak_rss_mb"] != None:
+			print(f'Peak memory: {report["peak_rss_mb"]:.1f} MB', file=sys.stderr)
+		counters = [f"{name}: {value}" for name, value in report["counters"].items()]
+		if len(counters) > 0:
+			print(", ".join(counters).capitalize(), file=sys.stderr)
@@ -0,0 +1,152 @@
+import os, sys, io, tempfile, contextlib, threading, unittest
+import numpy as np
+from PIL import Image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import height2map
+
+def get_heights(size):
+	x, y = np.meshgrid(np.arange(size), np.arange(size))
+	return ((np.sin(x * 0.3) * np.cos(y * 0.2) * 0.5 + 0.5) * 255.0).astype(np.uint8)
+
+def get_image(size):
+	return Image.fromarray(get_heights(size), "L")
+
+def get_brush_count(text):
+	return text.count("{\n( ")
+
+class GenerateBrushesTest(unittest.TestCase):
+	def test_window(self):
+		text = height2map.generate_brushes(get_image(16), 4, 2, 3, 5)
+		self.assertEqual(get_brush_count(text), 3 * 5 * 2)
+
+	def test_converted_window(self):
+		output = io.StringIO()
+		height2map.convert(get_image(16), output)
+		self.assertIn(height2map.generate_brushes(get_image(16)), output.getvalue())
+
+class ConverterTest(unittest.TestCase):
+	def convert(self, **options):
+		output = io.StringIO()
+		height2map.convert(get_image(32), output, chunk_size=8, merge_coplanar=True, **options)
+		return output.getvalue()
+
+	def test_threads(self):
+		expected = self.convert()
+		outputs = []
+		threads = [threading.Thread(target=lambda: outputs.append(self.convert(jobs=2))) for index in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(outputs, [expected] * len(threads))
+
+# the same heights stored in 8 and 16 bits, as floats and as raw files give the same terrain
+class HeightmapFormatsTest(unittest.TestCase):
+	def convert(self, input, **options):
+		output = io.StringIO()
+		height2map.convert(input, output, **options)
+		return output.getvalue()
+
+	def test_same_terrain(self):
+		heights = get_heights(16)
+		expected = self.convert(get_image(16))
+		with tempfile.TemporaryDirectory() as directory:
+			png_path = os.path.join(directory, "terrain.png")
+			Image.fromarray(heights.astype(np.uint16) * 257).save(png_path)
+			(heights.astype("<u2") * 257).tofile(os.path.join(directory, "terrain.r16"))
+			(heights.astype("<f4") / 255).tofile(os.path.join(directory, "terrain.r32"))
+			inputs = [(png_path, {}), (Image.fromarray(heights.astype(np.float32) / 255), {})]
+			inputs += [(os.path.join(directory, "terrain.r16"), {}), (os.path.join(directory, "terrain.r32"), {"raw_format": "<f4"})]
+			inputs += [(io.BytesIO(heights.astype(np.uint8).tobytes()), {"raw_width": 16, "raw_format": "u1"})]
+			for input, options in inputs:
+				with self.subTest(input=height2map.get_input_name(input), **options):
+					self.assertEqual(self.convert(input, **options), expected)
+
+	# 16-bit heights aren't reduced to 8 bits
+	def test_16_bit_precision(self):
+		heights = get_heights(16).astype(np.uint16) * 257
+		self.assertNotEqual(self.convert(Image.fromarray(heights + 128)), self.convert(Image.fromarray(heights)))
+
+	def test_raw_width(self):
+		values = np.zeros((8, 16), dtype="<u2")
+		self.assertEqual(get_brush_count(self.convert(io.BytesIO(values.tobytes()), raw_width=16)), 8 * 16 * 2)
+		with self.assertRaises(height2map.ConversionError):
+			self.convert(io.BytesIO(values.tobytes()), raw_width=15)
+
+class TileOutputTest(unittest.TestCase):
+	# every chunk is written into its own map with the brushes of its window
+	def test_tiles(self):
+		with tempfile.TemporaryDirectory() as directory:
+			output_path = os.path.join(directory, "terrain.map")
+			height2map.convert(get_image(32), output_path, chunk_size=8, tile_output=True)
+			self.assertFalse(os.path.exists(output_path))
+			for x_chunk in range(4):
+				for y_chunk in range(4):
+					with open(os.path.join(directory, f"terrain_{x_chunk}_{y_chunk}.map")) as tile_file:
+						text = tile_file.read()
+					self.assertEqual(get_brush_count(text), 8 * 8 * 2)
+					self.assertIn(height2map.generate_brushes(get_image(32), x_chunk * 8, y_chunk * 8, 8, 8), text)
+			self.assertEqual(len(os.listdir(directory)), 16)
+
+	def test_unavailable_options(self):
+		for input, output, options in [(get_image(32), "terrain.map", {}), (get_image(32), io.StringIO(), {"chunk_size": 8})]:
+			with self.subTest(**options):
+				with self.assertRaises(height2map.ConversionError):
+					height2map.convert(input, output, tile_output=True, **options)
+
+class UpdateTest(unittest.TestCase):
+	def convert(self, heights, output_path, **options):
+		with contextlib.redirect_stdout(io.StringIO()):
+			height2map.convert(Image.fromarray(heights, "L"), output_path, chunk_size=8, update=True, **options)
+		with open(output_path) as output_file:
+			return output_file.read()
+
+	# chunk entities regenerated since marking the old map
+	def get_generated_chunks(self, heights, output_path, **options):
+		with open(output_path) as output_file:
+			text = output_file.read()
+		with open(output_path, "w") as output_file:
+			output_file.write(text.replace("__TB_empty", "KEPT"))
+		text = self.convert(heights, output_path, **options)
+		return len([entity for entity in text.split('\n{\n"classname"')[1:] if "__TB_empty" in entity])
+
+	def test_same_output(self):
+		heights = get_heights(32)
+		edited_heights = heights.copy()
+		edited_heights[3, 3] += 10
+		with tempfile.TemporaryDirectory() as directory:
+			output_path = os.path.join(directory, "terrain.map")
+			self.convert(heights, output_path)
+			self.assertEqual(self.convert(edited_heights, output_path), self.convert(edited_heights, os.path.join(directory, "edited.map")))
+
+	# chunks read a border column and row of their neighbours, wrapping around the heightmap
+	def test_changed_chunks(self):
+		heights = get_heights(32)
+		with tempfile.TemporaryDirectory() as directory:
+			output_path = os.path.join(directory, "terrain.map")
+			self.convert(heights, output_path)
+			self.assertEqual(self.get_generated_chunks(heights, output_path), 0)
+			for row, column, chunk_count in [(3, 3, 1), (3, 8, 2), (3, 0, 2), (7, 8, 4)]:
+				with self.subTest(row=row, column=column):
+					heights[row, column] += 10
+					self.assertEqual(self.get_generated_chunks(heights, output_path), chunk_count)
+			self.assertEqual(self.get_generated_chunks(heights, output_path, height=128.0), 16)
+
+	# unchanged tiles are kept as they are
+	def test_tiles(self):
+		heights = get_heights(32)
+		with tempfile.TemporaryDirectory() as directory:
+			output_path = os.path.join(directory, "terrain.map")
+			height2map.convert(Image.fromarray(heights, "L"), output_path, chunk_size=8, update=True, tile_output=True)
+			tile_names = sorted(os.listdir(directory))
+			self.assertEqual(len(tile_names), 16)
+			for name in tile_names:
+				os.utime(os.path.join(directory, name), ns=(0, 0))
+			heights[3, 3] += 10
+			height2map.convert(Image.fromarray(heights, "L"), output_path, chunk_size=8, update=True, tile_output=True)
+			self.assertEqual(sorted(os.listdir(directory)), tile_names)
+			updated_names = [name for name in tile_names if os.stat(os.path.join(directory, name)).st_mtime_ns != 0]
+			self.assertEqual(updated_names, ["terrain_0_3.map"])
+
+if __name__ == "__main__":
+	unittest.main()
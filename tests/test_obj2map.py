@@ -0,0 +1,589 @@
+import os, sys, io, json, tempfile, contextlib, threading, unittest
+from unittest import mock
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import obj2map
+
+# coplanar grid with jittered vertices, merged polygons reject concave and collinear neighbours,
+# snapping moves vertices of tilted grids off their planes
+def get_jittered_grid(size, seed, tilt = 0.0):
+	random = np.random.default_rng(seed)
+	x, z = np.meshgrid(np.arange(size + 1, dtype=np.float64), np.arange(size + 1, dtype=np.float64))
+	x += random.uniform(-0.3, 0.3, x.shape)
+	z += random.uniform(-0.3, 0.3, z.shape)
+	y = (x * 0.7 + z * 0.3) * tilt
+	lines = ["o Plane"] + [f"v {a:.6f} {b:.6f} {c:.6f}" for a, b, c in zip(x.reshape(-1).tolist(), y.reshape(-1).tolist(), z.reshape(-1).tolist())]
+	for row in range(size):
+		for column in range(size):
+			corner = row * (size + 1) + column + 1
+			lines.append(f"f {corner} {corner + size + 1} {corner + size + 2}")
+			lines.append(f"f {corner} {corner + size + 2} {corner + 1}")
+	return "\n".join(lines) + "\n"
+
+# L-shaped floor with vertices in the middle of straight edges
+concave_floor = """o Floor
+v 0 0 0
+v 1 0 0
+v 2 0 0
+v 0 0 1
+v 1 0 1
+v 2 0 1
+v 0 0 2
+v 1 0 2
+f 1 4 5
+f 1 5 2
+f 2 5 6
+f 2 6 3
+f 4 7 8
+f 4 8 5
+"""
+
+def get_brush_count(text):
+	return text.count("{\n( ")
+
+# returns the three points of every plane of every brush
+def get_brush_planes(text):
+	brushes = [brush.split("\n}")[0] for brush in text.split("{\n( ")[1:]]
+	return [np.array([line.split()[1:4] + line.split()[6:9] + line.split()[11:14] for line in ("( " + brush).splitlines()], dtype=np.float64).reshape(-1, 3, 3) for brush in brushes]
+
+class MergeCoplanarTest(unittest.TestCase):
+	def convert(self, text, **options):
+		output = io.StringIO()
+		obj2map.convert(io.StringIO(text), output, merge_coplanar=True, **options)
+		return output.getvalue()
+
+	# prisms have sides from each polygon point to its back point, followed by back and front caps
+	def assertFlatPrisms(self, text):
+		prisms = [planes for planes in get_brush_planes(text) if len(planes) > 4]
+		for planes in prisms:
+			sides, back_cap, front_cap = planes[:-2], planes[-2], planes[-1]
+			for cap, cap_points in [(back_cap, sides[:, 1]), (front_cap, sides[:, 0])]:
+				normal = np.cross(cap[2] - cap[0], cap[1] - cap[0])
+				distances = (cap_points - cap[0]) @ normal / np.linalg.norm(normal)
+				self.assertLess(np.max(np.abs(distances)), 0.001)
+		return len(prisms)
+
+	def test_concave_floor(self):
+		self.assertGreater(self.assertFlatPrisms(self.convert(concave_floor)), 0)
+
+	def test_jittered_grids(self):
+		for seed in range(20):
+			with self.subTest(seed=seed):
+				self.assertGreater(self.assertFlatPrisms(self.convert(get_jittered_grid(4, seed))), 0)
+				self.assertFlatPrisms(self.convert(get_jittered_grid(4, seed, 1.0)))
+
+class GenerateBrushesTest(unittest.TestCase):
+	def test_validate(self):
+		vertices = [[0, 0, 0], [1, 0, 0], [0, 0, 1], [2, 0, 0]]
+		# the second triangle has no area and no valid brush
+		text = obj2map.generate_brushes(vertices, [[0, 2, 1], [0, 1, 3]], validate=True)
+		self.assertEqual(get_brush_count(text), 1)
+
+	def test_materials_array(self):
+		vertices = [[0, 0, 0], [1, 0, 0], [0, 0, 1]]
+		text = obj2map.generate_brushes(vertices, [[0, 2, 1], [0, 1, 2]], np.array(["STONE", "WOOD"]))
+		self.assertIn(" STONE ", text)
+		self.assertIn(" WOOD ", text)
+
+# input stream generating brushes with other options while the map is converted
+class NestedInput(io.StringIO):
+	def read(self, *args):
+		obj2map.generate_brushes([[0, 0, 0], [1, 0, 0], [0, 0, 1]], [[0, 2, 1]], normal_offset=-4.0, uv_valve=True)
+		return super().read(*args)
+
+class LibraryStateTest(unittest.TestCase):
+	def convert(self, input_class = io.StringIO):
+		output = io.StringIO()
+		obj2map.convert(input_class(concave_floor), output, normal_offset=2.0)
+		return output.getvalue()
+
+	def test_nested_calls(self):
+		self.assertEqual(self.convert(NestedInput), self.convert())
+
+	def test_threads(self):
+		expected = self.convert()
+		outputs = []
+		threads = [threading.Thread(target=lambda: outputs.append(self.convert())) for index in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(outputs, [expected] * len(threads))
+
+	# a conversion waiting for its input doesn't hold back conversions in other threads
+	def test_concurrent_threads(self):
+		converted = threading.Event()
+		waits = []
+		class WaitingInput(io.StringIO):
+			def read(self, *args):
+				waits.append(converted.wait(10.0))
+				return super().read(*args)
+		thread = threading.Thread(target=self.convert, args=(WaitingInput,))
+		thread.start()
+		self.convert()
+		converted.set()
+		thread.join()
+		self.assertEqual(set(waits), {True})
+
+# triangles with duplicated vertices and every fourth one flattened by grid snapping
+def get_sliver_triangles(count, seed):
+	random = np.random.default_rng(seed)
+	lines = ["o Slivers"]
+	for index, (x, y) in enumerate(random.uniform(-2000, 2000, (count, 2)).tolist()):
+		if index % 4 == 0:
+			lines += [f"v {x:.6f} {y:.6f} 50", f"v {x + 64:.6f} {y:.6f} 50", f"v {x + 128:.6f} {y + 0.001:.6f} 50"]
+		else:
+			lines += [f"v {x:.6f} {y:.6f} 0", f"v {x + 16:.6f} {y:.6f} 0", f"v {x:.6f} {y + 16:.6f} 8"]
+		lines.append(f"f {index * 3 + 1} {index * 3 + 2} {index * 3 + 3}")
+	return "\n".join(lines + lines[1:4]) + "\n"
+
+# many small objects sharing tasks of the brush pool
+def get_object_grids(object_count, size):
+	lines = []
+	for index in range(object_count):
+		grid = get_jittered_grid(size, index).splitlines()
+		offset = index * (size + 1) * (size + 1)
+		lines.append(f"o Object{index}")
+		lines += [line for line in grid if line.startswith("v ")]
+		lines += ["f " + " ".join([str(int(vertex) + offset) for vertex in line.split()[1:]]) for line in grid if line.startswith("f ")]
+	return "\n".join(lines) + "\n"
+
+class BrushPoolTest(unittest.TestCase):
+	def convert(self, **options):
+		output = io.StringIO()
+		obj2map.convert(io.StringIO(get_object_grids(120, 6)), output, **options)
+		return output.getvalue()
+
+	def test_small_groups(self):
+		for options in [{}, {"secondary_normal_offset": 1.0}, {"secondary_normal_offset": -1.0, "secondary_normal_brush": True, "uv_valve": True}]:
+			with self.subTest(**options):
+				self.assertEqual(self.convert(jobs=2, **options), self.convert(**options))
+
+class ProfileCountersTest(unittest.TestCase):
+	def get_counters(self, input, **options):
+		with tempfile.TemporaryDirectory() as directory:
+			profile_path = os.path.join(directory, "profile.json")
+			with contextlib.redirect_stdout(io.StringIO()):
+				obj2map.convert(input, os.path.join(directory, "output.map"), profile=profile_path, **options)
+			with open(profile_path) as profile_file:
+				return json.load(profile_file)["counters"]
+
+	def assertCountersEqual(self, input, counted_name, **options):
+		counters = self.get_counters(input, jobs=1, **options)
+		self.assertGreater(counters.get(counted_name, 0), 0)
+		self.assertEqual(self.get_counters(input, jobs=2, **options), counters)
+
+	def test_brush_pool(self):
+		with tempfile.TemporaryDirectory() as directory:
+			input_path = os.path.join(directory, "slivers.obj")
+			with open(input_path, "w") as input_file:
+				input_file.write(get_sliver_triangles(8192, 0))
+			self.assertCountersEqual(input_path, "invalid", validate=True)
+
+	def test_directory_pool(self):
+		with tempfile.TemporaryDirectory() as directory:
+			for seed in range(3):
+				with open(os.path.join(directory, f"slivers{seed}.obj"), "w") as input_file:
+					input_file.write(get_sliver_triangles(256, seed))
+			self.assertCountersEqual(directory, "welded", validate=True, weld_vertices=True)
+
+# the first two vertices share a grid cell farther apart than epsilon, the third one is close to the second in the next cell
+weld_triangles = """o Weld
+v 10.0001 0 0
+v 10.0019 0 0
+v 10.0021 0 0
+v 0 10 0
+v 0 0 10
+f 1 4 5
+f 2 4 5
+f 3 4 5
+"""
+
+# the third vertex snaps onto the line of the first two, the fifth one onto the second vertex
+snapped_triangles = """o Snapped
+v 0 0 0
+v 1 0 0
+v 2 0.01 0
+v 0 1 0
+v 1.01 0 0
+f 1 2 3
+f 1 2 4
+f 1 5 4
+"""
+
+class WeldTest(unittest.TestCase):
+	def load(self, text, **options):
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			data = obj2map.load_scene(io.StringIO(text), unit_size=1.0, weld_vertices=True, **options)[0]
+		return data, output.getvalue()
+
+	def test_pairwise_distances(self):
+		data, output = self.load(weld_triangles, disable_grid_snap=True)
+		self.assertIn("1 vertices welded, 0 degenerate and 1 duplicate triangles removed", output)
+		self.assertEqual(data["triangles"][:, 0].tolist(), [0, 1])
+
+	def test_snapped_positions(self):
+		data, output = self.load(snapped_triangles)
+		self.assertIn("1 vertices welded, 1 degenerate and 1 duplicate triangles removed", output)
+		self.assertEqual(len(data["triangles"]), 1)
+		self.assertTrue(np.all(data["vertices"] / 0.125 == np.round(data["vertices"] / 0.125)))
+
+# octahedron subdivided into a sphere with jittered radii, dented by vertices inside of its hull
+def get_dented_sphere(subdivisions, seed):
+	random = np.random.default_rng(seed)
+	vertices = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+	triangles = [(0, 2, 4), (2, 1, 4), (1, 3, 4), (3, 0, 4), (2, 0, 5), (1, 2, 5), (3, 1, 5), (0, 3, 5)]
+	for subdivision in range(subdivisions):
+		midpoints = {}
+		def get_midpoint(a, b):
+			key = (min(a, b), max(a, b))
+			if not key in midpoints:
+				midpoints[key] = len(vertices)
+				vertices.append(tuple((np.add(vertices[a], vertices[b]) / 2.0).tolist()))
+			return midpoints[key]
+		new_triangles = []
+		for a, b, c in triangles:
+			ab, bc, ca = get_midpoint(a, b), get_midpoint(b, c), get_midpoint(c, a)
+			new_triangles += [(a, ab, ca), (ab, b, bc), (ca, bc, c), (ab, bc, ca)]
+		triangles = new_triangles
+	vertices = np.array(vertices)
+	vertices *= (random.uniform(90.0, 100.0, len(vertices)) / np.linalg.norm(vertices, axis=1))[:, None]
+	vertices[random.random(len(vertices)) < 0.2] *= 0.5
+	lines = ["o convex_sphere"] + [f"v {x:.6f} {y:.6f} {z:.6f}" for x, y, z in vertices.tolist()]
+	lines += [f"f {a + 1} {b + 1} {c + 1}" for a, b, c in triangles]
+	return "\n".join(lines) + "\n"
+
+class ConvexHullTest(unittest.TestCase):
+	def test_vertices_inside(self):
+		for seed in range(4):
+			with self.subTest(seed=seed):
+				text = get_dented_sphere(4, seed)
+				output = io.StringIO()
+				obj2map.convert(io.StringIO(text), output, convex_hull=True, unit_size=1.0)
+				planes = np.array([line.split()[1:4] + line.split()[6:9] + line.split()[11:14] for line in output.getvalue().splitlines() if line.startswith("( ")], dtype=np.float64).reshape(-1, 3, 3)
+				# plane points are clockwise seen from outside
+				normals = np.cross(planes[:, 2] - planes[:, 0], planes[:, 1] - planes[:, 0])
+				normals /= np.linalg.norm(normals, axis=1)[:, None]
+				vertices = obj2map.vectors3_grid_snap(obj2map.load_scene(io.StringIO(text), unit_size=1.0)[0]["vertices"], 0.125)
+				distances = vertices @ normals.T - np.sum(normals * planes[:, 0], axis=1)
+				self.assertGreater(len(planes), 100)
+				self.assertLess(np.max(distances), 0.001)
+
+# cube with two triangles on every side
+convex_cube = """o convex_cube
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+v 0 0 1
+v 1 0 1
+v 1 1 1
+v 0 1 1
+f 1 4 3
+f 1 3 2
+f 5 6 7
+f 5 7 8
+f 1 2 6
+f 1 6 5
+f 2 3 7
+f 2 7 6
+f 3 4 8
+f 3 8 7
+f 4 1 5
+f 4 5 8
+"""
+
+class InfoTest(unittest.TestCase):
+	def test_convex_planes(self):
+		info = obj2map.get_info(io.StringIO(convex_cube))
+		self.assertEqual([(object_info["triangles"], object_info["brushes"], object_info["planes"]) for object_info in info["files"][0]["objects"][1:]], [(12, 1, 6)])
+
+class DecimateTest(unittest.TestCase):
+	def convert(self, text, **options):
+		output = io.StringIO()
+		with contextlib.redirect_stdout(io.StringIO()) as messages:
+			obj2map.convert(io.StringIO(text), output, **options)
+		return output.getvalue(), messages.getvalue()
+
+	def test_budget(self):
+		text, messages = self.convert(get_jittered_grid(24, 0), target_brushes=200)
+		self.assertLessEqual(get_brush_count(text), 200)
+		self.assertNotIn("over the target", messages)
+
+	def test_locked_boundaries(self):
+		text, messages = self.convert(get_jittered_grid(24, 0), target_brushes=20)
+		self.assertIn(f"{get_brush_count(text)} brushes are {get_brush_count(text) - 20} ", messages)
+		self.assertIn("96 vertices are locked on boundaries", messages)
+
+	# triangles of tilted grids share a single normal, clustering them can flip triangles over
+	def test_flipped_triangles(self):
+		for seed in range(4):
+			with self.subTest(seed=seed):
+				data = obj2map.load_scene(io.StringIO(get_jittered_grid(24, seed, 1.0)))[0]
+				vertices = data["vertices"][data["triangles"][0]]
+				normal = np.cross(vertices[1] - vertices[0], vertices[2] - vertices[0])
+				converter = obj2map.ObjConverter(obj2map.get_arguments(target_brushes=200))
+				with contextlib.redirect_stdout(io.StringIO()):
+					data = converter.decimate_smooth_groups(data, "", {0: np.arange(len(data["triangles"]))})
+				vertices = data["vertices"][data["triangles"]]
+				normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+				self.assertGreater(np.min(normals @ normal), 0.0)
+
+# two objects and a path of their own vertices
+update_scene = """o A
+v 0 0 0
+v 1 0 0
+v 0 0 1
+f 1 3 2
+o B
+v 2 0 0
+v 3 0 0
+v 2 0 1
+f 4 6 5
+o Path
+v 0 1 0
+v 1 1 0
+v 1 1 1
+l 7 8 9
+"""
+
+class UpdateTest(unittest.TestCase):
+	# returns texts of entities of every unit in the order of the map
+	def get_units(self, text):
+		units = {}
+		for entity in text.split('{\n"classname"')[1:]:
+			unit = entity.split('"_obj2map_unit" "')[1].split('"')[0]
+			units[unit] = units.get(unit, "") + entity
+		return units
+
+	# units are marked in the map, so that reused ones keep their marks
+	def update(self, directory, input_text):
+		input_path, output_path = os.path.join(directory, "scene.obj"), os.path.join(directory, "scene.map")
+		with open(input_path, "w") as input_file:
+			input_file.write(input_text)
+		if os.path.isfile(output_path):
+			with open(output_path) as output_file:
+				text = output_file.read()
+			with open(output_path, "w") as output_file:
+				output_file.write(text.replace("__TB_empty", "KEPT").replace('"wait" "-1"', '"wait" "-2"'))
+		obj2map.convert(input_path, output_path, update=True)
+		with open(output_path) as output_file:
+			return self.get_units(output_file.read())
+
+	def test_reuse_and_rewrite(self):
+		with tempfile.TemporaryDirectory() as directory:
+			units = self.update(directory, update_scene)
+			self.assertEqual(list(units.keys()), ["object A", "object B", "paths"])
+			self.assertNotIn("KEPT", units["object A"] + units["object B"])
+
+			# moving a vertex of B rewrites B only, the path doesn't use it
+			moved_scene = update_scene.replace("v 3 0 0", "v 3 0 0.5")
+			units = self.update(directory, moved_scene)
+			self.assertEqual(list(units.keys()), ["object A", "object B", "paths"])
+			self.assertIn("KEPT", units["object A"])
+			self.assertNotIn("KEPT", units["object B"])
+			self.assertIn('"wait" "-2"', units["paths"])
+
+			# moving a path vertex rewrites its corners, removed objects are dropped
+			units = self.update(directory, moved_scene.replace("v 1 1 1", "v 1 1 2").replace("f 1 3 2", ""))
+			self.assertEqual(list(units.keys()), ["object B", "paths"])
+			self.assertIn("KEPT", units["object B"])
+			self.assertIn('"origin" "32 -64 32"', units["paths"])
+			self.assertNotIn('"wait" "-2"', units["paths"])
+
+# faces with texture and normal indices, n-gons, relative indices, smooth groups, materials, colors and paths
+mixed_scene = """mtllib scene.mtl
+o Quads
+usemtl stone
+s 1
+v 0 0 0 1 0 0
+v 4 0 0 0 1 0
+v 4 0 4 0 0 1
+v 0 0 4 0.5 0.5 0.5
+vt 0 0
+vn 0 1 0
+f 1/1/1 2/1/1 3/1/1 4/1/1
+s off
+usemtl wood
+v 0 2 0
+v 4 2 0
+v 2 2 4
+f -3 -2 -1
+g Path
+v 0 8 0
+v 8 8 0
+l 8 9
+o Pentagon
+s 2
+v 10 0 0
+v 12 0 1
+v 12 0 3
+v 10 0 4
+v 9 0 2
+f 10 11 12 13 14
+"""
+
+class StreamTest(unittest.TestCase):
+	# streamed objects are written in the order they are read, like unsorted objects of the vectorized parser
+	def test_same_output(self):
+		text = get_jittered_grid(4, 0) + mixed_scene + concave_floor + convex_cube
+		with tempfile.TemporaryDirectory() as directory:
+			input_path = os.path.join(directory, "mixed.obj")
+			with open(input_path, "w") as input_file:
+				input_file.write(text)
+			for options in [{}, {"vertex_color_materials": True}, {"phong_angle": 89.0}, {"secondary_normal_offset": 1.0, "uv_valve": True}, {"disable_objects": True}, {"weld_vertices": True}]:
+				with self.subTest(**options):
+					outputs = []
+					for stream in [False, True]:
+						output = io.StringIO()
+						with contextlib.redirect_stdout(io.StringIO()):
+							obj2map.convert(input_path, output, stream=stream, disable_sorting_objects=True, disable_sorting_materials=True, **options)
+						outputs.append(output.getvalue())
+					self.assertGreater(get_brush_count(outputs[0]), 0)
+					self.assertEqual(outputs[1], outputs[0])
+
+	def test_unavailable_options(self):
+		for options in [{"info": True}, {"update": True}, {"max_color_materials": 4}]:
+			with self.subTest(**options):
+				with self.assertRaises(obj2map.ConversionError):
+					obj2map.convert(io.StringIO(convex_cube), io.StringIO(), stream=True, **options)
+
+class CacheTest(unittest.TestCase):
+	def convert(self, input_path, cache_directory, **options):
+		output = io.StringIO()
+		with contextlib.redirect_stdout(io.StringIO()):
+			obj2map.convert(input_path, output, cache_directory=cache_directory, **options)
+		return output.getvalue()
+
+	def write_input(self, directory, name, text):
+		input_path = os.path.join(directory, name)
+		with open(input_path, "w") as input_file:
+			input_file.write(text)
+		return input_path
+
+	def test_reuse(self):
+		with tempfile.TemporaryDirectory() as directory:
+			cache_directory = os.path.join(directory, "cache")
+			input_path = self.write_input(directory, "mixed.obj", mixed_scene + convex_cube)
+			output = self.convert(input_path, cache_directory)
+			offset_output = self.convert(input_path, None, normal_offset=8.0)
+			self.assertEqual(len(os.listdir(cache_directory)), 1)
+			# cached files are read without parsing, also with arguments not affecting parsing
+			with mock.patch.object(obj2map.ObjConverter, "read_obj_ranges", side_effect=AssertionError("parsed again")):
+				self.assertEqual(self.convert(input_path, cache_directory), output)
+				self.assertEqual(self.convert(input_path, cache_directory, normal_offset=8.0), offset_output)
+			self.assertEqual(len(os.listdir(cache_directory)), 1)
+
+	def test_invalidation(self):
+		with tempfile.TemporaryDirectory() as directory:
+			cache_directory = os.path.join(directory, "cache")
+			input_path = self.write_input(directory, "cube.obj", convex_cube)
+			self.convert(input_path, cache_directory)
+			for options in [{"scale": 2.0}, {"unit_size": 1.0}, {"vertex_color_materials": True}]:
+				with self.subTest(**options):
+					self.assertEqual(self.convert(input_path, cache_directory, **options), self.convert(input_path, None, **options))
+			self.assertEqual(len(os.listdir(cache_directory)), 4)
+			# edited files have a different size or modification time
+			modification_time = os.stat(input_path).st_mtime_ns + 1000000000
+			self.write_input(directory, "cube.obj", convex_cube.replace("v 1 1 1", "v 2 2 2"))
+			os.utime(input_path, ns=(modification_time, modification_time))
+			self.assertEqual(self.convert(input_path, cache_directory), self.convert(input_path, None))
+			self.assertEqual(len(os.listdir(cache_directory)), 5)
+
+	def test_eviction(self):
+		with tempfile.TemporaryDirectory() as directory:
+			cache_directory = os.path.join(directory, "cache")
+			first_path = self.write_input(directory, "first.obj", convex_cube)
+			second_path = self.write_input(directory, "second.obj", convex_cube)
+			self.convert(first_path, cache_directory)
+			first_cache_path = os.path.join(cache_directory, os.listdir(cache_directory)[0])
+			os.utime(first_cache_path, (0, 0))
+			# the limit fits a single cache file, the least recently used one is removed
+			cache_size = os.path.getsize(first_cache_path) * 1.5 / (1024 * 1024)
+			self.convert(second_path, cache_directory, cache_size=cache_size)
+			cache_names = os.listdir(cache_directory)
+			self.assertEqual(len(cache_names), 1)
+			self.assertTrue(cache_names[0].startswith("second-"))
+
+class PartitionTest(unittest.TestCase):
+	def get_partitions(self, data, **options):
+		converter = obj2map.ObjConverter(obj2map.get_arguments(**options))
+		return converter.get_triangle_partitions(data, np.arange(len(data["triangles"])))
+
+	def get_centers(self, data, triangles):
+		return np.mean(data["vertices"][data["triangles"][triangles]], axis=1)
+
+	def assertPartitioned(self, data, partitions):
+		self.assertGreater(len(partitions), 1)
+		self.assertEqual(np.sort(np.concatenate(partitions)).tolist(), list(range(len(data["triangles"]))))
+
+	def test_grid_cells(self):
+		data = obj2map.load_scene(io.StringIO(get_jittered_grid(24, 0, 1.0)))[0]
+		partitions = self.get_partitions(data, partition_size=128.0)
+		self.assertPartitioned(data, partitions)
+		cells = [np.unique(np.floor(self.get_centers(data, triangles) / 128.0), axis=0) for triangles in partitions]
+		self.assertEqual([len(partition_cells) for partition_cells in cells], [1] * len(partitions))
+		self.assertEqual(len(np.unique(np.concatenate(cells), axis=0)), len(partitions))
+
+	# octree cells don't overlap, so neither do the boxes of their triangle centers
+	def test_octree_cells(self):
+		data = obj2map.load_scene(io.StringIO(get_jittered_grid(24, 0, 1.0)))[0]
+		for options, max_triangles in [({}, 100), ({"secondary_normal_offset": 1.0, "secondary_normal_brush": True}, 50)]:
+			with self.subTest(**options):
+				partitions = self.get_partitions(data, partition_brushes=100, **options)
+				self.assertPartitioned(data, partitions)
+				self.assertLessEqual(max([len(triangles) for triangles in partitions]), max_triangles)
+				boxes = np.array([(centers.min(axis=0), centers.max(axis=0)) for centers in [self.get_centers(data, triangles) for triangles in partitions]])
+				for index in range(len(boxes)):
+					is_overlapping = np.all(np.maximum(boxes[index, 0], boxes[:, 0]) < np.minimum(boxes[index, 1], boxes[:, 1]), axis=1)
+					is_overlapping[index] = False
+					self.assertFalse(np.any(is_overlapping))
+
+	# partitions are entities of the object group with all brushes of the object
+	def test_entities(self):
+		text = get_jittered_grid(24, 0, 1.0)
+		output, partitioned_output = io.StringIO(), io.StringIO()
+		obj2map.convert(io.StringIO(text), output)
+		obj2map.convert(io.StringIO(text), partitioned_output, partition_brushes=100)
+		self.assertEqual(get_brush_count(partitioned_output.getvalue()), get_brush_count(output.getvalue()))
+		self.assertEqual(partitioned_output.getvalue().count('"classname" "func_group"'), output.getvalue().count('"classname" "func_group"') + 1)
+		self.assertGreater(partitioned_output.getvalue().count('"classname" "func_detail"'), 1)
+
+# separate triangles of three objects colored with noise around base colors, the last one with mixed colors
+def get_noisy_colors(base_colors, count, seed):
+	random = np.random.default_rng(seed)
+	lines = []
+	for index in range(count):
+		if index % (count // 3) == 0:
+			lines.append(f"o Scan{index // (count // 3)}")
+		color = np.clip(np.array(base_colors[index % len(base_colors)]) + random.uniform(-0.05, 0.05, 3), 0.0, 1.0)
+		for corner in [(0, 0, 0), (1, 0, 0), (0, 0, 1)]:
+			lines.append("v " + " ".join([f"{value:.6f}" for value in (np.array(corner) + index * 2).tolist() + color.tolist()]))
+		lines.append(f"f {index * 3 + 1} {index * 3 + 3} {index * 3 + 2}")
+	lines += ["v 0 5 0 1 0 0", "v 1 5 0 0 1 0", "v 0 5 1 0 0 1", f"f {count * 3 + 1} {count * 3 + 3} {count * 3 + 2}"]
+	return "\n".join(lines) + "\n"
+
+class ColorPaletteTest(unittest.TestCase):
+	# clusters of equal weights are split at their weighted medians, boxes get weighted mean colors
+	def test_median_cut(self):
+		clusters = [(200, 20, 20), (20, 200, 20), (20, 20, 200), (200, 200, 20)]
+		channels = np.array([(r + offset, g + offset, b) for r, g, b in clusters for offset in range(4)], dtype=np.int64)
+		weights = np.array([1, 1, 1, 5] * len(clusters), dtype=np.int64)
+		colors = obj2map.get_median_cut_colors(obj2map.pack_colors(channels), weights, len(clusters))
+		expected_colors = obj2map.pack_colors(np.array([(r + 2, g + 2, b) for r, g, b in clusters], dtype=np.int64))
+		self.assertEqual(colors.tolist(), np.repeat(expected_colors, 4).tolist())
+
+	# palettes are built for whole files, triangles with mixed vertex colors keep the default material
+	def test_max_color_materials(self):
+		text = get_noisy_colors([(0.8, 0.1, 0.1), (0.1, 0.8, 0.1), (0.1, 0.1, 0.8), (0.8, 0.8, 0.1)], 300, 0)
+		data = obj2map.load_scene(io.StringIO(text), vertex_color_materials=True)[0]
+		self.assertGreater(len(data["materials"]), 100)
+		data = obj2map.load_scene(io.StringIO(text), vertex_color_materials=True, max_color_materials=4)[0]
+		used_materials = np.unique(data["triangle_materials"])
+		self.assertEqual(len(used_materials), 5)
+		self.assertEqual(data["materials"][int(data["triangle_materials"][-1])], "")
+		self.assertEqual(len(np.unique(data["triangle_materials"][:-1:4])), 1)
+
+if __name__ == "__main__":
+	unittest.main()